@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+Compare edge call latency with and without hedging against a fake edge with a slow tail.
+
+    python -m benchmarks.bench_hedging --calls 200 --tail-probability 0.05 --tail-delay 3
+"""
+# Import necessary libraries
+import time
+import argparse
+import statistics
+from typing import List
+import requests
+from resilience import EdgeGuard
+from benchmarks.fakes import latency_distribution, start_fake_edge
+
+
+def run(guard: EdgeGuard, url: str, calls: int, hedge: bool) -> List[float]:
+    """
+    This function calls the fake edge repeatedly and returns the latency of each call.
+    """
+    latencies = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        guard.call(
+            url,
+            lambda timeout: requests.post(url, data={"color": "#C63D2B"}, timeout=timeout),
+            hedge=hedge,
+        )
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def report(name: str, latencies: List[float]) -> None:
+    """
+    This function prints the p50, p95 and p99 of a list of latencies.
+    """
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(
+        "{:<10} p50={:.3f}s p95={:.3f}s p99={:.3f}s max={:.3f}s".format(
+            name, quantiles[49], quantiles[94], quantiles[98], max(latencies)
+        )
+    )
+
+
+if __name__ == "__main__":
+    # Parse the benchmark settings from the command line
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--median", type=float, default=0.05)
+    parser.add_argument("--tail-probability", type=float, default=0.05)
+    parser.add_argument("--tail-delay", type=float, default=3.0)
+    args = parser.parse_args()
+
+    # Start a fake edge with a slow tail
+    server, base_url = start_fake_edge(
+        latency_distribution(
+            args.median, 0.3, args.tail_probability, args.tail_delay
+        )
+    )
+    url = base_url + "/lipstick"
+
+    # Measure the same traffic without and with hedging
+    report("plain", run(EdgeGuard(), url, args.calls, hedge=False))
+    guard = EdgeGuard(hedge_min_delay=0.05, hedge_budget_ratio=0.2)
+    report("hedged", run(guard, url, args.calls, hedge=True))
+    print(dict(guard.snapshot()[url]))
+
+    server.shutdown()
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+Compare classifying webhook bodies from their bytes with parsing every body as JSON.
+
+    python -m benchmarks.bench_ingest --number 200000
+"""
+# Import necessary libraries
+import json
+import timeit
+import argparse
+from ingest import routine_statuses
+
+
+def status_body(status: str) -> bytes:
+    """
+    This function builds a status callback shaped like the ones WhatsApp sends, serialized as it sends them.
+    """
+    value = {
+        "messaging_product": "whatsapp",
+        "metadata": {"display_phone_number": "15550000000", "phone_number_id": "1000"},
+        "statuses": [
+            {
+                "id": "wamid.HBgLMTU1NTEyMzQ1NjcVAgARGBI5QTNDQTVCM0Q0Q0Q2RTY3RTcA",
+                "status": status,
+                "timestamp": "1700000000",
+                "recipient_id": "15551234567",
+                "conversation": {"id": "0123456789abcdef0123456789abcdef", "origin": {"type": "service"}},
+                "pricing": {"billable": True, "pricing_model": "CBP", "category": "service"},
+            }
+        ],
+    }
+    body = {"object": "whatsapp_business_account", "entry": [{"id": "0", "changes": [{"value": value, "field": "messages"}]}]}
+    return json.dumps(body, separators=(",", ":")).encode()
+
+
+if __name__ == "__main__":
+    # Parse the number of iterations from the command line
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--number", type=int, default=200000)
+    args = parser.parse_args()
+
+    # Time both ways of telling a routine status callback from a body to process
+    print("{:<12} {:>12} {:>12} {:>8}".format("status", "json.loads", "byte scan", "speedup"))
+    for status in ("sent", "delivered", "read", "failed"):
+        raw = status_body(status)
+        parsed = timeit.timeit(lambda: "statuses" in json.loads(raw)["entry"][0]["changes"][0]["value"], number=args.number)
+        scanned = timeit.timeit(lambda: routine_statuses(raw), number=args.number)
+        print(
+            "{:<12} {:>10.2f}us {:>10.2f}us {:>7.1f}x".format(
+                status, parsed / args.number * 1e6, scanned / args.number * 1e6, parsed / scanned
+            )
+        )
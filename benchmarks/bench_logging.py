@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Measure what logging one message costs the thread handling it, before and after the logs go through a queue.
+
+    python -m benchmarks.bench_logging --messages 5000
+"""
+# Import necessary libraries
+import os
+import json
+import time
+import argparse
+import logging
+import logs
+
+
+def webhook_body(i: int) -> dict:
+    """
+    This function builds a webhook body shaped like the ones WhatsApp sends for a text message.
+    """
+    return {
+        "object": "whatsapp_business_account",
+        "entry": [
+            {
+                "id": "1234567890",
+                "changes": [
+                    {
+                        "field": "messages",
+                        "value": {
+                            "messaging_product": "whatsapp",
+                            "metadata": {"display_phone_number": "15550000000", "phone_number_id": "1000"},
+                            "contacts": [{"profile": {"name": "Ann"}, "wa_id": "15551234567"}],
+                            "messages": [
+                                {
+                                    "from": "15551234567",
+                                    "id": "wamid.{:032d}".format(i),
+                                    "timestamp": "1700000000",
+                                    "type": "text",
+                                    "text": {"body": "lip stick try-on"},
+                                }
+                            ],
+                        },
+                    }
+                ],
+            }
+        ],
+    }
+
+
+class FakeResponse:
+    # A response whose body is parsed on every call, like requests.Response.json
+    content = json.dumps({"messaging_product": "whatsapp", "messages": [{"id": "wamid.out"}]})
+
+    def json(self) -> dict:
+        return json.loads(self.content)
+
+
+def log_message_before(i: int, payloads: list, response: FakeResponse) -> None:
+    # Log a message the way the handlers did: every body, payload and response, formatted eagerly
+    logging.info("INCOMING BODY >>>>> {}".format(webhook_body(i)))
+    logging.info("LOWER TEXT >>>>> {}".format("lip stick try-on"))
+    logging.info("STRIPPED TEXT >>>>> {}".format("lip stick try-on"))
+    for _ in range(30):
+        logging.info("INSIDE THE FLOW...")
+    for payload in payloads:
+        logging.info("ABOUT TO SEND RESPONSE...")
+        logging.info("SENDING THIS DATA >>> {}".format(payload))
+        logging.info("RESPONSE FROM SERVER >>> {}".format(response.json()))
+        logging.info("MESSAGE SENT!")
+
+
+def log_message_after(i: int, payloads: list, response: FakeResponse) -> None:
+    # Log a message the way the handlers do now: lazy arguments, sampled payloads, routine steps at debug
+    logs.log_payload("INCOMING BODY >>>>> %s", logs.truncated(webhook_body(i)))
+    logging.debug("LOWER TEXT >>>>> %s", "lip stick try-on")
+    logging.debug("STRIPPED TEXT >>>>> %s", "lip stick try-on")
+    for payload in payloads:
+        logging.debug("ABOUT TO SEND RESPONSE...")
+        logs.log_payload("SENDING THIS DATA >>> %s", logs.truncated(payload))
+        logs.log_payload("RESPONSE FROM SERVER >>> %s", logs.Lazy(response.json))
+        logging.debug("MESSAGE SENT!")
+
+
+def run(log_message, messages: int) -> float:
+    """
+    This function logs many messages and returns the CPU time of the calling thread per message, in microseconds.
+    """
+    payloads = [json.dumps({"to": "15551234567", "type": "text", "text": {"body": "x" * 300}})] * 3
+    response = FakeResponse()
+    start = time.thread_time()
+    for i in range(messages):
+        log_message(i, payloads, response)
+    return (time.thread_time() - start) / messages * 1e6
+
+
+if __name__ == "__main__":
+    # Parse the benchmark settings from the command line
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--payload-sample-rate", type=float, default=0.01)
+    args = parser.parse_args()
+
+    # Write every record to the null device, so the numbers do not depend on the terminal
+    devnull = open(os.devnull, "w")
+    os.dup2(devnull.fileno(), 2)
+
+    # Log through a stream handler on the calling thread, as logging.basicConfig set it up
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    logging.basicConfig(level=logging.INFO)
+    before = run(log_message_before, args.messages)
+
+    # Log through the queue, with the payloads sampled
+    logs.setup_logging("INFO", payload_sample_rate=args.payload_sample_rate)
+    after = run(log_message_after, args.messages)
+
+    # Log through the queue as JSON, with every payload kept
+    logs.setup_logging("INFO", json_format=True, payload_sample_rate=1.0)
+    unsampled = run(log_message_after, args.messages)
+
+    print("before               {:.1f}us per message".format(before))
+    print("queued, sampled      {:.1f}us per message".format(after))
+    print("queued, all payloads {:.1f}us per message".format(unsampled))
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+Measure how often and how fast mistyped replies are matched to the option they meant.
+
+    python -m benchmarks.bench_matching --typos 2000 --edits 1
+"""
+# Import necessary libraries
+import time
+import random
+import difflib
+import argparse
+import statistics
+from typing import Callable, List, Optional, Tuple
+import services
+from catalog import BRANDS, SHADES
+from matcher import Matcher
+
+
+def misspell(text: str, edits: int, rng: random.Random) -> str:
+    """
+    This function applies random deletions, insertions, substitutions and transpositions to the letters of a text.
+    """
+    letters = list(text)
+    for _ in range(edits):
+        position = rng.randrange(len(letters))
+        edit = rng.choice("disx")
+        if edit == "d" and len(letters) > 1:
+            del letters[position]
+        elif edit == "i":
+            letters.insert(position, rng.choice("abcdefghijklmnopqrstuvwxyz"))
+        elif edit == "s":
+            letters[position] = rng.choice("abcdefghijklmnopqrstuvwxyz")
+        elif position + 1 < len(letters):
+            letters[position], letters[position + 1] = letters[position + 1], letters[position]
+    return "".join(letters)
+
+
+def corpus(typos: int, edits: int, seed: int) -> List[Tuple[str, Optional[str], str]]:
+    """
+    This function builds (typo, state, meant option) cases from the handler keywords, the greetings and the catalog.
+    The state is the category a brand is picked from, or the category and brand a shade is picked from.
+    """
+    rng = random.Random(seed)
+    index = services.catalog.index
+    options = [(phrase, None) for phrase in services.option_phrases]
+    options += [(entry.name, entry) for entry in index.entries if entry.level in (BRANDS, SHADES)]
+
+    cases = []
+    while len(cases) < typos:
+        phrase, entry = rng.choice(options)
+        typo = misspell(phrase, edits, rng)
+        if typo == phrase:
+            continue
+        cases.append((typo, entry, phrase))
+    return cases
+
+
+def run(
+    cases: List[Tuple[str, Optional[object], str]],
+    match: Callable[[str, Optional[object]], Optional[str]],
+) -> Tuple[float, float, List[float]]:
+    """
+    This function matches every case and returns the share matched correctly, the share matched wrongly and the latencies.
+    """
+    right = wrong = 0
+    latencies = []
+    for typo, entry, meant in cases:
+        start = time.perf_counter()
+        found = match(typo, entry)
+        latencies.append(time.perf_counter() - start)
+        # A typo that still contains a greeting routes as a greeting, whichever one it meant
+        if found == meant or (found in services.greetings and meant in services.greetings):
+            right += 1
+        elif found is not None:
+            wrong += 1
+    return right / len(cases), wrong / len(cases), latencies
+
+
+def report(name: str, right: float, wrong: float, latencies: List[float]) -> None:
+    """
+    This function prints the match rates and the p50 and p99 latency of a matcher.
+    """
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(
+        "{:<10} right={:.1%} wrong={:.1%} p50={:.1f}us p99={:.1f}us".format(
+            name, right, wrong, quantiles[49] * 1e6, quantiles[98] * 1e6
+        )
+    )
+
+
+def state_of(entry) -> List[str]:
+    # The last VTO type a user has when they are asked to pick the entry
+    if entry is None:
+        return []
+    if entry.level == BRANDS:
+        return [entry.category]
+    return [entry.category, entry.brand]
+
+
+def match_index(typo: str, entry) -> Optional[str]:
+    # Match a typo the way manage_chatbot does
+    services.last_vto_type["bench"] = state_of(entry)
+    correction = services.correct_text(typo, typo, "bench", services.catalog.index)
+    if correction is not None:
+        return correction[1]
+    return next((greeting for greeting in services.greetings if greeting in typo), None)
+
+
+def match_exact(typo: str, entry) -> Optional[str]:
+    # Typos never match an option as typed, unless they still contain a greeting
+    return next((greeting for greeting in services.greetings if greeting in typo), None)
+
+
+def match_difflib(typo: str, entry) -> Optional[str]:
+    # Match a typo with difflib over the same options, scanning all of them on every call
+    index = services.catalog.index
+    state = state_of(entry)
+    options = services.option_phrases
+    if len(state) == 1:
+        options = options + [index.entries[id].name for id in index.members[(BRANDS, state[0])]]
+    elif len(state) == 2:
+        options = options + [index.entries[id].name for id in index.members[(SHADES, tuple(state))]]
+    found = difflib.get_close_matches(typo, options, n=1, cutoff=0.8)
+    return found[0] if found else None
+
+
+if __name__ == "__main__":
+    # Parse the benchmark settings from the command line
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--typos", type=int, default=2000)
+    parser.add_argument("--edits", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    # Time building the matchers once
+    start = time.perf_counter()
+    Matcher(services.option_phrases)
+    print("build      {:.1f}ms".format((time.perf_counter() - start) * 1e3))
+
+    # Match the same typos with every matcher
+    cases = corpus(args.typos, args.edits, args.seed)
+    for name, match in (("as typed", match_exact), ("difflib", match_difflib), ("index", match_index)):
+        report(name, *run(cases, match))
+    services.last_vto_type.pop("bench", None)
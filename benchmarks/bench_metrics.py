@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Measure the cost of recording stage latencies, alone and from many threads at once.
+
+    python -m benchmarks.bench_metrics --observations 200000 --threads 8
+"""
+# Import necessary libraries
+import time
+import argparse
+import threading
+from metrics import Metrics
+
+
+def per_call(function, calls: int) -> float:
+    """
+    This function returns the mean time of a call of a function, in nanoseconds.
+    """
+    start = time.perf_counter()
+    for _ in range(calls):
+        function()
+    return (time.perf_counter() - start) / calls * 1e9
+
+
+if __name__ == "__main__":
+    # Parse the benchmark settings from the command line
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--observations", type=int, default=200000)
+    parser.add_argument("--threads", type=int, default=8)
+    args = parser.parse_args()
+    metrics = Metrics()
+
+    # Time a bare call, and the same call timed by each kind of instrumentation
+    def bare():
+        pass
+
+    timed = metrics.timed("decorated")(bare)
+
+    def with_timer():
+        with metrics.timer("timer"):
+            pass
+
+    baseline = per_call(bare, args.observations)
+    print("bare call  {:.0f}ns".format(baseline))
+    print("observe    {:.0f}ns".format(per_call(lambda: metrics.observe("observe", 0.003), args.observations) - baseline))
+    print("timer      {:.0f}ns".format(per_call(with_timer, args.observations) - baseline))
+    print("decorator  {:.0f}ns".format(per_call(timed, args.observations) - baseline))
+
+    # Record from many threads at once, which would contend on a shared lock
+    def record():
+        for _ in range(args.observations):
+            metrics.observe("threads", 0.003)
+
+    threads = [threading.Thread(target=record) for _ in range(args.threads)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    print(
+        "{} threads {:.0f}ns per observation".format(
+            args.threads, elapsed / (args.threads * args.observations) * 1e9
+        )
+    )
+
+    # Check nothing was lost, and time a scrape
+    count = metrics.snapshot()["stages"]["threads"]["count"]
+    print("recorded   {} of {}".format(count, args.threads * args.observations))
+    start = time.perf_counter()
+    metrics.render()
+    print("scrape     {:.2f}ms".format((time.perf_counter() - start) * 1e3))
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+Compare the prebuilt payload templates with building and serializing each static message per send.
+
+    python -m benchmarks.bench_payloads --number 200000
+"""
+# Import necessary libraries
+import timeit
+import argparse
+import services
+from payloads import PayloadTemplate
+
+# A recipient and a replied-to message ID shaped like WhatsApp's
+NUMBER = "15551234567"
+MESSAGE_ID = "wamid.HBgLMTU1NTEyMzQ1NjcVAgASGBQzQTk0RDM0MkQ2QUJDMjU0QjM4RgA="
+
+
+if __name__ == "__main__":
+    # Parse the number of iterations from the command line
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--number", type=int, default=200000)
+    args = parser.parse_args()
+
+    # Find every template defined in services
+    templates = {
+        name: value
+        for name, value in vars(services).items()
+        if isinstance(value, PayloadTemplate)
+    }
+
+    print("{:<25} {:>12} {:>12} {:>8}".format("payload", "builder", "template", "speedup"))
+    for name, template in sorted(templates.items()):
+        # Check that the template renders exactly what the builder returns
+        assert template.render(NUMBER, MESSAGE_ID) == template.build(NUMBER, MESSAGE_ID), name
+
+        # Time building the message per send against rendering the template
+        built = timeit.timeit(lambda: template.build(NUMBER, MESSAGE_ID), number=args.number)
+        rendered = timeit.timeit(lambda: template.render(NUMBER, MESSAGE_ID), number=args.number)
+        print(
+            "{:<25} {:>10.2f}us {:>10.2f}us {:>7.1f}x".format(
+                name,
+                built / args.number * 1e6,
+                rendered / args.number * 1e6,
+                built / rendered,
+            )
+        )
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+Measure the time and peak memory of rendering a recommendation PDF.
+
+    python -m benchmarks.bench_pdf --products 10 --renders 100
+"""
+# Import necessary libraries
+import time
+import argparse
+import tracemalloc
+from documents import RecommendationsPdf
+from benchmarks.fakes import SAMPLE_PRODUCTS
+
+
+if __name__ == "__main__":
+    # Parse the benchmark settings from the command line
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--products", type=int, default=10)
+    parser.add_argument("--renders", type=int, default=100)
+    parser.add_argument("--spool-max-bytes", type=int, default=1024 * 1024)
+    args = parser.parse_args()
+
+    # Repeat the sample products up to the requested count
+    products = [
+        SAMPLE_PRODUCTS[i % len(SAMPLE_PRODUCTS)] for i in range(args.products)
+    ]
+
+    # Time setting up the fonts and styles, which happens once per process
+    start = time.perf_counter()
+    layout = RecommendationsPdf(spool_max_size=args.spool_max_bytes)
+    print("setup   {:.2f}ms".format((time.perf_counter() - start) * 1e3))
+
+    # Time rendering the same products repeatedly
+    layout.render(products).close()
+    start = time.perf_counter()
+    for _ in range(args.renders):
+        layout.render(products).close()
+    print("render  {:.2f}ms".format((time.perf_counter() - start) / args.renders * 1e3))
+
+    # Measure the peak memory and size of one document
+    tracemalloc.start()
+    with layout.render(products) as pdf_file:
+        peak = tracemalloc.get_traced_memory()[1]
+        size = len(pdf_file.read())
+        on_disk = pdf_file._rolled
+    tracemalloc.stop()
+    print("peak    {:.0f}KB, document {:.0f}KB, on disk: {}".format(peak / 1024, size / 1024, on_disk))
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""
+Time the message builders and the routing of services.py against a stored baseline, flagging regressions.
+
+Sends are collected instead of posted and any other network call fails the benchmark, so only the code that runs on
+every message is timed. Each benchmark is timed over several repeats of enough calls to take a tenth of a second, and
+the median time per call is compared with the baseline's median. A benchmark only counts as slower when its median is
+slower by the threshold and by at least an absolute floor, since the fastest benchmarks jitter by more than the
+threshold on an unchanged tree:
+
+    python -m benchmarks.bench_services --save        # store the baseline
+    python -m benchmarks.bench_services               # compare with it, exiting with 1 on a regression
+    python -m benchmarks.bench_services --threshold 0.1 --only route
+"""
+# Import necessary libraries
+import os
+import sys
+import json
+import timeit
+import argparse
+import platform
+import statistics
+from typing import Callable, Dict, List
+import services
+
+# The default baseline, kept next to the benchmark
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "bench_services.json")
+
+# A recipient and a replied-to message ID shaped like WhatsApp's
+NUMBER = "15551234567"
+MESSAGE_ID = "wamid.HBgLMTU1NTEyMzQ1NjcVAgASGBQzQTk0RDM0MkQ2QUJDMjU0QjM4RgA="
+NUMBER_ID = "1000"
+
+# The messages WhatsApp delivers, one of each type the handlers read
+MESSAGES = {
+    "text": {"type": "text", "text": {"body": "hi"}},
+    "image": {"type": "image", "image": {"id": "1234567890"}},
+    "button": {"type": "button", "button": {"text": "Yes, please."}},
+    "list_reply": {"type": "interactive", "interactive": {"type": "list_reply", "list_reply": {"title": "😀 Face"}}},
+    "button_reply": {
+        "type": "interactive",
+        "interactive": {"type": "button_reply", "button_reply": {"title": "💄 Product Recs"}},
+    },
+}
+
+# The replies routed by manage_chatbot: menu taps, a greeting, a typo to correct and text no handler takes
+ROUTES = {
+    "greeting": "Hi",
+    "product recs": "💄 Product Recs",
+    "face": "😀 Face",
+    "foundation": "🎨 Foundation",
+    "lip stick try-on": "💋 Lip Stick Try-On",
+    "typo": "lip stik try-on",
+    "unmatched": "what should I wear to a wedding tonight?",
+}
+
+
+class NetworkCalled(Exception):
+    # Raised when a benchmark reaches the network, which would make its timings meaningless
+    pass
+
+
+def stub_network(sent: List[str]) -> None:
+    """
+    This function collects the messages services would send, skips the pings that prewarm the edges, and fails any
+    other request it would make.
+
+    Parameters:
+    sent (List[str]): The list the sent messages are appended to.
+    """
+
+    def send(data: str, *args):
+        sent.append(data)
+        return "message sent!", 200
+
+    def refuse(*args, **kwargs):
+        raise NetworkCalled("network call from a benchmark: {}".format(args[:1]))
+
+    services.send_whatsapp_message = send
+    services.keep_warm.prewarm = lambda url: None
+    for name in ("get", "post", "put", "delete", "request"):
+        setattr(services.requests, name, refuse)
+
+
+def benchmarks(sent: List[str]) -> Dict[str, Callable[[], object]]:
+    """
+    This function lists the benchmarks by name, each a function making one call of the code it times.
+
+    Parameters:
+    sent (List[str]): The list the sent messages are appended to, emptied by each routing call.
+
+    Returns:
+    Dict[str, Callable[[], object]]: The benchmarks.
+    """
+    options = ["💄 Product Recs", "🪞 Try-On", "🔁 Start Over"]
+    rows = ["🎨 Foundation", "🙈 Concealer", "💎 Setting Powder", "🌟 Skin Tint", "🧴 Bronzer"]
+    cases = {
+        "text_message": lambda: services.text_message(NUMBER, "Here are your recommendations."),
+        "button_reply_message": lambda: services.button_reply_message(
+            NUMBER, options, "How may I help?", services.footer_text, "intro", MESSAGE_ID
+        ),
+        "list_reply_message": lambda: services.list_reply_message(
+            NUMBER, rows, "Which feature first?", services.footer_text, "face", MESSAGE_ID
+        ),
+        "image_message": lambda: services.image_message(NUMBER, "1234567890"),
+        "mark_read_message": lambda: services.mark_read_message(MESSAGE_ID),
+        "remove_emoji_and_strip": lambda: services.remove_emoji_and_strip("💋 lip stick try-on"),
+    }
+    for kind, message in MESSAGES.items():
+        cases["get_whatsapp_message:" + kind] = lambda message=message: services.get_whatsapp_message(message)
+
+    def route(text: str) -> None:
+        # Route the reply through every handler check, then drop what it would have sent
+        services.manage_chatbot(text, NUMBER, MESSAGE_ID, "Ann", NUMBER_ID)
+        sent.clear()
+
+    for name, text in ROUTES.items():
+        cases["route:" + name] = lambda text=text: route(text)
+    return cases
+
+
+def measure(function: Callable[[], object], repeats: int) -> Dict[str, float]:
+    """
+    This function times a function over several repeats, each of enough calls to take at least 0.1 seconds.
+
+    Parameters:
+    function (Callable[[], object]): The function to time.
+    repeats (int): The number of repeats.
+
+    Returns:
+    Dict[str, float]: The median, minimum and standard deviation of the time per call, in microseconds, and the calls per repeat.
+    """
+    timer = timeit.Timer(function)
+    loops, _ = timer.autorange()
+    times = [elapsed / loops * 1e6 for elapsed in timer.repeat(repeat=repeats, number=loops)]
+    return {
+        "median": statistics.median(times),
+        "min": min(times),
+        "stdev": statistics.stdev(times) if len(times) > 1 else 0.0,
+        "loops": loops,
+    }
+
+
+def compare(
+    results: Dict[str, Dict[str, float]],
+    baseline: Dict[str, Dict[str, float]],
+    threshold: float,
+    min_change: float = 0.2,
+) -> List[str]:
+    """
+    This function prints the results next to the baseline and returns the benchmarks that slowed down beyond the threshold.
+
+    Parameters:
+    results (Dict[str, Dict[str, float]]): The timings of this run.
+    baseline (Dict[str, Dict[str, float]]): The stored timings, which may lack some benchmarks.
+    threshold (float): The slowdown of the median tolerated, as a fraction.
+    min_change (float, optional): The slowdown in microseconds below which no benchmark is flagged. Defaults to 0.2.
+
+    Returns:
+    List[str]: The names of the benchmarks that regressed.
+    """
+    regressions = []
+    print("{:<34} {:>10} {:>10} {:>9}".format("benchmark", "baseline", "median", "change"))
+    for name, result in results.items():
+        if name not in baseline:
+            print("{:<34} {:>10} {:>8.2f}us {:>9}".format(name, "-", result["median"], "new"))
+            continue
+        change = result["median"] / baseline[name]["median"] - 1
+        flag = ""
+        if change > threshold and result["median"] - baseline[name]["median"] >= min_change:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(
+            "{:<34} {:>8.2f}us {:>8.2f}us {:>+8.1%}{}".format(
+                name, baseline[name]["median"], result["median"], change, flag
+            )
+        )
+    return regressions
+
+
+if __name__ == "__main__":
+    # Parse the benchmark settings from the command line
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--baseline", default=BASELINE, help="the JSON file holding the baseline timings")
+    parser.add_argument("--save", action="store_true", help="store this run as the baseline instead of comparing")
+    parser.add_argument("--threshold", type=float, default=0.2, help="the slowdown flagged as a regression, as a fraction")
+    parser.add_argument("--min-change", type=float, default=0.2, help="the slowdown in microseconds below which nothing is flagged")
+    parser.add_argument("--repeats", type=int, default=15)
+    parser.add_argument("--only", help="run only the benchmarks whose name contains this text")
+    args = parser.parse_args()
+
+    # Keep the benchmarks off the network
+    sent: List[str] = []
+    stub_network(sent)
+
+    # Time every benchmark, after one call to warm its caches
+    results = {}
+    for name, function in benchmarks(sent).items():
+        if args.only and args.only not in name:
+            continue
+        function()
+        results[name] = measure(function, args.repeats)
+
+    # Store the results as the baseline
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, "w") as baseline_file:
+            json.dump(
+                {"python": platform.python_version(), "machine": platform.machine(), "results": results},
+                baseline_file,
+                indent=2,
+                sort_keys=True,
+            )
+        for name, result in results.items():
+            print("{:<34} {:>8.2f}us (min {:.2f}us, stdev {:.2f}us)".format(name, result["median"], result["min"], result["stdev"]))
+        print("baseline stored in {}".format(args.baseline))
+        sys.exit(0)
+
+    # Compare the results with the baseline, failing on a regression
+    if not os.path.exists(args.baseline):
+        sys.exit("no baseline in {}; store one with --save".format(args.baseline))
+    with open(args.baseline) as baseline_file:
+        baseline = json.load(baseline_file)
+    if baseline.get("python") != platform.python_version():
+        print("baseline was stored with Python {}".format(baseline.get("python")), file=sys.stderr)
+    regressions = compare(results, baseline["results"], args.threshold, args.min_change)
+    if regressions:
+        print("{} regressed by more than {:.0%}: {}".format(len(regressions), args.threshold, ", ".join(regressions)))
+        sys.exit(1)
@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+"""
+Local stand-ins for the external services, with configurable latency distributions.
+
+Run a fake edge, Graph API or Vertex endpoint on its own with:
+
+    python -m benchmarks.fakes --port 8081 --median 0.4 --tail-probability 0.05 --tail-delay 6
+    python -m benchmarks.fakes --fake graph --port 8082 --median 0.15
+"""
+# Import necessary libraries
+import json
+import time
+import base64
+import random
+import argparse
+import threading
+import collections
+from io import BytesIO
+from urllib.parse import urlsplit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Tuple
+from PIL import Image
+
+
+def latency_distribution(
+    median: float = 0.4,
+    sigma: float = 0.5,
+    tail_probability: float = 0.0,
+    tail_delay: float = 0.0,
+) -> Callable[[], float]:
+    """
+    This function creates a latency distribution: log-normal around a median, with an optional slow tail such as a dyno cold start.
+
+    Parameters:
+    median (float, optional): The median latency in seconds. Defaults to 0.4.
+    sigma (float, optional): The spread of the log-normal distribution. Defaults to 0.5.
+    tail_probability (float, optional): The probability of a request hitting the slow tail. Defaults to 0.
+    tail_delay (float, optional): The extra delay in seconds of a request in the slow tail. Defaults to 0.
+
+    Returns:
+    Callable[[], float]: A function that samples a latency in seconds.
+    """
+
+    def sample() -> float:
+        delay = random.lognormvariate(0, sigma) * median if median > 0 else 0.0
+        if random.random() < tail_probability:
+            delay += tail_delay
+        return delay
+
+    return sample
+
+
+def _sample_image() -> str:
+    # Encode a small JPEG as base64, as the try-on edges return it
+    image_bytes = BytesIO()
+    Image.new("RGB", (64, 64), "#C63D2B").save(image_bytes, format="JPEG")
+    return base64.b64encode(image_bytes.getvalue()).decode()
+
+
+def _sample_selfie() -> bytes:
+    # Encode a selfie-sized JPEG, as the WhatsApp media download returns it
+    image_bytes = BytesIO()
+    Image.new("RGB", (720, 960), "#8D5524").save(image_bytes, format="JPEG")
+    return image_bytes.getvalue()
+
+
+# Build the responses once, so the fakes only cost their configured latency
+SAMPLE_IMAGE = _sample_image()
+SAMPLE_SELFIE = _sample_selfie()
+SAMPLE_PRODUCTS = [
+    {
+        "Company": "Brand {}".format(i % 2),
+        "Foundation": "Foundation {}".format(i),
+        "Shade": "Shade {}".format(i),
+        "Price": "$3{}.00".format(i),
+        "ProductURL": "https://example.com/products/{}".format(i),
+        "VideoTutorial": "https://example.com/tutorials/{}".format(i),
+    }
+    for i in range(12)
+]
+
+
+class FakeEdgeHandler(BaseHTTPRequestHandler):
+    """
+    This class answers like the try-on and recommendation edges: try-on paths return a base64 image, the others return a product list.
+    """
+
+    # The latency distribution of the server, set by start_fake_edge
+    latency = staticmethod(latency_distribution(median=0))
+
+    # The paths that answer with a try-on image
+    image_paths = ("/hairdye", "/lipstick", "/lipliner", "/api/hair")
+
+    def do_POST(self) -> None:
+        # Read the request body, then wait for the sampled latency
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(self.latency())
+
+        # Answer with an image or with product recommendations
+        if self.path.startswith(self.image_paths):
+            body = {"b64": SAMPLE_IMAGE}
+        else:
+            body = SAMPLE_PRODUCTS
+        self._send_json(body)
+
+    def do_GET(self) -> None:
+        # Answer pings, such as keep-warm requests
+        time.sleep(self.latency())
+        self._send_json({"status": "ok"})
+
+    def _send_json(self, body) -> None:
+        # Send the body as a JSON response
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format: str, *args) -> None:
+        # Keep the fakes quiet
+        pass
+
+
+class FakeGraphHandler(FakeEdgeHandler):
+    """
+    This class answers like the WhatsApp Cloud API: sending messages, uploading media, and looking up and downloading
+    the media users send. It counts the requests of each kind.
+    """
+
+    # The number of requests of each kind, shared by every fake Graph API server
+    counts = collections.Counter()
+
+    def do_POST(self) -> None:
+        # Read the request body, then wait for the sampled latency
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(self.latency())
+
+        # Answer message sends and media uploads
+        path = urlsplit(self.path).path
+        if path.endswith("/messages"):
+            self.counts["messages"] += 1
+            self._send_json(
+                {"messaging_product": "whatsapp", "messages": [{"id": "wamid.out.{}".format(self.counts["messages"])}]}
+            )
+        elif path.endswith("/media"):
+            self.counts["uploads"] += 1
+            self._send_json({"id": str(900000 + self.counts["uploads"])})
+        else:
+            self.send_error(404)
+
+    def do_GET(self) -> None:
+        # Wait for the sampled latency
+        time.sleep(self.latency())
+
+        # Answer media downloads with a selfie, and media lookups with the URL to download it from
+        path = urlsplit(self.path).path
+        if path.startswith("/files/"):
+            self.counts["downloads"] += 1
+            self.send_response(200)
+            self.send_header("Content-Type", "image/jpeg")
+            self.send_header("Content-Length", str(len(SAMPLE_SELFIE)))
+            self.end_headers()
+            self.wfile.write(SAMPLE_SELFIE)
+        else:
+            self.counts["lookups"] += 1
+            host = self.headers.get("Host", "127.0.0.1")
+            self._send_json({"url": "http://{}/files{}".format(host, path), "mime_type": "image/jpeg"})
+
+
+class FakeVertexHandler(FakeEdgeHandler):
+    """
+    This class answers like a Vertex AI endpoint serving Llama 2, at the REST predict path.
+    """
+
+    def do_POST(self) -> None:
+        # Read the instances, then wait for the sampled latency
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        time.sleep(self.latency())
+
+        # Answer every instance with a canned completion, echoing the prompt as the model does
+        if not urlsplit(self.path).path.endswith(":predict"):
+            self.send_error(404)
+            return
+        predictions = [
+            "Prompt:\n{}\nOutput:\nTry a satin finish with a hydrating primer.".format(instance.get("prompt", ""))
+            for instance in body.get("instances", [])
+        ]
+        self._send_json({"predictions": predictions, "deployedModelId": "fake"})
+
+
+def start_server(
+    handler: type, latency: Callable[[], float], port: int = 0
+) -> Tuple[ThreadingHTTPServer, str]:
+    """
+    This function starts a fake server in a daemon thread.
+
+    Parameters:
+    handler (type): The request handler class of the fake.
+    latency (Callable[[], float]): The latency distribution of the fake.
+    port (int, optional): The port to listen on. Defaults to 0, which picks a free port.
+
+    Returns:
+    Tuple[ThreadingHTTPServer, str]: The server and its base URL.
+    """
+    # Give the handler its own latency distribution
+    handler = type(handler.__name__, (handler,), {"latency": staticmethod(latency)})
+
+    # Serve requests in a daemon thread
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server, "http://127.0.0.1:{}".format(server.server_port)
+
+
+def start_fake_edge(
+    latency: Callable[[], float], port: int = 0
+) -> Tuple[ThreadingHTTPServer, str]:
+    """
+    This function starts a fake try-on and recommendation edge.
+
+    Returns:
+    Tuple[ThreadingHTTPServer, str]: The server and its base URL.
+    """
+    return start_server(FakeEdgeHandler, latency, port)
+
+
+def start_fake_graph(
+    latency: Callable[[], float], port: int = 0
+) -> Tuple[ThreadingHTTPServer, str]:
+    """
+    This function starts a fake WhatsApp Cloud API.
+
+    Returns:
+    Tuple[ThreadingHTTPServer, str]: The server and its base URL.
+    """
+    return start_server(FakeGraphHandler, latency, port)
+
+
+def start_fake_vertex(
+    latency: Callable[[], float], port: int = 0
+) -> Tuple[ThreadingHTTPServer, str]:
+    """
+    This function starts a fake Vertex AI endpoint.
+
+    Returns:
+    Tuple[ThreadingHTTPServer, str]: The server and its base URL.
+    """
+    return start_server(FakeVertexHandler, latency, port)
+
+
+# The fakes that can be run on their own
+FAKES = {"edge": start_fake_edge, "graph": start_fake_graph, "vertex": start_fake_vertex}
+
+
+if __name__ == "__main__":
+    # Parse the latency settings from the command line
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--fake", choices=sorted(FAKES), default="edge")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--median", type=float, default=0.4)
+    parser.add_argument("--sigma", type=float, default=0.5)
+    parser.add_argument("--tail-probability", type=float, default=0.0)
+    parser.add_argument("--tail-delay", type=float, default=0.0)
+    args = parser.parse_args()
+
+    # Serve the fake until interrupted
+    server, url = FAKES[args.fake](
+        latency_distribution(
+            args.median, args.sigma, args.tail_probability, args.tail_delay
+        ),
+        args.port,
+    )
+    print("Fake {} listening on {}".format(args.fake, url))
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+"""
+Replay webhook traffic against server.app with local stand-ins for WhatsApp, the edges and Vertex AI.
+
+Every external call goes to a fake with its own latency distribution. The report covers throughput, the p50, p95 and
+p99 of every stage, taken from a trace of every message, and the growth of the process memory.
+
+    python -m benchmarks.loadtest --users 4 --edge-median 0.3 --graph-median 0.1
+    python -m benchmarks.loadtest --traffic /tmp/aiysha_requests.jsonl --speed 10
+    python -m benchmarks.loadtest --traffic /tmp/aiysha_requests.jsonl --speed 0 --direct
+"""
+# Import necessary libraries
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import statistics
+import configparser
+from urllib.parse import urlsplit
+from typing import Dict, Iterable, List, Optional, Tuple
+from capture import capture_files, read_capture, replay as replay_bodies
+from benchmarks.fakes import latency_distribution, start_fake_edge, start_fake_graph, start_fake_vertex, FakeGraphHandler
+
+# The directory of the application, which holds config.ini and options.json
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The phone number ID the fake WhatsApp account sends from
+NUMBER_ID = "1000"
+
+
+def webhook_body(number: str, message_id: str, message: Dict) -> Dict:
+    """
+    This function wraps a message in a webhook body shaped like the ones WhatsApp sends.
+
+    Parameters:
+    number (str): The phone number of the sender.
+    message_id (str): The ID of the message.
+    message (Dict): The type and content of the message, such as {"type": "text", "text": {"body": "hello"}}.
+
+    Returns:
+    Dict: The webhook body.
+    """
+    message = dict(message, **{"from": number, "id": message_id, "timestamp": str(int(time.time()))})
+    value = {
+        "messaging_product": "whatsapp",
+        "metadata": {"display_phone_number": "15550000000", "phone_number_id": NUMBER_ID},
+        "contacts": [{"profile": {"name": "Load Test"}, "wa_id": number}],
+        "messages": [message],
+    }
+    return {"object": "whatsapp_business_account", "entry": [{"id": "0", "changes": [{"field": "messages", "value": value}]}]}
+
+
+def text(body: str) -> Dict:
+    # A text message, as typed or as the title of a tapped reply
+    return {"type": "text", "text": {"body": body}}
+
+
+def selfie(media_id: int) -> Dict:
+    # An image message, which the handlers read as the media ID
+    return {"type": "image", "image": {"id": str(media_id), "mime_type": "image/jpeg"}}
+
+
+def conversations(users: int, seed: int) -> List[List[Dict]]:
+    """
+    This function scripts one conversation per user, tapping the buttons of the menus as a user would, alternating
+    between a lipstick try-on and foundation recommendations, with brands and shades picked at random from the catalog.
+
+    Parameters:
+    users (int): The number of users.
+    seed (int): The seed of the random picks.
+
+    Returns:
+    List[List[Dict]]: The messages of each user, in order.
+    """
+    import services
+    from catalog import BRANDS, SHADES
+
+    rng = random.Random(seed)
+    index = services.catalog.index
+    brands = [index.entries[id].name for id in index.members[(BRANDS, "lip stick try-on")]]
+    scripts = []
+    for user in range(users):
+        if user % 2 == 0:
+            brand = rng.choice(brands)
+            shades = [index.entries[id].name for id in index.members[(SHADES, ("lip stick try-on", brand))]]
+            script = [
+                text("hello"),
+                text("🪞 Try-On"),
+                text("👄 Lips"),
+                text("💋 Lip Stick Try-On"),
+                text(brand),
+                text(rng.choice(shades)),
+                selfie(user),
+            ]
+        else:
+            script = [
+                text("hello"),
+                text("💄 Product Recs"),
+                text("😀 Face"),
+                text("🎨 Foundation"),
+                selfie(user),
+                text("Brand 0"),
+            ]
+        scripts.append(script)
+    return scripts
+
+
+def synthetic_traffic(users: int, seed: int) -> List[Tuple[Optional[float], Dict]]:
+    """
+    This function interleaves the users' conversations into webhook bodies: the first message of every user, then the
+    second, and so on, so each user's messages stay in order.
+
+    Returns:
+    List[Tuple[Optional[float], Dict]]: The webhook bodies, without arrival times.
+    """
+    scripts = conversations(users, seed)
+    traffic = []
+    for step in range(max(len(script) for script in scripts)):
+        for user, script in enumerate(scripts):
+            if step < len(script):
+                number = "1555{:07d}".format(user)
+                message_id = "wamid.load.{}.{}".format(user, step)
+                traffic.append((None, webhook_body(number, message_id, script[step])))
+    return traffic
+
+
+def recorded_traffic(paths: Iterable[str]) -> List[Tuple[Optional[float], Dict]]:
+    """
+    This function reads recorded webhook traffic, such as a capture written by capture.Recorder with its rotated
+    files. Each line holds either a webhook body or {"time": arrival time, "body": webhook body}; the older
+    {"at": seconds since the recording started, "body": webhook body} is read as well.
+
+    Parameters:
+    paths (Iterable[str]): The recordings, each read after the files it was rotated into.
+
+    Returns:
+    List[Tuple[Optional[float], Dict]]: The arrival times in seconds since the first one, if recorded, and the webhook bodies.
+    """
+    files = []
+    for path in paths:
+        path = path if os.path.isabs(path) else os.path.join(ROOT, path)
+        files.extend(capture_files(path) or [path])
+    return list(read_capture(files))
+
+
+def write_config(directory: str, edge_url: str) -> None:
+    """
+    This function writes the config.ini of the load test: the edges point at the fake edge, every message is traced
+    into the directory, keep-warm is off and only warnings are logged. Everything else is as configured.
+    """
+    config = configparser.ConfigParser()
+    config.read(os.path.join(ROOT, "config.ini"))
+    for name, url in config["url"].items():
+        config["url"][name] = edge_url + urlsplit(url).path
+    settings = {
+        "warmup": {"enabled": "false"},
+        "media": {"registry_path": os.path.join(directory, "media_registry.jsonl")},
+        "tracing": {"enabled": "true", "sample_rate": "1.0", "path": os.path.join(directory, "traces.jsonl"), "collector_url": ""},
+        "logging": {"level": "WARNING"},
+    }
+    for section, values in settings.items():
+        if not config.has_section(section):
+            config.add_section(section)
+        config[section].update(values)
+    with open(os.path.join(directory, "config.ini"), "w") as config_file:
+        config.write(config_file)
+    os.symlink(os.path.join(ROOT, "options.json"), os.path.join(directory, "options.json"))
+
+
+def rss() -> float:
+    """
+    This function returns the resident memory of the process, in megabytes.
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, AttributeError):
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def replay(client, traffic: List[Tuple[Optional[float], Dict]], rate: float, speed: float) -> float:
+    """
+    This function posts the webhook bodies to the application, at their recorded times divided by the speed, at a fixed
+    rate, or as fast as possible.
+
+    Returns:
+    float: The time the first body was posted, from time.perf_counter.
+    """
+
+    def post(body: Dict) -> None:
+        # Post the body as WhatsApp would
+        response = client.post("/webhook", json=body)
+        if response.status_code != 200:
+            print("webhook answered {}".format(response.status_code), file=sys.stderr)
+
+    start = time.perf_counter()
+    replay_bodies(traffic, post, speed, rate)
+    return start
+
+
+def replay_direct(traffic: List[Tuple[Optional[float], Dict]], process_request) -> float:
+    """
+    This function hands the webhook bodies straight to the request processor, one at a time and in order, so every
+    run of the same traffic takes the same path through the handlers.
+
+    Returns:
+    float: The time the first body was processed, from time.perf_counter.
+    """
+    start = time.perf_counter()
+    replay_bodies(traffic, process_request, speed=0)
+    return start
+
+
+def stage_latencies(path: str) -> Dict[str, List[float]]:
+    """
+    This function reads the exported spans and groups their durations, in seconds, by stage.
+    The root span of each message is reported as the "end to end" stage.
+    """
+    stages: Dict[str, List[float]] = {}
+    if not os.path.exists(path):
+        return stages
+    with open(path) as trace_file:
+        for line in trace_file:
+            span = json.loads(line)
+            name = span["name"] if "parentId" in span else "end to end"
+            stages.setdefault(name, []).append(span["duration"] / 1e6)
+    return stages
+
+
+def report(stages: Dict[str, List[float]]) -> None:
+    """
+    This function prints the count, p50, p95 and p99 of every stage, slowest p99 first.
+    """
+    rows = []
+    for name, latencies in stages.items():
+        if len(latencies) > 1:
+            quantiles = statistics.quantiles(latencies, n=100, method="inclusive")
+            rows.append((name, len(latencies), quantiles[49], quantiles[94], quantiles[98]))
+        else:
+            rows.append((name, 1, latencies[0], latencies[0], latencies[0]))
+    print("{:<32} {:>6} {:>9} {:>9} {:>9}".format("stage", "count", "p50", "p95", "p99"))
+    for name, count, p50, p95, p99 in sorted(rows, key=lambda row: -row[4]):
+        print("{:<32} {:>6} {:>8.3f}s {:>8.3f}s {:>8.3f}s".format(name, count, p50, p95, p99))
+
+
+def parse_args(argv: Optional[Iterable[str]] = None) -> argparse.Namespace:
+    # Parse the load test settings from the command line
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=4, help="users with a scripted conversation each")
+    parser.add_argument("--traffic", nargs="+", help="replay recorded webhook bodies from these JSON lines files instead")
+    parser.add_argument("--rate", type=float, default=0.0, help="webhook posts per second, 0 for as fast as possible")
+    parser.add_argument("--speed", type=float, default=1.0, help="speed-up of recorded arrival times, 0 for as fast as possible")
+    parser.add_argument(
+        "--direct", action="store_true", help="process the bodies one at a time in order, bypassing the webhook and its queue"
+    )
+    parser.add_argument("--edge-median", type=float, default=0.3)
+    parser.add_argument("--edge-tail-probability", type=float, default=0.0)
+    parser.add_argument("--edge-tail-delay", type=float, default=0.0)
+    parser.add_argument("--graph-median", type=float, default=0.1)
+    parser.add_argument("--vertex-median", type=float, default=1.0)
+    parser.add_argument("--sigma", type=float, default=0.3)
+    parser.add_argument("--seed", type=int, default=7)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    random.seed(args.seed)
+
+    # Start the stand-ins for the external services
+    _, edge_url = start_fake_edge(
+        latency_distribution(args.edge_median, args.sigma, args.edge_tail_probability, args.edge_tail_delay)
+    )
+    _, graph_url = start_fake_graph(latency_distribution(args.graph_median, args.sigma))
+    _, vertex_url = start_fake_vertex(latency_distribution(args.vertex_median, args.sigma))
+
+    # Point the application at them
+    os.environ.update(
+        APP_TOKEN="load-test",
+        WHATSAPP_TOKEN="load-test",
+        WHATSAPP_URL_PROD="{}/{}/messages".format(graph_url, NUMBER_ID),
+        WHATSAPP_URL_DEV="{}/{}/messages".format(graph_url, NUMBER_ID),
+        WHATSAPP_MEDIA_URL=graph_url,
+        VERTEX_EMULATOR_HOST=urlsplit(vertex_url).netloc,
+        PROJECT="load-test",
+        LOCATION="local",
+        ENDPOINT_ID="llama",
+    )
+    os.environ.pop("WHATSAPP_NUMBER_ID", None)
+
+    # Run the application from a directory holding the load test's config.ini
+    directory = tempfile.mkdtemp(prefix="aiysha-loadtest-")
+    write_config(directory, edge_url)
+    sys.path.insert(0, ROOT)
+    os.chdir(directory)
+    memory_before_import = rss()
+    import server
+    import services
+
+    # Build or read the traffic
+    if args.traffic:
+        traffic = recorded_traffic(args.traffic)
+    else:
+        traffic = synthetic_traffic(args.users, args.seed)
+
+    # Replay it and wait for every message to be handled
+    client = server.app.test_client()
+    memory_before = rss()
+    if args.direct:
+        start = replay_direct(traffic, server.process_request)
+    else:
+        start = replay(client, traffic, args.rate, args.speed)
+    posted = time.perf_counter()
+    server.request_queue.join()
+    elapsed = time.perf_counter() - start
+    services.tracer.flush()
+    memory_after = rss()
+
+    # Report the throughput, the stage latencies and the memory
+    print("messages    {} in {:.1f}s ({:.1f}s to post)".format(len(traffic), elapsed, posted - start))
+    print("throughput  {:.2f} messages/s".format(len(traffic) / elapsed))
+    print(
+        "graph API   {} sends, {} uploads, {} media lookups, {} downloads".format(
+            *(FakeGraphHandler.counts[kind] for kind in ("messages", "uploads", "lookups", "downloads"))
+        )
+    )
+    print(
+        "memory      {:.0f}MB before import, {:.0f}MB before replay, {:.0f}MB after (+{:.1f}MB)".format(
+            memory_before_import, memory_before, memory_after, memory_after - memory_before
+        )
+    )
+    print()
+    report(stage_latencies(os.path.join(directory, "traces.jsonl")))
+    print()
+    print("traces in {}".format(os.path.join(directory, "traces.jsonl")))
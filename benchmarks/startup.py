@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Measure how long a fresh process takes to import server, and what the warm-up request loads on top of it.
+
+Each run starts a new interpreter in the application directory, as an App Engine instance does on a cold start, so
+nothing is cached in the process. The slowest imports of the last run are listed from python -X importtime.
+
+    python -m benchmarks.startup --runs 5
+"""
+# Import necessary libraries
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+from typing import Dict, List, Tuple
+
+# The directory of the application, which holds config.ini and options.json
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The script each run executes: import the server, then warm it up, timing both
+SCRIPT = """
+import json, time
+start = time.perf_counter()
+import server
+imported = time.perf_counter()
+timings = server.services.warm_up()
+warmed = time.perf_counter()
+print(json.dumps({"import": imported - start, "warm_up": warmed - imported, "parts": timings}))
+"""
+
+
+def run(importtime: bool = False) -> Tuple[Dict, str]:
+    """
+    This function imports and warms up the server in a new interpreter.
+
+    Parameters:
+    importtime (bool, optional): Whether to trace the imports with python -X importtime. Defaults to False.
+
+    Returns:
+    Tuple[Dict, str]: The timings of the run, and the import trace if asked for.
+    """
+    env = dict(os.environ)
+    env.setdefault("APP_TOKEN", "startup-benchmark")
+    command = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", SCRIPT]
+    result = subprocess.run(command, cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1]), result.stderr
+
+
+def slowest_imports(trace: str, limit: int) -> List[Tuple[int, str]]:
+    """
+    This function reads an import trace and returns the top-level imports of the server that took the longest.
+
+    Parameters:
+    trace (str): The output of python -X importtime.
+    limit (int): The number of imports to return.
+
+    Returns:
+    List[Tuple[int, str]]: The cumulative microseconds and name of each import, slowest first.
+    """
+    imports = []
+    for line in trace.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if cumulative.strip().isdigit() and len(name) - len(name.lstrip()) <= 3:
+            imports.append((int(cumulative), name.strip()))
+    return sorted(imports, reverse=True)[:limit]
+
+
+if __name__ == "__main__":
+    # Parse the benchmark settings from the command line
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=12, help="the number of slowest imports to list")
+    args = parser.parse_args()
+
+    # Start the server in fresh interpreters
+    runs = [run()[0] for _ in range(args.runs)]
+    print("import server  median {:.3f}s  min {:.3f}s".format(
+        statistics.median(r["import"] for r in runs), min(r["import"] for r in runs)
+    ))
+    print("warm-up        median {:.3f}s  min {:.3f}s".format(
+        statistics.median(r["warm_up"] for r in runs), min(r["warm_up"] for r in runs)
+    ))
+    for part in runs[0]["parts"]:
+        print("  {:<12} median {:.3f}s".format(part, statistics.median(r["parts"][part] for r in runs)))
+
+    # List the slowest imports of the server and its warm-up
+    _, trace = run(importtime=True)
+    print()
+    print("slowest imports, the warm-up's included")
+    for cumulative, name in slowest_imports(trace, args.top):
+        print("  {:>8.1f}ms  {}".format(cumulative / 1000, name))
@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+# Import necessary libraries
+import os
+import json
+import time
+import queue
+import hashlib
+import logging
+import threading
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Set up logging with INFO level
+logging.basicConfig(level=logging.INFO)
+
+# The keys of a webhook body that hold phone numbers
+PHONE_KEYS = ("from", "wa_id", "recipient_id", "display_phone_number")
+
+
+def hash_number(number: str, salt: str = "") -> str:
+    """
+    This function replaces a phone number with a stable pseudonym of the same shape, so a captured user keeps one
+    number across their messages without the capture revealing it.
+
+    Parameters:
+    number (str): The phone number.
+    salt (str, optional): A secret mixed into the hash, so pseudonyms cannot be reversed by hashing every number. Defaults to "".
+
+    Returns:
+    str: Twelve digits derived from the number.
+    """
+    digest = hashlib.sha256((salt + str(number)).encode("utf-8")).hexdigest()
+    return "{:012d}".format(int(digest[:15], 16) % 10**12)
+
+
+def sanitize(value: Any, salt: str = "") -> Any:
+    """
+    This function copies a webhook body with its phone numbers hashed and its contact names replaced by pseudonyms.
+    Message contents are kept, since they decide how a replayed message is routed.
+
+    Parameters:
+    value (Any): The webhook body, or a part of it.
+    salt (str, optional): The secret mixed into the hashes. Defaults to "".
+
+    Returns:
+    Any: The sanitized copy.
+    """
+    if isinstance(value, dict):
+        sanitized = {}
+        for key, item in value.items():
+            if key in PHONE_KEYS and isinstance(item, (str, int)):
+                sanitized[key] = hash_number(item, salt)
+            elif key == "profile" and isinstance(item, dict):
+                sanitized[key] = dict(item, name="user")
+            else:
+                sanitized[key] = sanitize(item, salt)
+        return sanitized
+    if isinstance(value, list):
+        return [sanitize(item, salt) for item in value]
+    return value
+
+
+class Recorder:
+    """
+    This class captures webhook bodies to a JSON lines file, one {"time": arrival time, "body": sanitized body} per line.
+
+    Recording a body only puts it on a queue. A background thread sanitizes, serializes and writes the bodies through a
+    buffered file, flushing it every interval, and rotates the file when it grows past a size, keeping a number of
+    older files as path.1, path.2 and so on. Bodies are dropped when the queue is full, so capturing never slows the
+    webhook down.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_bytes: int = 50 * 1024 * 1024,
+        backups: int = 5,
+        salt: str = "",
+        flush_interval: float = 1.0,
+        max_queue: int = 10000,
+    ) -> None:
+        """
+        Parameters:
+        path (str): The path of the capture.
+        max_bytes (int, optional): The size past which the capture is rotated. Defaults to 50MB.
+        backups (int, optional): The number of rotated captures kept. Defaults to 5.
+        salt (str, optional): The secret mixed into the hashes of the phone numbers. Defaults to "".
+        flush_interval (float, optional): How often the buffered lines are written out, in seconds. Defaults to 1.
+        max_queue (int, optional): The maximum number of bodies waiting to be written. Defaults to 10000.
+        """
+        # Store the settings of the recorder
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.salt = salt
+        self.flush_interval = flush_interval
+
+        # Queue the bodies for the writer thread, which starts with the first body
+        self._queue: "queue.Queue[Tuple[float, Dict]]" = queue.Queue(max_queue)
+        self._writer = None
+        self._lock = threading.Lock()
+        self.recorded = 0
+        self.dropped = 0
+
+    def record(self, body: Dict) -> None:
+        """
+        This function queues a webhook body for capture. The body must not be changed afterwards.
+        """
+        try:
+            self._queue.put_nowait((time.time(), body))
+        except queue.Full:
+            self.dropped += 1
+            return
+
+        # Start the writer thread with the first body
+        if self._writer is None:
+            with self._lock:
+                if self._writer is None:
+                    self._writer = threading.Thread(target=self.run, name="capture", daemon=True)
+                    self._writer.start()
+
+    def run(self) -> None:
+        """
+        This function writes the queued bodies to the capture, indefinitely.
+        """
+        capture_file = None
+        while True:
+            # Wait for a body, flushing the buffered lines whenever the queue runs dry for an interval
+            try:
+                arrival, body = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                if capture_file is not None:
+                    capture_file.flush()
+                continue
+
+            try:
+                # Rotate the capture once it is full
+                if capture_file is not None and capture_file.tell() >= self.max_bytes:
+                    capture_file.close()
+                    capture_file = None
+                    self._rotate()
+
+                # Write the sanitized body as one line
+                if capture_file is None:
+                    capture_file = open(self.path, "a", buffering=64 * 1024)
+                line = json.dumps({"time": arrival, "body": sanitize(body, self.salt)}, ensure_ascii=False)
+                capture_file.write(line + "\n")
+                self.recorded += 1
+            except (OSError, TypeError, ValueError) as e:
+                logging.error(f"Error occurred while capturing a webhook body: {e}")
+            finally:
+                self._queue.task_done()
+
+            # Write the lines out when nothing else is waiting, so a quiet capture is up to date
+            if capture_file is not None and self._queue.empty():
+                capture_file.flush()
+
+    def flush(self) -> None:
+        """
+        This function waits until every queued body has been written.
+        """
+        self._queue.join()
+
+    def _rotate(self) -> None:
+        # Shift the older captures up by one, dropping the oldest, and move the full capture to path.1
+        for number in range(self.backups - 1, 0, -1):
+            older = "{}.{}".format(self.path, number)
+            if os.path.exists(older):
+                os.replace(older, "{}.{}".format(self.path, number + 1))
+        if self.backups > 0:
+            os.replace(self.path, self.path + ".1")
+        else:
+            os.remove(self.path)
+
+
+def capture_files(path: str) -> List[str]:
+    """
+    This function lists a capture and its rotated files, oldest first.
+
+    Parameters:
+    path (str): The path of the capture.
+
+    Returns:
+    List[str]: The paths of the files that exist.
+    """
+    rotated = []
+    number = 1
+    while os.path.exists("{}.{}".format(path, number)):
+        rotated.append("{}.{}".format(path, number))
+        number += 1
+    return list(reversed(rotated)) + ([path] if os.path.exists(path) else [])
+
+
+def read_capture(paths: Iterable[str]) -> Iterator[Tuple[Optional[float], Dict]]:
+    """
+    This function reads captured webhook bodies with their arrival times, in seconds since the first one.
+    Lines holding a bare webhook body are read without an arrival time.
+
+    Parameters:
+    paths (Iterable[str]): The capture files, in the order they were written.
+
+    Returns:
+    Iterator[Tuple[Optional[float], Dict]]: The arrival time, if captured, and the body of each request.
+    """
+    first = None
+    for path in paths:
+        with open(path) as capture_file:
+            for line in capture_file:
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Skip a line cut short by a crash
+                    continue
+                if "entry" in record:
+                    yield None, record
+                    continue
+                arrival = record.get("time", record.get("at"))
+                if arrival is not None:
+                    first = arrival if first is None else first
+                    arrival -= first
+                yield arrival, record["body"]
+
+
+def restamp(value: Any, now: int) -> Any:
+    """
+    This function copies a webhook body with the timestamps of its messages and statuses set to a given time, so a
+    replayed message counts as just sent, as it did when it was captured.
+
+    Parameters:
+    value (Any): The webhook body, or a part of it.
+    now (int): The Unix time to set.
+
+    Returns:
+    Any: The restamped copy.
+    """
+    if isinstance(value, dict):
+        return {
+            key: str(now) if key == "timestamp" and isinstance(item, (str, int)) else restamp(item, now)
+            for key, item in value.items()
+        }
+    if isinstance(value, list):
+        return [restamp(item, now) for item in value]
+    return value
+
+
+def replay(
+    records: Iterable[Tuple[Optional[float], Dict]],
+    submit: Callable[[Dict], Any],
+    speed: float = 1.0,
+    rate: float = 0.0,
+    restamp_bodies: bool = True,
+) -> int:
+    """
+    This function feeds captured bodies to the application in their captured order.
+
+    Parameters:
+    records (Iterable[Tuple[Optional[float], Dict]]): The arrival times and bodies, as read by read_capture.
+    submit (Callable[[Dict], Any]): A function that hands a body to the application.
+    speed (float, optional): How much faster than captured the bodies arrive, or 0 for as fast as possible. Defaults to 1.
+    rate (float, optional): The bodies per second of records without arrival times, or 0 for as fast as possible. Defaults to 0.
+    restamp_bodies (bool, optional): Whether the timestamps of the messages are set to the time they are submitted, so
+    the customer service windows of the users are open as they were when captured. Defaults to True.
+
+    Returns:
+    int: The number of bodies submitted.
+    """
+    start = time.perf_counter()
+    count = 0
+    for arrival, body in records:
+        # Wait until the body is due
+        if arrival is not None and speed > 0:
+            due = start + arrival / speed
+        elif arrival is None and rate > 0:
+            due = start + count / rate
+        else:
+            due = start
+        delay = due - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+        submit(restamp(body, int(time.time())) if restamp_bodies else body)
+        count += 1
+    return count
@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+# Import necessary libraries
+import os
+import sys
+import json
+import time
+import bisect
+import logging
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from matcher import Matcher, tokens, word_starts
+
+# Set up logging with INFO level
+logging.basicConfig(level=logging.INFO)
+
+# The levels of the catalog menus
+BRANDS = "brands"
+SHADES = "shades"
+STYLES = "styles"
+
+
+
+class Entry:
+    """
+    This class is one option of the catalog: a brand of a category, a shade of a brand, or a hair style.
+    Its strings are interned, so the many entries that share a category or brand share one string object.
+    """
+
+    __slots__ = ("id", "level", "category", "brand", "name", "title", "code", "words")
+
+    def __init__(
+        self,
+        id: int,
+        level: str,
+        category: str,
+        brand: Optional[str],
+        name: str,
+        code: Optional[str],
+    ) -> None:
+        self.id = id
+        self.level = level
+        self.category = sys.intern(category)
+        self.brand = sys.intern(brand) if brand is not None else None
+        self.name = sys.intern(name)
+        self.title = name.title()
+        self.code = code
+
+        # Count the distinct words of the name, to tell when a reply mentions all of them
+        self.words = len(set(tokens(name)))
+
+    @property
+    def menu(self) -> Tuple[str, Any]:
+        # The (level, key) of the menu the entry is listed in
+        if self.level == SHADES:
+            return (SHADES, (self.category, self.brand))
+        return (self.level, self.category)
+
+    def __repr__(self) -> str:
+        return "Entry({}, {!r}, {!r}, {!r})".format(self.id, self.category, self.brand, self.name)
+
+
+class CatalogIndex:
+    """
+    This class is an immutable snapshot of the try-on catalog in options.json, indexed once so handlers do not walk it per message.
+
+    Every brand, shade and style is an Entry with an integer ID. Entries are reachable through a hash index on
+    (category, brand, shade), the entries of each menu, a word index for finding the option a free-text reply mentions,
+    a sorted list of names for prefix lookups and matchers for typo-tolerant lookups. Shade names that repeat
+    across brands are distinct entries, so a lookup is always scoped to a brand.
+
+    It also holds the titled option list and the prebuilt payload of every menu (the brands of a category, the shades
+    of a brand, the styles).
+    """
+
+    def __init__(
+        self,
+        feats: Dict[str, Dict[str, Any]],
+        build_menu: Callable[[str, Any, List[str]], Any],
+        previous: Optional["CatalogIndex"] = None,
+    ) -> None:
+        """
+        Parameters:
+        feats (Dict[str, Dict[str, Any]]): The catalog as loaded from options.json.
+        build_menu (Callable[[str, Any, List[str]], Any]): A function that builds the menu payload of a level, key and option list.
+        previous (Optional[CatalogIndex], optional): The previous snapshot, whose menus are reused where the options did not change.
+        """
+        self.feats = feats
+
+        # Every entry, where the ID of an entry is its position
+        self.entries: List[Entry] = []
+
+        # Map each (category, brand, shade) to an entry ID. Brands are (category, brand, None) and styles (category, None, style)
+        self.ids: Dict[Tuple[str, Optional[str], Optional[str]], int] = {}
+
+        # Map each menu (level, key) to the IDs of its entries, in catalog order, and to its lower-cased titles
+        self.members: Dict[Tuple[str, Any], List[int]] = {}
+        self._titles: Dict[Tuple[str, Any], Dict[str, int]] = {}
+
+        # Map each menu to an index from the words of its options to their entry IDs
+        self._words: Dict[Tuple[str, Any], Dict[str, List[int]]] = {}
+
+        for category, values in feats.items():
+            if all(isinstance(value, dict) for value in values.values()):
+                # A category of brands, each with its shades and their hex codes
+                for brand, shades in values.items():
+                    self._add(BRANDS, category, None, brand, None)
+                    for shade, code in shades.items():
+                        self._add(SHADES, category, brand, shade, code)
+            else:
+                # A category of styles and their style codes
+                for style, code in values.items():
+                    self._add(STYLES, category, None, style, code)
+
+        # Sort the names of each level for prefix lookups, from the start of every word so "scar" finds "822 scarlet silk"
+        self._sorted: Dict[str, List[Tuple[str, int]]] = {}
+        for entry in self.entries:
+            names = self._sorted.setdefault(entry.level, [])
+            name = entry.name.lower()
+            for start in word_starts(name):
+                names.append((name[start:], entry.id))
+        for names in self._sorted.values():
+            names.sort()
+
+        # The matchers are built on the first typo-tolerant lookup of each menu or level
+        self._matchers: Dict[Any, Matcher] = {}
+
+        # Keep the titled options of each menu and build the menus, reusing the previous payloads whose options did not change
+        self.options: Dict[Tuple[str, Any], List[str]] = {
+            menu: [self.entries[id].title for id in ids] for menu, ids in self.members.items()
+        }
+        self.menus: Dict[Tuple[str, Any], Any] = {}
+        self.rebuilt = 0
+        for menu, options in self.options.items():
+            if previous is not None and previous.options.get(menu) == options:
+                self.menus[menu] = previous.menus[menu]
+            else:
+                self.menus[menu] = build_menu(menu[0], menu[1], options)
+                self.rebuilt += 1
+
+    def _add(self, level: str, category: str, brand: Optional[str], name: str, code: Optional[str]) -> None:
+        # Create the entry and add it to the hash index
+        entry = Entry(len(self.entries), level, category, brand, name, code)
+        self.entries.append(entry)
+        if level == BRANDS:
+            self.ids[(entry.category, entry.name, None)] = entry.id
+        elif level == SHADES:
+            self.ids[(entry.category, entry.brand, entry.name)] = entry.id
+        else:
+            self.ids[(entry.category, None, entry.name)] = entry.id
+
+        # Add the entry to its menu and the word index of the menu
+        menu = entry.menu
+        self.members.setdefault(menu, []).append(entry.id)
+        self._titles.setdefault(menu, {})[entry.title.lower()] = entry.id
+        words = self._words.setdefault(menu, {})
+        for word in set(tokens(name)):
+            words.setdefault(word, []).append(entry.id)
+
+    def get(self, category: str, brand: Optional[str] = None, name: Optional[str] = None) -> Optional[Entry]:
+        """
+        This function looks up an entry by its catalog keys: (category, brand) for a brand, (category, brand, shade)
+        for a shade and (category, None, style) for a style.
+
+        Returns:
+        Optional[Entry]: The entry, or None if it is not in the catalog.
+        """
+        id = self.ids.get((category, brand, name))
+        return self.entries[id] if id is not None else None
+
+    def codes(self, category: str, brand: str) -> Dict[str, str]:
+        """
+        This function returns the hex color code of every shade of a brand.
+
+        Returns:
+        Dict[str, str]: A dictionary mapping each shade name to its hex color code.
+        """
+        entries = self.entries
+        return {
+            entries[id].name: entries[id].code
+            for id in self.members.get((SHADES, (category, brand)), ())
+        }
+
+    def find(self, level: str, key: Any, text: str) -> Optional[Entry]:
+        """
+        This function finds the option of a menu that a reply refers to. A reply matches an option if it is the option,
+        or if it contains all the words of the option, in which case the option with the most words wins.
+
+        Parameters:
+        level (str): The level of the menu: brands, shades or styles.
+        key (Any): The category of a brands or styles menu, or the (category, brand) of a shades menu.
+        text (str): The reply of the user.
+
+        Returns:
+        Optional[Entry]: The matching entry, or None if the reply does not mention an option of the menu.
+        """
+        menu = (level, key)
+        titles = self._titles.get(menu)
+        if titles is None:
+            return None
+
+        # Look the reply up as a whole first
+        id = titles.get(text.lower().strip())
+        if id is not None:
+            return self.entries[id]
+
+        # Otherwise count the words of each option that appear in the reply
+        words = self._words[menu]
+        found: Dict[int, int] = {}
+        for word in set(tokens(text)):
+            for id in words.get(word, ()):
+                found[id] = found.get(id, 0) + 1
+
+        # Keep the options whose words all appear, preferring the most specific one
+        best = None
+        for id, count in found.items():
+            entry = self.entries[id]
+            if count == entry.words and (best is None or count > best[0]):
+                best = (count, entry)
+        return best[1] if best is not None else None
+
+    def prefix(self, level: str, text: str, key: Any = None, limit: int = 10) -> List[Entry]:
+        """
+        This function finds the entries of a level with a word in their names that starts with a prefix, in alphabetical order.
+
+        Parameters:
+        level (str): The level of the entries: brands, shades or styles.
+        text (str): The prefix.
+        key (Any, optional): The key of a menu to restrict the results to. Defaults to the whole level.
+        limit (int, optional): The maximum number of results. Defaults to 10.
+
+        Returns:
+        List[Entry]: The matching entries.
+        """
+        names = self._sorted.get(level, [])
+        text = text.lower().strip()
+        results = {}
+        position = bisect.bisect_left(names, (text, -1))
+        while position < len(names) and len(results) < limit:
+            name, id = names[position]
+            if not name.startswith(text):
+                break
+            entry = self.entries[id]
+            if key is None or entry.menu == (level, key):
+                results[id] = entry
+            position += 1
+        return list(results.values())
+
+    def fuzzy(
+        self, level: str, text: str, key: Any = None, limit: int = 1, min_score: float = 0.75
+    ) -> List[Tuple[float, Entry]]:
+        """
+        This function finds the entries of a level whose names are most similar to a possibly misspelled text.
+
+        Parameters:
+        level (str): The level of the entries: brands, shades or styles.
+        text (str): The text to match.
+        key (Any, optional): The key of a menu to restrict the results to. Defaults to the whole level.
+        limit (int, optional): The maximum number of results. Defaults to 1.
+        min_score (float, optional): The minimum similarity of a result, between 0 and 1. Defaults to 0.75.
+
+        Returns:
+        List[Tuple[float, Entry]]: The (score, entry) of the results, best first.
+        """
+        # Build the matcher of the menu or level the first time it is searched
+        scope = (level, key) if key is not None else level
+        matcher = self._matchers.get(scope)
+        if matcher is None:
+            matcher = Matcher()
+            if key is not None:
+                ids = self.members.get(scope, [])
+            else:
+                ids = [entry.id for entry in self.entries if entry.level == level]
+            for id in ids:
+                matcher.add(self.entries[id].name, self.entries[id])
+            self._matchers[scope] = matcher
+
+        return matcher.search(text, limit, min_score)
+
+
+class Catalog:
+    """
+    This class loads options.json into a CatalogIndex and swaps in a new snapshot when the file changes, so catalog updates do not need a redeploy.
+    Readers take `catalog.index` once and use that snapshot for the whole message.
+    """
+
+    def __init__(self, path: str, build_menu: Callable[[str, Any, List[str]], Any]) -> None:
+        # Store the path and the menu builder, then load the catalog
+        self.path = path
+        self.build_menu = build_menu
+        self._mtime = None
+        self.index: Optional[CatalogIndex] = None
+        self.reload()
+
+    def reload(self) -> bool:
+        """
+        This function reloads the catalog if options.json changed since it was last loaded.
+
+        Returns:
+        bool: True if a new snapshot was swapped in, False otherwise.
+        """
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime == self._mtime:
+            return False
+
+        # Load the file and index it, reusing the menus that did not change
+        with open(self.path) as f:
+            feats = json.load(f)
+        index = CatalogIndex(feats, self.build_menu, self.index)
+
+        # Swap in the new snapshot
+        self.index = index
+        self._mtime = mtime
+        logging.info(
+            "Loaded catalog from {} ({} menus rebuilt)".format(self.path, index.rebuilt)
+        )
+        return True
+
+    def watch(self, interval: float = 30.0) -> None:
+        """
+        This function checks options.json for changes indefinitely. It is meant to run in a daemon thread.
+        """
+        while True:
+            time.sleep(interval)
+            try:
+                self.reload()
+            except Exception as e:
+                # Keep the current snapshot if the file is missing or invalid
+                logging.error(f"Error occurred while reloading the catalog: {e}")
@@ -51,4 +51,6 @@ all_image_options = face_options + cheeks_options + body_options
 
 hair_color_options = ["color try-on"]
 lips_options = ["lip stick try-on", "lip liner try-on"]
-plus_color_options = hair_color_options + lips_options
\ No newline at end of file
+plus_color_options = hair_color_options + lips_options
+
+compare_shades_option = "compare shades"
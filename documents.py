@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+# Import necessary libraries
+import json
+import hashlib
+import threading
+import collections
+from tempfile import SpooledTemporaryFile
+from typing import IO, Dict, List, Optional, Tuple
+
+# The parts of reportlab the documents use, imported on first use, since most instances never render a PDF
+canvas = simpleSplit = stringWidth = None
+
+# The US letter page size in points, as reportlab.lib.pagesizes.letter
+LETTER = (612.0, 792.0)
+
+# The product fields listed above the price, in order, and their labels
+PRODUCT_FIELDS = (
+    ("Foundation", "Foundation"),
+    ("Concealer", "Concealer"),
+    ("Shoe", "Shoe"),
+    ("Shade", "Shade"),
+    ("Price", "Price"),
+)
+
+# The product links, and their labels
+PRODUCT_LINKS = (("ProductURL", "Buy"), ("VideoTutorial", "Tutorial"))
+
+
+def load_reportlab() -> None:
+    """
+    This function imports the parts of reportlab the documents use, once.
+    """
+    global canvas, simpleSplit, stringWidth
+    if canvas is None:
+        from reportlab.lib.utils import simpleSplit
+        from reportlab.pdfbase.pdfmetrics import stringWidth
+        from reportlab.pdfgen import canvas
+
+
+def _printable(value: str) -> str:
+    # The standard PDF fonts only have Latin-1 glyphs, so drop emojis and other characters they would draw as boxes
+    return str(value).encode("latin-1", "ignore").decode("latin-1").strip()
+
+
+class RecommendationsPdf:
+    """
+    This class lays out product recommendations as a PDF document, one block per product, as many blocks per page as fit.
+
+    The fonts, font metrics and column widths are set up once, before the first document, and reused by every
+    document. Each document is written
+    straight into a spooled temporary file, which stays in memory unless it grows past a threshold, so it can be
+    uploaded without a copy or a temporary file on disk.
+    """
+
+    def __init__(
+        self,
+        spool_max_size: int = 1024 * 1024,
+        pagesize: Tuple[float, float] = LETTER,
+        margin: float = 50.0,
+        font: str = "Helvetica",
+        bold_font: str = "Helvetica-Bold",
+        font_size: float = 11.0,
+        title_size: float = 18.0,
+    ) -> None:
+        # Store the page settings
+        self.spool_max_size = spool_max_size
+        self.width, self.height = pagesize
+        self.pagesize = pagesize
+        self.margin = margin
+        self.font = font
+        self.bold_font = bold_font
+        self.font_size = font_size
+        self.title_size = title_size
+        self.leading = font_size * 1.35
+        self.block_gap = font_size * 1.6
+
+        # The column widths, measured before the first document
+        self.label_width: Optional[float] = None
+        self.value_width: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def warm(self) -> None:
+        """
+        This function loads reportlab and measures the labels, which also loads the metrics of both fonts, once.
+        Rendering the first document does it if it has not been done.
+        """
+        if self.value_width is not None:
+            return
+        with self._lock:
+            if self.value_width is not None:
+                return
+            load_reportlab()
+            labels = [label for _, label in PRODUCT_FIELDS + PRODUCT_LINKS]
+            label_width = max(stringWidth(label + ":", self.bold_font, self.font_size) for label in labels) + 8
+            stringWidth("AIySha", self.font, self.font_size)
+            self.label_width = label_width
+            self.value_width = self.width - 2 * self.margin - label_width
+
+    def _wrap(self, value: str) -> List[str]:
+        # Wrap a value to the value column, breaking words too long for it, such as links, where they overflow
+        lines = []
+        for line in simpleSplit(value, self.font, self.font_size, self.value_width) or [value]:
+            while len(line) > 1 and stringWidth(line, self.font, self.font_size) > self.value_width:
+                low, high = 1, len(line) - 1
+                while low < high:
+                    middle = (low + high + 1) // 2
+                    if stringWidth(line[:middle], self.font, self.font_size) <= self.value_width:
+                        low = middle
+                    else:
+                        high = middle - 1
+                lines.append(line[:low])
+                line = line[low:]
+            lines.append(line)
+        return lines
+
+    def _block(self, product: Dict[str, str]) -> List[Tuple[str, str, Optional[str]]]:
+        # Lay out the lines of a product as (label, text, link), wrapping long values under their label
+        lines = []
+        for fields, is_link in ((PRODUCT_FIELDS, False), (PRODUCT_LINKS, True)):
+            for key, label in fields:
+                value = _printable(product.get(key, ""))
+                if not value:
+                    continue
+                wrapped = self._wrap(value)
+                link = value if is_link else None
+                lines.append((label + ":", wrapped[0], link))
+                lines.extend(("", line, link) for line in wrapped[1:])
+        return lines
+
+    def render(self, products: List[Dict[str, str]], title: str = "Your Recommendations") -> IO[bytes]:
+        """
+        This function lays out product recommendations as a PDF document.
+
+        Parameters:
+        products (List[Dict[str, str]]): A list of dictionaries where each dictionary contains product information.
+        title (str, optional): The title at the top of every page. Defaults to "Your Recommendations".
+
+        Returns:
+        IO[bytes]: A spooled temporary file holding the PDF document, rewound to its start. The caller closes it.
+        """
+        self.warm()
+        pdf_file = SpooledTemporaryFile(max_size=self.spool_max_size)
+        c = canvas.Canvas(pdf_file, pagesize=self.pagesize)
+        c.setTitle(title)
+        top = self.height - self.margin
+        bottom = self.margin
+        left = self.margin
+        page = 0
+
+        def start_page() -> float:
+            # Draw the title and page number, and return where the first block starts
+            nonlocal page
+            page += 1
+            c.setFont(self.bold_font, self.title_size)
+            c.drawString(left, top - self.title_size, _printable(title))
+            c.setFont(self.font, self.font_size - 2)
+            c.drawRightString(self.width - self.margin, top - self.title_size, "Page {}".format(page))
+            return top - self.title_size - self.block_gap * 1.5
+
+        y = first = start_page()
+        for number, product in enumerate(products, start=1):
+            lines = self._block(product)
+            height = (len(lines) + 1) * self.leading
+
+            # Move the product to a new page if it does not fit on this one, unless the page is empty
+            if y - height < bottom and y < first:
+                c.showPage()
+                y = start_page()
+
+            # Draw the product heading
+            c.setFont(self.bold_font, self.font_size + 1)
+            heading = _printable(product.get("Company", "")) or "Product"
+            c.drawString(left, y, "{}. {}".format(number, heading))
+            y -= self.leading
+
+            # Draw the fields and links, making the links clickable
+            for label, text, link in lines:
+                if label:
+                    c.setFont(self.bold_font, self.font_size)
+                    c.drawString(left, y, label)
+                c.setFont(self.font, self.font_size)
+                if link:
+                    c.setFillColorRGB(0.1, 0.3, 0.8)
+                    c.drawString(left + self.label_width, y, text)
+                    c.linkURL(
+                        link,
+                        (left + self.label_width, y - 2, self.width - self.margin, y + self.font_size),
+                        relative=0,
+                    )
+                    c.setFillColorRGB(0, 0, 0)
+                else:
+                    c.drawString(left + self.label_width, y, text)
+                y -= self.leading
+
+            # Separate the products with a rule
+            y -= self.block_gap / 2
+            c.setStrokeColorRGB(0.85, 0.85, 0.85)
+            c.line(left, y + self.leading / 2, self.width - self.margin, y + self.leading / 2)
+            y -= self.block_gap / 2
+
+        # Write the document into the spooled file and rewind it for reading
+        c.save()
+        pdf_file.seek(0)
+        return pdf_file
+
+
+class PdfCache:
+    """
+    This class caches recommendation PDFs by the products they list, so the same products are rendered once.
+
+    The key is a hash of the product list only. The recipient's name goes into the filename of the document message,
+    not into the document, so users who get the same products share an entry, and the same bytes map to the same
+    uploaded media ID. Entries are evicted least recently used first.
+    """
+
+    def __init__(self, max_entries: int = 128) -> None:
+        # Store the limit of the cache
+        self.max_entries = max_entries
+
+        # Map each key to its PDF bytes, oldest first
+        self._entries: "collections.OrderedDict[str, bytes]" = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(products: List[Dict[str, str]]) -> str:
+        """
+        This function hashes a product list into a cache key, independent of the order of each product's fields.
+
+        Returns:
+        str: The hex digest of the product list.
+        """
+        data = json.dumps(products, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        This function returns the cached PDF of a key.
+
+        Returns:
+        Optional[bytes]: The PDF bytes, or None if they are not cached.
+        """
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                # Mark the entry as recently used
+                self._entries.move_to_end(key)
+            return data
+
+    def put(self, key: str, data: bytes) -> None:
+        """
+        This function stores a rendered PDF, evicting the least recently used entries when full.
+        """
+        with self._lock:
+            self._entries[key] = data
+            self._entries.move_to_end(key)
+
+            # Evict the oldest entries above the limit
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# Import necessary libraries
+import re
+from typing import List, Optional
+
+# The markers of a status callback, as WhatsApp serializes it; "messages" is also the value of every change's "field"
+STATUSES_KEY = b'"statuses"'
+MESSAGES_KEY = re.compile(rb'"messages"\s*:')
+STATUS_PATTERN = re.compile(rb'"status"\s*:\s*"([a-z_]+)"')
+
+# The statuses reported under their own names; any other value is reported as "other", so a body cannot create counters
+KNOWN_STATUSES = {b"sent": "sent", b"delivered": "delivered", b"read": "read", b"deleted": "deleted"}
+
+
+def routine_statuses(raw: bytes) -> Optional[List[str]]:
+    """
+    This function classifies a webhook body from its bytes, without parsing it: a status callback that only reports
+    messages as sent, delivered or read needs no processing, unlike messages and failed deliveries.
+
+    A text a user sends that mentions "statuses" is escaped inside the body and has its own "messages" key, so it is
+    never taken for a status callback.
+
+    Parameters:
+    raw (bytes): The body of the webhook request.
+
+    Returns:
+    Optional[List[str]]: The statuses reported, each sent, delivered, read, deleted or other, if the body is a status
+    callback needing no processing, or None if the body has to be parsed and processed.
+    """
+    # Process anything that is not purely a status callback
+    if STATUSES_KEY not in raw or MESSAGES_KEY.search(raw) is not None:
+        return None
+
+    # Process failed deliveries, and callbacks whose statuses cannot be read from the bytes
+    statuses = STATUS_PATTERN.findall(raw)
+    if not statuses or b"failed" in statuses:
+        return None
+    return [KNOWN_STATUSES.get(status, "other") for status in statuses]
@@ -1,7 +1,9 @@
-from google.cloud import aiplatform
 import os
+import requests
 import logging
+import threading
 from dotenv import load_dotenv
+from metrics import metrics
 
 load_dotenv()
 
@@ -11,6 +13,7 @@ PROJECT = os.getenv("PROJECT")
 ENDPOINT_ID = os.getenv("ENDPOINT_ID")
 LOCATION = os.getenv("LOCATION")
 API_ENDPOINT = os.getenv("API_ENDPOINT")
+VERTEX_EMULATOR_HOST = os.getenv("VERTEX_EMULATOR_HOST")
 
 SYSTEM_PROMPT = """<s>[INST]
 <<SYS>>
@@ -20,16 +23,42 @@ Your responses are ALWAYS CLEAR AND CONCISE. If you do not have a response, just
 <</SYS>>
 """
 
+# The prediction client, created on first use: importing aiplatform is the slowest part of a cold start
+_client = None
+_client_lock = threading.Lock()
+
+def get_prediction_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from google.cloud import aiplatform
+
+                client_options = {"api_endpoint": API_ENDPOINT}
+                _client = aiplatform.gapic.PredictionServiceClient(client_options=client_options)
+    return _client
+
+@metrics.timed("get_llama_response")
 def get_llama_response(input_data):
-    client_options = {"api_endpoint": API_ENDPOINT}
-    client = aiplatform.gapic.PredictionServiceClient(client_options=client_options)
+    instances = [{"prompt": input_data, "max_tokens": 500}]
+    if VERTEX_EMULATOR_HOST:
+        return get_emulator_response(instances)
+    client = get_prediction_client()
     endpoint = client.endpoint_path(
         project=PROJECT, location=LOCATION, endpoint=ENDPOINT_ID
     )
-    instances = [{"prompt": input_data, "max_tokens": 500}]
     response = client.predict(endpoint=endpoint, instances=instances)
     return response.predictions
 
+def get_emulator_response(instances):
+    # Call a local stand-in for the endpoint over the Vertex AI REST API, such as the benchmark fakes
+    url = "http://{}/v1/projects/{}/locations/{}/endpoints/{}:predict".format(
+        VERTEX_EMULATOR_HOST, PROJECT, LOCATION, ENDPOINT_ID
+    )
+    response = requests.post(url, json={"instances": instances}, timeout=60)
+    response.raise_for_status()
+    return response.json()["predictions"]
+
 def format_llama_prompt(message: str, history: list, memory_limit: int = 10) -> str:
   if len(history) > memory_limit:
     history = history[-memory_limit:]
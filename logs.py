@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+# Import necessary libraries
+import sys
+import json
+import time
+import queue
+import atexit
+import random
+import logging
+import logging.handlers
+from typing import Any, Callable
+from tracing import current_trace_id
+
+# The logger of verbose payloads, such as webhook bodies and outbound messages, and the share of them logged
+payload_logger = logging.getLogger("aiysha.payloads")
+_payload_rate = 1.0
+
+
+class Lazy:
+    """
+    This class defers computing a log argument, such as parsing a response body, until the record is formatted,
+    which only happens if the record passes the level and the sampling, and then on the logging thread.
+    """
+
+    __slots__ = ("function", "limit")
+
+    def __init__(self, function: Callable[[], Any], limit: int = 2000) -> None:
+        """
+        Parameters:
+        function (Callable[[], Any]): A function that returns the value to log.
+        limit (int, optional): The maximum number of characters logged. Defaults to 2000.
+        """
+        self.function = function
+        self.limit = limit
+
+    def __str__(self) -> str:
+        try:
+            text = str(self.function())
+        except Exception as e:
+            text = "<unavailable: {}>".format(e)
+        if len(text) > self.limit:
+            text = "{}... ({} more characters)".format(text[: self.limit], len(text) - self.limit)
+        return text
+
+
+def truncated(value: Any, limit: int = 2000) -> Lazy:
+    """
+    This function wraps a value so it is converted to text, and cut short, only when its record is formatted.
+
+    Parameters:
+    value (Any): The value to log.
+    limit (int, optional): The maximum number of characters logged. Defaults to 2000.
+
+    Returns:
+    Lazy: The wrapped value.
+    """
+    return Lazy(lambda: value, limit)
+
+
+def log_payload(message: str, *args: Any) -> None:
+    """
+    This function logs a verbose payload, such as a webhook body or an outbound message, for a sample of the messages
+    and for every traced one. The sampling happens before the record is created, so skipped payloads cost nothing else.
+
+    Parameters:
+    message (str): The message, with %s placeholders for the arguments.
+    args (Any): The arguments, formatted only if the record is written.
+    """
+    if (current_trace_id() is not None or random.random() < _payload_rate) and payload_logger.isEnabledFor(
+        logging.INFO
+    ):
+        payload_logger.info(message, *args)
+
+
+class ContextFilter(logging.Filter):
+    """
+    This class stamps every record with the trace ID of the running code, while the record is still on its thread.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.trace_id = current_trace_id()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    This class formats a record as one JSON object per line, with the fields passed in extra={"fields": {...}}.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": "{}.{:03d}Z".format(
+                time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)), int(record.msecs)
+            ),
+            "severity": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "trace_id", None):
+            entry["trace_id"] = record.trace_id
+        fields = getattr(record, "fields", None)
+        if fields:
+            for key, value in fields.items():
+                entry[key] = value if isinstance(value, (int, float, bool)) else str(value)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    This class hands records to the logging thread without formatting them, and drops them when the queue is full
+    rather than blocking the message that logged them.
+    """
+
+    def __init__(self, log_queue: "queue.Queue[logging.LogRecord]") -> None:
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Keep the message and its arguments apart so they are formatted on the logging thread,
+        # rendering only the traceback now, since it refers to frames that are about to go away
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(
+    level: str = "INFO",
+    json_format: bool = False,
+    payload_sample_rate: float = 1.0,
+    queue_size: int = 10000,
+) -> logging.handlers.QueueListener:
+    """
+    This function routes every log record through a queue to a background thread, which formats and writes it to stderr.
+
+    Logging then costs a message thread a level check and a queue put; formatting the message and the I/O happen on the
+    logging thread. Payloads logged with log_payload are sampled.
+
+    Parameters:
+    level (str, optional): The lowest level logged. Defaults to "INFO".
+    json_format (bool, optional): Whether records are written as JSON lines rather than text. Defaults to False.
+    payload_sample_rate (float, optional): The share of payload records logged, between 0 and 1. Defaults to 1.
+    queue_size (int, optional): The maximum number of records waiting to be written. Defaults to 10000.
+
+    Returns:
+    logging.handlers.QueueListener: The started listener, which is stopped when the process exits.
+    """
+    # Write the records on a background thread, in the format of logging.basicConfig unless JSON is asked for
+    output = logging.StreamHandler(sys.stderr)
+    if json_format:
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(queue_size)
+    listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=False)
+
+    # Replace the handlers that logging.basicConfig installed with the queue
+    handler = DroppingQueueHandler(log_queue)
+    handler.addFilter(ContextFilter())
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level.upper())
+
+    # Sample the verbose payloads, and skip looking up the source line of every record, which no format uses
+    global _payload_rate
+    _payload_rate = payload_sample_rate
+    logging._srcfile = None
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+
+    # Start writing, and write what is left in the queue when the process exits
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+# Import necessary libraries
+import re
+import heapq
+from collections import Counter
+from itertools import chain
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# A word of an option or a reply
+_word = re.compile(r"[^\W_]+")
+
+
+def tokens(text: str) -> List[str]:
+    """
+    This function splits a text into lower-cased words, dropping punctuation and emojis.
+
+    Parameters:
+    text (str): The text to split.
+
+    Returns:
+    List[str]: The words of the text.
+    """
+    return _word.findall(text.lower())
+
+
+def word_starts(text: str) -> List[int]:
+    """
+    This function returns the position of every word in a text.
+
+    Parameters:
+    text (str): The text to split.
+
+    Returns:
+    List[int]: The position of the first character of each word.
+    """
+    return [match.start() for match in _word.finditer(text)]
+
+
+def trigrams(text: str) -> List[str]:
+    """
+    This function returns the distinct trigrams of the words of a text, each word padded with spaces so short words
+    and word boundaries are represented.
+
+    Parameters:
+    text (str): The text to split.
+
+    Returns:
+    List[str]: The distinct trigrams of the text.
+    """
+    grams = set()
+    for word in tokens(text):
+        padded = "  {} ".format(word)
+        for i in range(len(padded) - 2):
+            grams.add(padded[i : i + 3])
+    return list(grams)
+
+
+def aliases(phrase: str) -> List[str]:
+    """
+    This function returns the spellings a phrase is matched under: the phrase itself, its words joined with spaces, and
+    every way of running adjacent words of three letters or more together, so "lipstik try on" can match "lip stick try-on"
+    through "lipstick try on". Every spelling covers all the words of the phrase, so a reply of one common word, such as
+    "thanks", never matches a longer phrase that contains it, such as "no, thanks.".
+
+    Parameters:
+    phrase (str): The phrase to spell.
+
+    Returns:
+    List[str]: The distinct spellings of the phrase.
+    """
+    words = tokens(phrase)
+    spellings = {phrase, " ".join(words)}
+
+    # Find the gaps between words long enough to be the halves of a word split in two, unlike "no" or "on"
+    gaps = [gap for gap in range(len(words) - 1) if len(words[gap]) >= 3 and len(words[gap + 1]) >= 3]
+
+    # Join or keep each of those gaps, for phrases short enough to try every combination
+    if len(gaps) <= 5:
+        for joins in range(1, 1 << len(gaps)):
+            joined = {gap for bit, gap in enumerate(gaps) if joins >> bit & 1}
+            spelling = words[0]
+            for gap, word in enumerate(words[1:]):
+                spelling += ("" if gap in joined else " ") + word
+            spellings.add(spelling)
+    else:
+        spellings.add("".join(words))
+    return [spelling for spelling in spellings if spelling]
+
+
+class TrigramIndex:
+    """
+    This class is an inverted index from trigrams to integer IDs, used to find the texts most similar to a misspelled query.
+    The similarity of two texts is the Dice coefficient of their trigram sets, between 0 and 1.
+    """
+
+    __slots__ = ("_postings", "_sizes")
+
+    def __init__(self) -> None:
+        self._postings: Dict[str, List[int]] = {}
+        self._sizes: Dict[int, int] = {}
+
+    def add(self, id: int, text: str) -> None:
+        """
+        This function indexes a text under an integer ID.
+        """
+        grams = trigrams(text)
+        self._sizes[id] = len(grams)
+        for gram in grams:
+            self._postings.setdefault(gram, []).append(id)
+
+    def search(self, text: str, limit: int = 1, min_score: float = 0.5) -> List[Tuple[float, int]]:
+        """
+        This function finds the IDs whose texts are most similar to a query.
+
+        Parameters:
+        text (str): The query.
+        limit (int, optional): The maximum number of results. Defaults to 1.
+        min_score (float, optional): The minimum similarity of a result. Defaults to 0.5.
+
+        Returns:
+        List[Tuple[float, int]]: The (score, ID) of the results, best first.
+        """
+        return heapq.nlargest(limit, self.scores(text, min_score))
+
+    def scores(self, text: str, min_score: float = 0.5) -> List[Tuple[float, int]]:
+        """
+        This function scores every ID whose text is similar enough to a query, in no particular order.
+
+        Parameters:
+        text (str): The query.
+        min_score (float, optional): The minimum similarity of a result. Defaults to 0.5.
+
+        Returns:
+        List[Tuple[float, int]]: The (score, ID) of the results.
+        """
+        grams = trigrams(text)
+        if not grams:
+            return []
+
+        # Count the trigrams each ID shares with the query
+        postings = self._postings
+        shared = Counter(chain.from_iterable(postings.get(gram, ()) for gram in grams))
+
+        # An ID of n trigrams scores at least min_score only if it shares min_score * (size + n) / 2 of them,
+        # so the IDs that share too few trigrams with the query are skipped without scoring
+        sizes = self._sizes
+        size = len(grams)
+        least = min_score * size / 2.0
+        scored = []
+        for id, count in shared.items():
+            if count < least:
+                continue
+            score = 2.0 * count / (size + sizes[id])
+            if score >= min_score:
+                scored.append((score, id))
+        return scored
+
+
+def distance(a: str, b: str, limit: int) -> int:
+    """
+    This function computes the edit distance between two texts, counting an insertion, deletion, substitution or swap
+    of two adjacent letters as one edit. It uses Hyyrö's bit-parallel algorithm, which keeps a column of the edit
+    distance matrix in the bits of two integers, so each letter of b costs a handful of integer operations.
+
+    Parameters:
+    a (str): The first text.
+    b (str): The second text.
+    limit (int): The largest distance of interest.
+
+    Returns:
+    int: The edit distance, or limit + 1 if it exceeds the limit.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    if not a:
+        return len(b)
+
+    # Mark the positions of each letter of a
+    positions: Dict[str, int] = {}
+    for i, letter in enumerate(a):
+        positions[letter] = positions.get(letter, 0) | (1 << i)
+
+    # Walk the letters of b, updating the vertical deltas of the column and the distance in its last row
+    full = (1 << len(a)) - 1
+    last = 1 << (len(a) - 1)
+    plus, minus, diagonal, previous_match, score = full, 0, 0, 0, len(a)
+    for letter in b:
+        match = positions.get(letter, 0)
+        swap = ((~diagonal & match) << 1) & previous_match
+        diagonal = ((((match & plus) + plus) ^ plus) | match | minus | swap) & full
+        horizontal_plus = (minus | ~(diagonal | plus)) & full
+        horizontal_minus = diagonal & plus
+        if horizontal_plus & last:
+            score += 1
+        elif horizontal_minus & last:
+            score -= 1
+        horizontal_plus = ((horizontal_plus << 1) | 1) & full
+        horizontal_minus = (horizontal_minus << 1) & full
+        plus = (horizontal_minus | ~(diagonal | horizontal_plus)) & full
+        minus = horizontal_plus & diagonal
+        previous_match = match
+    return score if score <= limit else limit + 1
+
+
+class Matcher:
+    """
+    This class finds the phrase a mistyped reply most likely meant, such as the handler keyword "lip stick try-on" for
+    "lipstik" or the greeting "hello" for "helo". It is built once. A match looks up the spellings of the phrases that
+    share the most trigrams with the reply, then scores them by edit distance, so short words with one typo still match
+    and a reply with extra words does not match a shorter spelling.
+
+    The score of a spelling is 1 - edits / length of the longer text. A reply that is as close to two different phrases
+    is ambiguous and matches neither, so the matcher never has to guess.
+    """
+
+    __slots__ = ("_values", "_spellings", "_index")
+
+    def __init__(self, phrases: Iterable[str] = ()) -> None:
+        """
+        Parameters:
+        phrases (Iterable[str], optional): The phrases to match replies against, each standing for itself.
+        """
+        self._values: List[Any] = []
+        self._spellings: List[str] = []
+        self._index = TrigramIndex()
+        for phrase in dict.fromkeys(phrases):
+            self.add(phrase)
+
+    def add(self, phrase: str, value: Any = None) -> None:
+        """
+        This function adds a phrase to match replies against.
+
+        Parameters:
+        phrase (str): The phrase.
+        value (Any, optional): What a reply matching the phrase stands for. Defaults to the phrase itself.
+        """
+        # Index every spelling of the phrase under its own ID, remembering the value it spells
+        value = phrase if value is None else value
+        for spelling in aliases(phrase):
+            self._index.add(len(self._values), spelling)
+            self._values.append(value)
+            self._spellings.append(" ".join(tokens(spelling)))
+
+    def search(
+        self, text: str, limit: int = 1, min_score: float = 0.75, candidates: int = 8
+    ) -> List[Tuple[float, Any]]:
+        """
+        This function finds the values whose phrases are closest to a reply.
+
+        Parameters:
+        text (str): The reply of the user.
+        limit (int, optional): The maximum number of results. Defaults to 1.
+        min_score (float, optional): The minimum similarity of a result, between 0 and 1. Defaults to 0.75.
+        candidates (int, optional): The number of spellings sharing the most trigrams with the reply to score. Defaults to 8.
+
+        Returns:
+        List[Tuple[float, Any]]: The (score, value) of the results, best first, with each value scored by its closest spelling.
+        """
+        # Score the spellings sharing the most trigrams with the reply by their edit distance to it
+        text = " ".join(tokens(text))
+        values = self._values
+        spellings = self._spellings
+        best: Dict[Any, float] = {}
+        for _, id in self._index.search(text, candidates, 0.2):
+            spelling = spellings[id]
+            length = max(len(text), len(spelling))
+            limit_edits = int(length * (1.0 - min_score))
+            edits = distance(text, spelling, limit_edits)
+            if edits > limit_edits:
+                continue
+
+            # Score each value by its closest spelling, since one value can have many
+            score = 1.0 - edits / length
+            value = values[id]
+            if score > best.get(value, 0.0):
+                best[value] = score
+
+        results = heapq.nlargest(limit, best.items(), key=lambda item: item[1])
+        return [(score, value) for value, score in results]
+
+    def match(self, text: str, min_score: float = 0.75) -> Optional[Tuple[float, Any]]:
+        """
+        This function finds the value whose phrase is closest to a reply.
+
+        Parameters:
+        text (str): The reply of the user.
+        min_score (float, optional): The minimum similarity of a match, between 0 and 1. Defaults to 0.75.
+
+        Returns:
+        Optional[Tuple[float, Any]]: The score and the matched value, or None if no phrase is close enough or the best
+        match is ambiguous.
+        """
+        return best_match(self.search(text, 2, min_score))
+
+
+def best_match(results: Iterable[Tuple[float, Any]]) -> Optional[Tuple[float, Any]]:
+    """
+    This function picks the best of a list of scored matches, unless another match with the same score means something else.
+
+    Parameters:
+    results (Iterable[Tuple[float, Any]]): The (score, value) pairs, best first.
+
+    Returns:
+    Optional[Tuple[float, Any]]: The best (score, value), or None if there are no results or the best one is ambiguous.
+    """
+    best = None
+    for score, value in results:
+        if best is None:
+            best = (score, value)
+        elif score < best[0] - 1e-9:
+            break
+        elif value != best[1]:
+            return None
+    return best
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+# Import necessary libraries
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from typing import IO, Dict, Optional, Tuple
+
+# Set up logging with INFO level
+logging.basicConfig(level=logging.INFO)
+
+
+def digest_file(media_file: IO[bytes]) -> str:
+    """
+    This function hashes the content of an open file and rewinds it.
+
+    Parameters:
+    media_file (IO[bytes]): The open file.
+
+    Returns:
+    str: The hex digest of the content.
+    """
+    media_file.seek(0)
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: media_file.read(1024 * 1024), b""):
+        digest.update(chunk)
+    media_file.seek(0)
+    return digest.hexdigest()
+
+
+def digest_path(path: str) -> str:
+    """
+    This function hashes the content of a file.
+
+    Parameters:
+    path (str): The path of the file.
+
+    Returns:
+    str: The hex digest of the content.
+    """
+    with open(path, "rb") as media_file:
+        return digest_file(media_file)
+
+
+class MediaRegistry:
+    """
+    This class remembers which content was uploaded to WhatsApp as which media ID, so the same bytes are not uploaded twice.
+
+    Entries are keyed by the phone number ID the media was uploaded from and the hash of its content, and are forgotten
+    shortly before WhatsApp deletes the media. The registry survives restarts through an append-only log of uploads,
+    which is replayed on start and compacted when most of its lines are stale. The least recently registered entries
+    are evicted above a limit.
+    """
+
+    def __init__(
+        self, path: Optional[str] = None, ttl: float = 29 * 24 * 3600.0, max_entries: int = 10000
+    ) -> None:
+        """
+        Parameters:
+        path (Optional[str], optional): The path of the log. Defaults to None, which keeps the registry in memory only.
+        ttl (float, optional): How long a media ID is used after its upload, in seconds. Defaults to 29 days.
+        max_entries (int, optional): The maximum number of entries. Defaults to 10000.
+        """
+        # Store the settings of the registry
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        # Map each (phone number ID, content hash) to its media ID and expiry time, oldest first
+        self._entries: Dict[Tuple[str, str], Tuple[str, float]] = {}
+        self._lock = threading.Lock()
+        self._log = None
+        self._log_lines = 0
+
+        # Replay the log of a previous run
+        if path:
+            self._load()
+
+    def get(self, number_id: str, digest: str) -> Optional[str]:
+        """
+        This function returns the media ID some content was uploaded as from a phone number ID.
+
+        Returns:
+        Optional[str]: The media ID, or None if the content was not uploaded or its upload has expired.
+        """
+        entry = self._entries.get((number_id, digest))
+        if entry is None or time.time() >= entry[1]:
+            return None
+        return entry[0]
+
+    def put(self, number_id: str, digest: str, media_id: str) -> None:
+        """
+        This function records the media ID some content was uploaded as from a phone number ID.
+        """
+        key = (number_id, digest)
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            # Re-insert the entry so the dictionary stays ordered by registration
+            self._entries.pop(key, None)
+            self._entries[key] = (media_id, expires_at)
+            while len(self._entries) > self.max_entries:
+                self._entries.pop(next(iter(self._entries)))
+
+            # Append the upload to the log, compacting it when most of its lines are stale
+            if self.path:
+                try:
+                    self._append(key, media_id, expires_at)
+                    if self._log_lines > 2 * len(self._entries) + 100:
+                        self._compact()
+                except OSError as e:
+                    # Keep the entry in memory, the log is only needed across restarts
+                    logging.error(f"Error occurred while writing the media registry: {e}")
+
+    def _load(self) -> None:
+        # Replay the log, keeping the latest unexpired media ID of each key
+        now = time.time()
+        try:
+            with open(self.path) as log:
+                for line in log:
+                    self._log_lines += 1
+                    try:
+                        number_id, digest, media_id, expires_at = json.loads(line)
+                    except ValueError:
+                        # Skip a line cut short by a crash
+                        continue
+                    key = (number_id, digest)
+                    self._entries.pop(key, None)
+                    if expires_at > now:
+                        self._entries[key] = (media_id, expires_at)
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            logging.error(f"Error occurred while reading the media registry: {e}")
+            return
+
+        # Drop the entries above the limit and rewrite the log without the stale lines
+        while len(self._entries) > self.max_entries:
+            self._entries.pop(next(iter(self._entries)))
+        logging.info("Loaded {} media IDs from {}".format(len(self._entries), self.path))
+        try:
+            self._compact()
+        except OSError as e:
+            logging.error(f"Error occurred while compacting the media registry: {e}")
+
+    def _append(self, key: Tuple[str, str], media_id: str, expires_at: float) -> None:
+        # Write one line per upload, opening the log on the first one
+        if self._log is None:
+            self._log = open(self.path, "a", buffering=1)
+        self._log.write(json.dumps([key[0], key[1], media_id, expires_at]) + "\n")
+        self._log_lines += 1
+
+    def _compact(self) -> None:
+        # Rewrite the log with the live entries only, replacing the old one atomically
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as log:
+            for (number_id, digest), (media_id, expires_at) in self._entries.items():
+                log.write(json.dumps([number_id, digest, media_id, expires_at]) + "\n")
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+        os.replace(temp_path, self.path)
+        self._log_lines = len(self._entries)
@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+# Import necessary libraries
+import time
+import functools
+import threading
+import contextlib
+from bisect import bisect_left
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# The upper bounds of the latency buckets, in seconds, from a millisecond to two minutes
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0,
+)
+
+
+class Histogram:
+    """
+    This class counts the observations of one stage in one thread: how many fell into each latency bucket, their sum,
+    and how many ended in an exception.
+    """
+
+    __slots__ = ("counts", "total", "errors")
+
+    def __init__(self, buckets: int) -> None:
+        # Keep one count per bucket, plus one for the observations above the last bound
+        self.counts = [0] * (buckets + 1)
+        self.total = 0.0
+        self.errors = 0
+
+    def merge(self, other: "Histogram") -> None:
+        # Add the observations of another histogram of the same buckets
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.total += other.total
+        self.errors += other.errors
+
+
+class Shard:
+    """
+    This class holds the histograms and counters written by one thread. Only its thread writes to it, so updates
+    need no lock, and the scrape reads it while it is being written, which at worst misses an observation in flight.
+    """
+
+    __slots__ = ("histograms", "counters")
+
+    def __init__(self) -> None:
+        self.histograms: Dict[str, Histogram] = {}
+        self.counters: Dict[str, int] = {}
+
+
+class Timer:
+    """
+    This class times a block of code and records its latency under a stage when the block exits, running the block in a
+    span of the current trace if a tracer is attached.
+    """
+
+    __slots__ = ("metrics", "stage", "start", "span")
+
+    def __init__(self, metrics: "Metrics", stage: str) -> None:
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self) -> "Timer":
+        self.span = self.metrics.span(self.stage)
+        self.span.__enter__()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.metrics.observe(self.stage, time.perf_counter() - self.start, exc_type is not None)
+        self.span.__exit__(exc_type, exc_value, traceback)
+
+
+class Metrics:
+    """
+    This class aggregates stage latencies and event counters, and renders them in the Prometheus text format.
+
+    Every thread writes to a shard of its own, found through a thread-local, so recording an observation takes no lock
+    and costs a bisect and two additions. The shards are only merged when the metrics are scraped. The shards of
+    threads that have exited are folded into one on the next scrape, so short-lived threads do not pile up.
+
+    A tracer can be attached, which makes every timed stage a span of the trace of the message being handled.
+    """
+
+    def __init__(self, namespace: str = "aiysha", buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        """
+        Parameters:
+        namespace (str, optional): The prefix of every metric name. Defaults to "aiysha".
+        buckets (Tuple[float, ...], optional): The upper bounds of the latency buckets, in seconds, ascending.
+        """
+        # Store the settings of the metrics
+        self.namespace = namespace
+        self.buckets = buckets
+        self.enabled = True
+        self.tracer = None
+
+        # Keep the shard of each live thread, the merged shard of the exited ones, and the gauges read on scrape
+        self._local = threading.local()
+        self._shards: List[Tuple[threading.Thread, Shard]] = []
+        self._retired = Shard()
+        self._gauges: Dict[str, Callable[[], float]] = {}
+        self._lock = threading.Lock()
+
+    def _shard(self) -> Shard:
+        # Return the shard of the calling thread, registering one on its first observation
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = Shard()
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+            return shard
+
+    def observe(self, stage: str, seconds: float, error: bool = False) -> None:
+        """
+        This function records the latency of one run of a stage.
+
+        Parameters:
+        stage (str): The name of the stage.
+        seconds (float): How long the run took.
+        error (bool, optional): Whether the run ended in an exception. Defaults to False.
+        """
+        if not self.enabled:
+            return
+        try:
+            histograms = self._local.shard.histograms
+        except AttributeError:
+            histograms = self._shard().histograms
+        histogram = histograms.get(stage)
+        if histogram is None:
+            histogram = histograms[stage] = Histogram(len(self.buckets))
+        histogram.counts[bisect_left(self.buckets, seconds)] += 1
+        histogram.total += seconds
+        if error:
+            histogram.errors += 1
+
+    def count(self, name: str, amount: int = 1) -> None:
+        """
+        This function adds to an event counter.
+
+        Parameters:
+        name (str): The name of the counter.
+        amount (int, optional): How much to add. Defaults to 1.
+        """
+        if not self.enabled:
+            return
+        counters = self._shard().counters
+        counters[name] = counters.get(name, 0) + amount
+
+    def gauge(self, name: str, read: Callable[[], float]) -> None:
+        """
+        This function registers a gauge, whose value is read when the metrics are scraped.
+
+        Parameters:
+        name (str): The name of the gauge.
+        read (Callable[[], float]): A function that returns the current value.
+        """
+        self._gauges[name] = read
+
+    def span(self, stage: str) -> Any:
+        """
+        This function opens a span for a stage in the current trace, or returns a stand-in if no tracer is attached.
+        """
+        if self.tracer is None:
+            return _no_span
+        return self.tracer.span(stage)
+
+    def timer(self, stage: str) -> Timer:
+        """
+        This function returns a context manager that records how long its block takes under a stage.
+        """
+        return Timer(self, stage)
+
+    def timed(self, stage: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+        """
+        This function returns a decorator that records how long every call of a function takes under a stage.
+        """
+
+        def decorator(function: Callable[..., Any]) -> Callable[..., Any]:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.span(stage):
+                    start = time.perf_counter()
+                    error = True
+                    try:
+                        result = function(*args, **kwargs)
+                        error = False
+                        return result
+                    finally:
+                        self.observe(stage, time.perf_counter() - start, error)
+
+            return wrapper
+
+        return decorator
+
+    def collect(self) -> Shard:
+        """
+        This function merges the shards of every thread into one.
+
+        Returns:
+        Shard: The histograms and counters of all threads.
+        """
+        merged = Shard()
+        with self._lock:
+            # Fold the shards of exited threads into the retired shard, since they will not change anymore
+            live = []
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    live.append((thread, shard))
+                else:
+                    self._merge(self._retired, shard)
+            self._shards = live
+
+            # Merge the shards, which their threads may be writing to meanwhile
+            for shard in [self._retired] + [shard for _, shard in live]:
+                self._merge(merged, shard)
+        return merged
+
+    def _merge(self, into: Shard, shard: Shard) -> None:
+        # Add the histograms and counters of a shard to another
+        for stage, histogram in list(shard.histograms.items()):
+            if stage not in into.histograms:
+                into.histograms[stage] = Histogram(len(self.buckets))
+            into.histograms[stage].merge(histogram)
+        for name, value in list(shard.counters.items()):
+            into.counters[name] = into.counters.get(name, 0) + value
+
+    def render(self) -> str:
+        """
+        This function renders the metrics in the Prometheus text exposition format.
+
+        Returns:
+        str: The stage latency histograms, the stage error counts, the event counters and the gauges.
+        """
+        merged = self.collect()
+        prefix = self.namespace
+        lines = []
+
+        # Render the latency of every stage as a cumulative histogram
+        lines.append("# HELP {}_stage_seconds The latency of each stage.".format(prefix))
+        lines.append("# TYPE {}_stage_seconds histogram".format(prefix))
+        for stage in sorted(merged.histograms):
+            histogram = merged.histograms[stage]
+            label = _label(stage)
+            cumulative = 0
+            for bound, count in zip(self.buckets, histogram.counts):
+                cumulative += count
+                lines.append('{}_stage_seconds_bucket{{stage="{}",le="{}"}} {}'.format(prefix, label, bound, cumulative))
+            cumulative += histogram.counts[-1]
+            lines.append('{}_stage_seconds_bucket{{stage="{}",le="+Inf"}} {}'.format(prefix, label, cumulative))
+            lines.append('{}_stage_seconds_sum{{stage="{}"}} {:.6f}'.format(prefix, label, histogram.total))
+            lines.append('{}_stage_seconds_count{{stage="{}"}} {}'.format(prefix, label, cumulative))
+
+        # Render the runs of every stage that ended in an exception
+        lines.append("# HELP {}_stage_errors_total The runs of each stage that raised an exception.".format(prefix))
+        lines.append("# TYPE {}_stage_errors_total counter".format(prefix))
+        for stage in sorted(merged.histograms):
+            lines.append(
+                '{}_stage_errors_total{{stage="{}"}} {}'.format(prefix, _label(stage), merged.histograms[stage].errors)
+            )
+
+        # Render the event counters
+        for name in sorted(merged.counters):
+            lines.append("# TYPE {}_{}_total counter".format(prefix, name))
+            lines.append("{}_{}_total {}".format(prefix, name, merged.counters[name]))
+
+        # Render the gauges, skipping the ones that fail to read
+        for name in sorted(self._gauges):
+            try:
+                value = float(self._gauges[name]())
+            except Exception:
+                continue
+            lines.append("# TYPE {}_{} gauge".format(prefix, name))
+            lines.append("{}_{} {}".format(prefix, name, value))
+
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """
+        This function summarizes the metrics for humans: the count, mean, errors and approximate p50 and p99 of every
+        stage, and the value of every counter.
+
+        Returns:
+        Dict[str, Dict[str, Any]]: The stages and counters.
+        """
+        merged = self.collect()
+        stages = {}
+        for stage, histogram in merged.histograms.items():
+            count = sum(histogram.counts)
+            stages[stage] = dict(
+                count=count,
+                errors=histogram.errors,
+                mean=histogram.total / count if count else 0.0,
+                p50=self._quantile(histogram, 0.5),
+                p99=self._quantile(histogram, 0.99),
+            )
+        return dict(stages=stages, counters=dict(merged.counters))
+
+    def _quantile(self, histogram: Histogram, q: float) -> Optional[float]:
+        # Return the upper bound of the bucket holding a quantile, or None if it is above the last bound
+        count = sum(histogram.counts)
+        if not count:
+            return None
+        rank = q * count
+        cumulative = 0
+        for bound, bucket in zip(self.buckets, histogram.counts):
+            cumulative += bucket
+            if cumulative >= rank:
+                return bound
+        return None
+
+
+# The stand-in span of stages timed without a tracer
+_no_span = contextlib.nullcontext()
+
+
+def _label(value: str) -> str:
+    # Escape a label value for the text format
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# The metrics shared by every module of the application
+metrics = Metrics()
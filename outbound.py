@@ -0,0 +1,384 @@
+# -*- coding: utf-8 -*-
+# Import necessary libraries
+import time
+import logging
+import threading
+import itertools
+import collections
+from typing import Any, Callable, Dict, List, Optional
+
+# Set up logging with INFO level
+logging.basicConfig(level=logging.INFO)
+
+# The priority classes of outbound messages, most urgent first
+INTERACTIVE = 0
+TEMPLATE = 1
+RECEIPT = 2
+
+# The Graph API error codes of the sender's throughput limit and of the limit per recipient
+THROUGHPUT_ERRORS = {4, 80007, 130429}
+PAIR_RATE_ERRORS = {131056}
+
+
+class TokenBucket:
+    """
+    This class holds the tokens of one rate limit: a send takes a token, and tokens refill at the rate up to the burst.
+    The rate adapts: it is halved when the API reports the limit was hit, and recovers step by step with successful sends.
+    """
+
+    __slots__ = ("max_rate", "rate", "capacity", "tokens", "updated", "paused_until")
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def wait_time(self, now: float) -> float:
+        """
+        This function refills the bucket and returns how long until it holds a token, in seconds.
+        """
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else float("inf")
+
+    def slow_down(self, now: float, pause: float, min_fraction: float) -> None:
+        """
+        This function halves the rate, down to a fraction of the configured one, and pauses the bucket after a limit was hit.
+        """
+        self.rate = max(self.rate / 2, self.max_rate * min_fraction)
+        self.tokens = 0.0
+        self.paused_until = max(self.paused_until, now + pause)
+
+    def speed_up(self, step: float) -> None:
+        """
+        This function raises the rate by a fraction of the configured one, up to the configured one, after a successful send.
+        """
+        if self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * step)
+
+
+class OutboundScheduler:
+    """
+    This class paces the messages sent to the WhatsApp Cloud API within its rate limits, so sends are as fast as allowed
+    without the penalties for exceeding them.
+
+    Every send takes a token from the bucket of its business phone number, which holds the number's throughput, and from
+    the bucket of its recipient, which holds the pair rate WhatsApp allows per user. A send blocks until both buckets
+    hold a token; among the sends waiting on the same number, the most urgent priority class goes first, unless its
+    recipient has no token yet. When the API answers that a limit was hit, the bucket of that limit slows down and
+    pauses, and the message is retried; successful sends let the rate recover.
+
+    Dispatched sends never wait on a recipient: a message to a recipient without a token, or with messages already
+    deferred, joins that recipient's queue and is sent in order by a background thread once the recipient has a token,
+    so the request worker goes on to the other users instead of sleeping through one user's pair rate.
+    """
+
+    def __init__(
+        self,
+        number_rate: float = 80.0,
+        number_burst: float = 80.0,
+        recipient_rate: float = 1 / 6,
+        recipient_burst: float = 10.0,
+        pause: float = 6.0,
+        min_fraction: float = 0.05,
+        recovery: float = 0.05,
+        max_retries: int = 2,
+        max_recipients: int = 10000,
+        max_deferred: int = 10000,
+    ) -> None:
+        """
+        Parameters:
+        number_rate (float, optional): The messages per second each business phone number may send. Defaults to 80.
+        number_burst (float, optional): The messages a business phone number may send at once. Defaults to 80.
+        recipient_rate (float, optional): The messages per second each recipient may be sent. Defaults to one every 6 seconds.
+        recipient_burst (float, optional): The messages a recipient may be sent at once. Defaults to 10.
+        pause (float, optional): How long a bucket pauses after its limit was hit, in seconds. Defaults to 6.
+        min_fraction (float, optional): The lowest fraction of its configured rate a bucket slows down to. Defaults to 0.05.
+        recovery (float, optional): The fraction of its configured rate a bucket regains per successful send. Defaults to 0.05.
+        max_retries (int, optional): How many times a message refused for a rate limit is retried. Defaults to 2.
+        max_recipients (int, optional): The number of recipient buckets kept before full ones are forgotten. Defaults to 10000.
+        max_deferred (int, optional): The most messages waiting for their recipients; later ones are dropped. Defaults to 10000.
+        """
+        self.number_rate = number_rate
+        self.number_burst = number_burst
+        self.recipient_rate = recipient_rate
+        self.recipient_burst = recipient_burst
+        self.pause = pause
+        self.min_fraction = min_fraction
+        self.recovery = recovery
+        self.max_retries = max_retries
+        self.max_recipients = max_recipients
+        self.max_deferred = max_deferred
+
+        # The buckets of the business phone numbers and of the recipients, and the sends waiting for tokens
+        self._numbers: Dict[str, TokenBucket] = {}
+        self._recipients: Dict[str, TokenBucket] = {}
+        self._waiting: List[tuple] = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+
+        # The messages deferred for each recipient in the order they were dispatched, and the recipients being sent to
+        self._deferred: Dict[str, collections.deque] = {}
+        self._in_flight: set = set()
+        self._deferred_count = 0
+        self._sender: Optional[threading.Thread] = None
+        self.deferred = 0
+        self.dropped = 0
+
+    def send(
+        self,
+        post: Callable[[], Any],
+        number_id: str,
+        recipient: Optional[str] = None,
+        priority: int = INTERACTIVE,
+    ) -> Any:
+        """
+        This function sends a message once the rate limits allow it, retrying it while the API refuses it for a rate limit.
+
+        Parameters:
+        post (Callable[[], Any]): A function that posts the message and returns the response.
+        number_id (str): The business phone number sending the message.
+        recipient (Optional[str], optional): The phone number of the recipient, or None for messages that are not
+        delivered to a user, such as read receipts. Defaults to None.
+        priority (int, optional): The priority class of the message. Defaults to INTERACTIVE.
+
+        Returns:
+        Any: The response of the last attempt.
+        """
+        return self._send(post, number_id, recipient, priority, 0, False)
+
+    def dispatch(
+        self,
+        post: Callable[[], Any],
+        number_id: str,
+        recipient: Optional[str] = None,
+        priority: int = INTERACTIVE,
+    ) -> Any:
+        """
+        This function sends a message now if its recipient has a token and nothing queued, or else defers it to the
+        recipient's queue, so the caller never waits for the pair rate of a recipient.
+
+        Parameters:
+        post (Callable[[], Any]): A function that posts the message and returns the response.
+        number_id (str): The business phone number sending the message.
+        recipient (Optional[str], optional): The phone number of the recipient, or None for messages that are not
+        delivered to a user, such as read receipts. Defaults to None.
+        priority (int, optional): The priority class of the message. Defaults to INTERACTIVE.
+
+        Returns:
+        Any: The response, or None if the message was deferred or dropped.
+        """
+        if recipient is not None:
+            with self._condition:
+                if (
+                    recipient in self._deferred
+                    or recipient in self._in_flight
+                    or self._recipient_bucket(recipient).wait_time(time.monotonic()) > 0
+                ):
+                    self._defer(recipient, (post, number_id, priority, 0), first=False)
+                    return None
+        return self._send(post, number_id, recipient, priority, 0, True)
+
+    def _defer(self, recipient: str, message: tuple, first: bool) -> None:
+        # Queue a message for a recipient, at the front if it is a retry, starting the sender thread with the first one
+        if self._deferred_count >= self.max_deferred:
+            self.dropped += 1
+            logging.warning("Outbound queue is full, dropping a message")
+            return
+        queue = self._deferred.setdefault(recipient, collections.deque())
+        if first:
+            queue.appendleft(message)
+        else:
+            queue.append(message)
+        self._deferred_count += 1
+        self.deferred += 1
+        if self._sender is None:
+            self._sender = threading.Thread(target=self.run, name="outbound", daemon=True)
+            self._sender.start()
+        self._condition.notify_all()
+
+    def run(self) -> None:
+        """
+        This function sends the deferred messages as their recipients get tokens, each recipient's in order, indefinitely.
+        """
+        while True:
+            # Wait for a recipient with deferred messages to get a token
+            with self._condition:
+                while True:
+                    now = time.monotonic()
+                    recipient, wait = None, None
+                    for candidate in self._deferred:
+                        candidate_wait = self._recipient_bucket(candidate).wait_time(now)
+                        if candidate_wait == 0:
+                            recipient = candidate
+                            break
+                        wait = candidate_wait if wait is None else min(wait, candidate_wait)
+                    if recipient is not None:
+                        break
+                    self._condition.wait(timeout=min(wait, 1.0) if wait is not None else None)
+
+                # Take the recipient's oldest message, holding back their new ones until it is sent
+                queue = self._deferred[recipient]
+                post, number_id, priority, attempt = queue.popleft()
+                if not queue:
+                    del self._deferred[recipient]
+                self._deferred_count -= 1
+                self._in_flight.add(recipient)
+
+            # Send the message outside the lock, so dispatches are never held up by the API
+            try:
+                response = self._send(post, number_id, recipient, priority, attempt, True)
+                if response is not None and error_code(response) is not None:
+                    logging.error("Deferred message failed with error %s", error_code(response))
+            except Exception as e:
+                logging.error(f"Error occurred while sending a deferred message: {e}")
+            finally:
+                with self._condition:
+                    self._in_flight.discard(recipient)
+                    self._condition.notify_all()
+
+    def _send(
+        self,
+        post: Callable[[], Any],
+        number_id: str,
+        recipient: Optional[str],
+        priority: int,
+        attempt: int,
+        defer: bool,
+    ) -> Any:
+        # Send a message, retrying it while the API refuses it for a rate limit; with defer, a message refused for its
+        # recipient's limit goes back to the front of the recipient's queue instead of waiting here
+        while True:
+            self.acquire(number_id, recipient, priority)
+            response = post()
+            code = error_code(response)
+
+            # Let the rates recover after a successful send
+            if code is None:
+                with self._condition:
+                    self._numbers[number_id].speed_up(self.recovery)
+                    if recipient is not None and recipient in self._recipients:
+                        self._recipients[recipient].speed_up(self.recovery)
+                return response
+
+            # Slow down the limit that was hit, and retry the message once it allows
+            if code in THROUGHPUT_ERRORS or code in PAIR_RATE_ERRORS:
+                with self._condition:
+                    now = time.monotonic()
+                    if code in PAIR_RATE_ERRORS and recipient is not None:
+                        self._recipient_bucket(recipient).slow_down(now, self.pause, self.min_fraction)
+                    else:
+                        self._numbers[number_id].slow_down(now, self.pause, self.min_fraction)
+                logging.warning("Rate limit hit sending a message (error %s), slowing down", code)
+                if attempt < self.max_retries:
+                    attempt += 1
+                    if defer and code in PAIR_RATE_ERRORS and recipient is not None:
+                        with self._condition:
+                            self._defer(recipient, (post, number_id, priority, attempt), first=True)
+                        return None
+                    continue
+            return response
+
+    def acquire(self, number_id: str, recipient: Optional[str] = None, priority: int = INTERACTIVE) -> float:
+        """
+        This function blocks until a message may be sent, then takes its tokens.
+
+        Parameters:
+        number_id (str): The business phone number sending the message.
+        recipient (Optional[str], optional): The phone number of the recipient, if the message is delivered to a user. Defaults to None.
+        priority (int, optional): The priority class of the message. Defaults to INTERACTIVE.
+
+        Returns:
+        float: How long the message waited, in seconds.
+        """
+        started = time.monotonic()
+        with self._condition:
+            entry = (priority, next(self._sequence), number_id, recipient)
+            self._waiting.append(entry)
+            try:
+                number = self._numbers.get(number_id)
+                if number is None:
+                    number = self._numbers[number_id] = TokenBucket(self.number_rate, self.number_burst)
+                while True:
+                    now = time.monotonic()
+                    wait = number.wait_time(now)
+                    if recipient is not None:
+                        wait = max(wait, self._recipient_bucket(recipient).wait_time(now))
+
+                    # Take the tokens, unless a more urgent send that could go is waiting on the same number
+                    if wait == 0 and not self._outranked(entry, now):
+                        number.tokens -= 1
+                        if recipient is not None:
+                            self._recipients[recipient].tokens -= 1
+                        return now - started
+                    self._condition.wait(timeout=min(wait, 1.0) if wait > 0 else 1.0)
+            finally:
+                self._waiting.remove(entry)
+                self._condition.notify_all()
+
+    def _outranked(self, entry: tuple, now: float) -> bool:
+        # Tell whether a more urgent send on the same number is waiting and has a recipient token
+        for other in self._waiting:
+            if other[2] == entry[2] and other[:2] < entry[:2]:
+                if other[3] is None or self._recipient_bucket(other[3]).wait_time(now) == 0:
+                    return True
+        return False
+
+    def _recipient_bucket(self, recipient: str) -> TokenBucket:
+        # Get the bucket of a recipient, forgetting the full buckets of idle recipients when there are too many
+        bucket = self._recipients.get(recipient)
+        if bucket is None:
+            if len(self._recipients) >= self.max_recipients:
+                now = time.monotonic()
+                for idle in [key for key, other in self._recipients.items() if other.wait_time(now) == 0 and other.tokens >= other.capacity]:
+                    del self._recipients[idle]
+            bucket = self._recipients[recipient] = TokenBucket(self.recipient_rate, self.recipient_burst)
+        return bucket
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        This function summarizes the buckets: the rate and tokens of every business phone number, the recipients tracked
+        and those slowed down, the sends waiting, and the messages deferred for their recipients.
+
+        Returns:
+        Dict[str, Any]: The summary.
+        """
+        with self._condition:
+            return {
+                "numbers": {
+                    number_id: {"rate": bucket.rate, "max_rate": bucket.max_rate, "tokens": round(bucket.tokens, 2)}
+                    for number_id, bucket in self._numbers.items()
+                },
+                "recipients": len(self._recipients),
+                "recipients_slowed": sum(1 for bucket in self._recipients.values() if bucket.rate < bucket.max_rate),
+                "waiting": len(self._waiting),
+                "deferred": self._deferred_count,
+                "deferred_recipients": len(self._deferred),
+                "deferred_total": self.deferred,
+                "dropped": self.dropped,
+            }
+
+
+def error_code(response: Any) -> Optional[int]:
+    """
+    This function reads the Graph API error code of a failed response, taking a 429 without one as the throughput limit.
+
+    Parameters:
+    response (Any): The response of a send.
+
+    Returns:
+    Optional[int]: The error code, the HTTP status if there is none, or None if the send succeeded.
+    """
+    if response.status_code < 400:
+        return None
+    try:
+        return int(response.json()["error"]["code"])
+    except (ValueError, KeyError, TypeError):
+        return 130429 if response.status_code == 429 else response.status_code
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# Import necessary libraries
+import json
+from typing import Callable
+
+# The placeholders written into a payload where the recipient and the replied-to message ID go
+TO_SLOT = "@@to@@"
+MESSAGE_ID_SLOT = "@@message_id@@"
+
+
+def _escape(value: str) -> str:
+    # Phone numbers and WhatsApp message IDs are plain ASCII and are spliced in as they are,
+    # anything else is escaped exactly as json.dumps would
+    if value.isascii() and value.isprintable() and '"' not in value and "\\" not in value:
+        return value
+    return json.dumps(value)[1:-1]
+
+
+class PayloadTemplate:
+    """
+    This class holds a WhatsApp message payload that was serialized once, so sending it to a recipient only splices in the recipient
+    and the replied-to message ID instead of rebuilding and re-serializing the whole message.
+
+    The payload is built by calling a message builder with placeholders, so the rendered payload is byte for byte what the builder
+    would have returned for the same recipient.
+    """
+
+    __slots__ = ("build", "_parts", "_slots")
+
+    def __init__(self, build: Callable[[str, str], str]) -> None:
+        """
+        Parameters:
+        build (Callable[[str, str], str]): A function that builds the payload from a recipient and a replied-to message ID.
+        """
+        # Keep the builder, so the template can be checked and benchmarked against it
+        self.build = build
+
+        # Build the payload with placeholders and split it into literal parts around them
+        data = build(TO_SLOT, MESSAGE_ID_SLOT)
+        parts = []
+        slots = []
+        for i, chunk in enumerate(data.split(TO_SLOT)):
+            if i:
+                slots.append((len(parts), TO_SLOT))
+                parts.append("")
+            for j, piece in enumerate(chunk.split(MESSAGE_ID_SLOT)):
+                if j:
+                    slots.append((len(parts), MESSAGE_ID_SLOT))
+                    parts.append("")
+                parts.append(piece)
+        self._parts = parts
+        self._slots = tuple(slots)
+
+    def render(self, number: str, messageId: str = "") -> str:
+        """
+        This function returns the payload for a recipient.
+
+        Parameters:
+        number (str): The phone number of the recipient.
+        messageId (str, optional): The ID of the message being replied to. Defaults to an empty string.
+
+        Returns:
+        str: A JSON string representing the WhatsApp message.
+        """
+        # Splice the escaped values into a copy of the parts
+        values = {TO_SLOT: _escape(number), MESSAGE_ID_SLOT: _escape(messageId)}
+        parts = self._parts.copy()
+        for index, slot in self._slots:
+            parts[index] = values[slot]
+        return "".join(parts)
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+# Import necessary libraries
+import os
+import time
+import logging
+import threading
+import collections
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Tuple
+
+# Set up logging with INFO level
+logging.basicConfig(level=logging.INFO)
+
+
+class RenderCache:
+    """
+    This class caches virtual try-on (VTO) renders for each user so a shade that was already rendered from their latest selfie can be sent back instantly.
+
+    Entries are keyed by (number, edge URL, color), expire after a time-to-live and are evicted least recently used first.
+    The image file of an entry is removed when the entry is evicted or discarded.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: float = 900.0) -> None:
+        # Store the limits of the cache
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+        # Map each key to the image path and the time it was stored, oldest first
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, number: str, edge_url: str, color: str) -> Optional[str]:
+        """
+        This function returns the cached render for a user, edge and color.
+
+        Returns:
+        Optional[str]: The path of the cached image, or None if there is no fresh entry.
+        """
+        key = (number, edge_url, color)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            # Drop the entry if it has expired or its file is gone
+            path, stored_at = entry
+            if time.monotonic() - stored_at > self.ttl or not os.path.isfile(path):
+                self._remove(key)
+                return None
+
+            # Mark the entry as recently used
+            self._entries.move_to_end(key)
+            return path
+
+    def put(self, number: str, edge_url: str, color: str, path: str) -> None:
+        """
+        This function stores a render in the cache, evicting the least recently used entries when full.
+        """
+        key = (number, edge_url, color)
+        with self._lock:
+            # Replace any previous render for the same key
+            if key in self._entries and self._entries[key][0] != path:
+                self._remove(key)
+            self._entries[key] = (path, time.monotonic())
+            self._entries.move_to_end(key)
+
+            # Evict the oldest entries above the limit
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def discard_user(self, number: str) -> None:
+        """
+        This function removes every render of a user, for example when a new selfie makes them stale.
+        """
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == number]:
+                self._remove(key)
+
+    def _remove(self, key: Tuple[str, str, str]) -> None:
+        # Remove the entry and its image file, if it still exists
+        path, _ = self._entries.pop(key)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class Prefetcher:
+    """
+    This class speculatively renders the other shades of a brand in the background after a selfie arrives, and stores them in a RenderCache.
+
+    It runs on its own small thread pool so it never queues ahead of real requests, caps the number of renders in flight per user
+    and overall, renders at most a budget of shades per selfie, and cancels a user's pending renders when a newer selfie arrives.
+    """
+
+    def __init__(
+        self,
+        render: Callable[[str, str, str], Optional[str]],
+        cache: RenderCache,
+        max_workers: int = 2,
+        per_user_limit: int = 2,
+        budget: int = 4,
+        max_pending: int = 32,
+    ) -> None:
+        # Store the render function, the cache and the limits
+        self.render = render
+        self.cache = cache
+        self.per_user_limit = per_user_limit
+        self.budget = budget
+        self.max_pending = max_pending
+
+        # Create the background thread pool, which is the global concurrency cap
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="prefetch"
+        )
+
+        # Track the latest prefetch of each user as (generation, edge URL, selfie path, colors left)
+        self._jobs = {}
+        self._generation = 0
+
+        # Track the workers draining each user's prefetch and the workers submitted overall
+        self._workers = collections.Counter()
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def schedule(
+        self, number: str, edge_url: str, colors: Dict[str, str], selfie_path: str
+    ) -> int:
+        """
+        This function schedules background renders of the given colors for a user, replacing their earlier prefetch.
+
+        Parameters:
+        number (str): The phone number of the user.
+        edge_url (str): The URL of the VTO edge service.
+        colors (Dict[str, str]): A dictionary mapping each shade name to its hex color code.
+        selfie_path (str): The path of the user's selfie.
+
+        Returns:
+        int: The number of renders that were scheduled.
+        """
+        # Keep the uncached colors within the budget
+        queue = collections.deque(
+            color
+            for color in colors.values()
+            if self.cache.get(number, edge_url, color) is None
+        )
+        while len(queue) > self.budget:
+            queue.pop()
+
+        with self._lock:
+            # Replace the user's prefetch, which cancels the colors still waiting
+            self._generation += 1
+            self._jobs[number] = (self._generation, edge_url, selfie_path, queue)
+
+            # Start workers up to the per-user and global caps, in the context of the message that scheduled them
+            while (
+                self._workers[number] < min(self.per_user_limit, len(queue))
+                and self._pending < self.max_pending
+            ):
+                self._workers[number] += 1
+                self._pending += 1
+                self._executor.submit(contextvars.copy_context().run, self._run, number)
+
+        return len(queue)
+
+    def cancel(self, number: str) -> None:
+        """
+        This function cancels a user's pending prefetch renders.
+        """
+        with self._lock:
+            self._jobs.pop(number, None)
+
+    def _next(self, number: str) -> Optional[Tuple[int, str, str, str]]:
+        # Take the next color of the user's latest prefetch, if any is left
+        with self._lock:
+            job = self._jobs.get(number)
+            if job is None or not job[3]:
+                return None
+            generation, edge_url, selfie_path, queue = job
+            return generation, edge_url, selfie_path, queue.popleft()
+
+    def _is_current(self, number: str, generation: int) -> bool:
+        # Check whether the render still belongs to the user's latest prefetch
+        with self._lock:
+            job = self._jobs.get(number)
+            return job is not None and job[0] == generation
+
+    def _run(self, number: str) -> None:
+        try:
+            # Render the user's colors until none are left or the prefetch is cancelled
+            while True:
+                job = self._next(number)
+                if job is None:
+                    break
+                generation, edge_url, selfie_path, color = job
+
+                try:
+                    # Render the shade
+                    path = self.render(edge_url, color, selfie_path)
+                except Exception as e:
+                    # Log the error, a failed prefetch only costs a later cache miss
+                    logging.error(f"Error occurred while prefetching VTO image: {e}")
+                    continue
+
+                # Only keep the render if no newer selfie arrived in the meantime
+                if path and self._is_current(number, generation):
+                    self.cache.put(number, edge_url, color, path)
+                elif path:
+                    os.remove(path)
+        finally:
+            with self._lock:
+                self._workers[number] -= 1
+                self._pending -= 1
+
+                # Forget the user's prefetch once its last worker is done
+                if self._workers[number] <= 0:
+                    del self._workers[number]
+                    job = self._jobs.get(number)
+                    if job is not None and not job[3]:
+                        del self._jobs[number]
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+# Import necessary libraries
+import os
+import sys
+import time
+import logging
+import threading
+import collections
+from typing import Dict, Optional
+
+# Set up logging with INFO level
+logging.basicConfig(level=logging.INFO)
+
+# The functions a thread sits in while it waits for work, whose samples are dropped unless idle stacks are asked for
+IDLE_FUNCTIONS = {
+    ("threading.py", "wait"),
+    ("queue.py", "get"),
+    ("selectors.py", "select"),
+    ("socketserver.py", "serve_forever"),
+    ("handlers.py", "dequeue"),
+    # The polling loops of the app, which sleep between checks
+    ("catalog.py", "watch"),
+    ("settings.py", "watch"),
+    ("warmup.py", "run"),
+}
+
+
+class ProfilerBusy(Exception):
+    """
+    This class is raised when a profile is requested while another one is running.
+    """
+
+
+class Profiler:
+    """
+    This class samples the Python stacks of every thread of the process for a while and counts them as collapsed stacks,
+    one "thread;outer function;...;inner function count" line per distinct stack, which flamegraph.pl, speedscope and
+    similar tools read directly.
+
+    Sampling runs on its own thread, started for one profile and gone after it, so the profiler costs nothing while no
+    profile is running. Only one profile runs at a time.
+    """
+
+    def __init__(self, max_seconds: float = 60.0, min_interval: float = 0.001) -> None:
+        """
+        Parameters:
+        max_seconds (float, optional): The longest profile that can be asked for. Defaults to 60.
+        min_interval (float, optional): The shortest interval between samples that can be asked for. Defaults to 1ms.
+        """
+        self.max_seconds = max_seconds
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+
+    def profile(self, seconds: float, interval: float = 0.01, idle: bool = False) -> str:
+        """
+        This function samples the stacks of every other thread for a number of seconds and returns them collapsed.
+
+        Parameters:
+        seconds (float): How long to sample for, capped at the longest profile allowed.
+        interval (float, optional): The time between samples, in seconds. Defaults to 10ms.
+        idle (bool, optional): Whether to keep the samples of threads waiting for work. Defaults to False.
+
+        Returns:
+        str: The collapsed stacks, most sampled first.
+
+        Raises:
+        ProfilerBusy: If another profile is running.
+        """
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy("a profile is already running")
+        try:
+            seconds = max(0.0, min(seconds, self.max_seconds))
+            interval = max(interval, self.min_interval)
+            stacks: Dict[str, int] = collections.Counter()
+
+            # Sample on a thread of its own, so the caller's thread can be told apart and left out
+            sampler = threading.Thread(
+                target=self._sample,
+                args=(stacks, seconds, interval, idle, threading.get_ident()),
+                name="profiler",
+                daemon=True,
+            )
+            started = time.perf_counter()
+            sampler.start()
+            sampler.join()
+            logging.info(
+                "Profiled for %.1fs: %d samples of %d stacks", time.perf_counter() - started, sum(stacks.values()), len(stacks)
+            )
+        finally:
+            self._lock.release()
+
+        return "".join("{} {}\n".format(stack, count) for stack, count in stacks.most_common())
+
+    def _sample(self, stacks: Dict[str, int], seconds: float, interval: float, idle: bool, caller: int) -> None:
+        # Sample until the profile is over, leaving out the sampler and the thread waiting for it
+        skip = {threading.get_ident(), caller}
+        deadline = time.perf_counter() + seconds
+        while True:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            frame = None
+            frames = sys._current_frames()
+            for ident, frame in frames.items():
+                if ident in skip:
+                    continue
+                stack = collapse(frame, idle)
+                if stack is not None:
+                    stacks["{};{}".format(names.get(ident, ident), stack)] += 1
+
+            # Let go of the frames, so the sampled threads' locals are not kept alive between samples
+            del frames, frame
+
+            # Wait for the next sample
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            time.sleep(min(interval, remaining))
+
+
+def collapse(frame, idle: bool = False) -> Optional[str]:
+    """
+    This function collapses the stack of a frame into one line, outermost function first.
+
+    Parameters:
+    frame (FrameType): The innermost frame of the stack.
+    idle (bool, optional): Whether to keep the stack of a thread waiting for work. Defaults to False.
+
+    Returns:
+    Optional[str]: The functions of the stack as "file:function", separated by ";", or None for a dropped idle stack.
+    """
+    code = frame.f_code
+    if not idle and (os.path.basename(code.co_filename), code.co_name) in IDLE_FUNCTIONS:
+        return None
+
+    functions = []
+    while frame is not None:
+        code = frame.f_code
+        functions.append(
+            "{}:{}".format(os.path.basename(code.co_filename), getattr(code, "co_qualname", code.co_name))
+        )
+        frame = frame.f_back
+    return ";".join(reversed(functions))
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+# Import necessary libraries
+import time
+import logging
+import threading
+import collections
+from typing import Callable, Dict, Optional, Tuple
+
+# Set up logging with INFO level
+logging.basicConfig(level=logging.INFO)
+
+
+class ReadReceipts:
+    """
+    This class sends read receipts off the path of the replies, from a background thread.
+
+    A receipt is held for a short delay before it is sent, so the replies to the message go out first. Marking a message
+    as read marks every earlier message of the conversation as read too, so while a user's receipt waits, a newer message
+    from them replaces it and one receipt covers both.
+    """
+
+    def __init__(self, send_receipt: Callable[[str, str], None], delay: float = 1.0, max_pending: int = 10000) -> None:
+        """
+        Parameters:
+        send_receipt (Callable[[str, str], None]): A function that sends a read receipt, by message ID and the ID of the
+        business phone number that received the message.
+        delay (float, optional): How long a receipt is held before it is sent, in seconds. Defaults to 1.
+        max_pending (int, optional): The most users with a receipt waiting; receipts beyond it are dropped. Defaults to 10000.
+        """
+        self.send_receipt = send_receipt
+        self.delay = delay
+        self.max_pending = max_pending
+
+        # The receipt waiting for each user, as the time it is due, the message ID and the business phone number ID
+        self._pending: "collections.OrderedDict[str, Tuple[float, str, Optional[str]]]" = collections.OrderedDict()
+        self._condition = threading.Condition()
+        self._sender: Optional[threading.Thread] = None
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+
+    def mark(self, number: str, message_id: str, number_id: Optional[str] = None) -> None:
+        """
+        This function queues a read receipt for a user's message, replacing the one waiting for their earlier message.
+
+        Parameters:
+        number (str): The phone number of the user.
+        message_id (str): The ID of the message.
+        number_id (Optional[str], optional): The ID of the business phone number that received it. Defaults to None.
+        """
+        with self._condition:
+            pending = self._pending.get(number)
+            if pending is not None:
+                # Keep the earlier message's place in the queue, and mark the newer message instead
+                self._pending[number] = (pending[0], message_id, number_id)
+                self.coalesced += 1
+                return
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return
+            self._pending[number] = (time.monotonic() + self.delay, message_id, number_id)
+
+            # Start the sender thread with the first receipt
+            if self._sender is None:
+                self._sender = threading.Thread(target=self.run, name="receipts", daemon=True)
+                self._sender.start()
+            self._condition.notify()
+
+    def run(self) -> None:
+        """
+        This function sends the receipts as they fall due, indefinitely.
+        """
+        while True:
+            # Wait for the oldest receipt to fall due
+            with self._condition:
+                while True:
+                    if self._pending:
+                        number, (due, message_id, number_id) = next(iter(self._pending.items()))
+                        wait = due - time.monotonic()
+                        if wait <= 0:
+                            del self._pending[number]
+                            break
+                        self._condition.wait(wait)
+                    else:
+                        self._condition.wait()
+
+            # Send the receipt outside the lock, so new receipts are never held up by the API
+            try:
+                self.send_receipt(message_id, number_id)
+                self.sent += 1
+            except Exception as e:
+                logging.error(f"Error occurred while sending a read receipt: {e}")
+
+    def snapshot(self) -> Dict[str, int]:
+        """
+        This function summarizes the receipts sent, coalesced into later ones, dropped and waiting.
+
+        Returns:
+        Dict[str, int]: The summary.
+        """
+        with self._condition:
+            return {"sent": self.sent, "coalesced": self.coalesced, "dropped": self.dropped, "pending": len(self._pending)}
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+# Import necessary libraries
+import time
+import logging
+import threading
+import collections
+from typing import Any, Callable, Dict, Optional
+
+# Set up logging with INFO level
+logging.basicConfig(level=logging.INFO)
+
+
+class Reengager:
+    """
+    This class re-engages users whose customer service window has closed, by sending them a template message.
+
+    WhatsApp only delivers free-form messages within 24 hours of the user's last message, and fails the others with
+    error 131047. The re-engager tracks each user's window from the messages they send and the failures reported, so
+    free-form sends bound to fail can be skipped. Re-engagement requests are coalesced: a user gets at most one template
+    per dedup window however many sends failed, and the templates go out from a background thread at a limited rate,
+    so a burst of failures never blocks the request worker or floods the API.
+    """
+
+    def __init__(
+        self,
+        send_template: Callable[[str, str], None],
+        window: float = 24 * 3600.0,
+        dedup_window: float = 3600.0,
+        rate: float = 1.0,
+        max_pending: int = 10000,
+    ) -> None:
+        """
+        Parameters:
+        send_template (Callable[[str, str], None]): A function that sends a template, by number and template name.
+        window (float, optional): How long after a user's last message free-form messages are delivered, in seconds. Defaults to 24 hours.
+        dedup_window (float, optional): How long after a template is sent to a user requests for another are dropped, in seconds. Defaults to 1 hour.
+        rate (float, optional): The most templates sent per second. Defaults to 1.
+        max_pending (int, optional): The most users waiting for a template; later requests are dropped. Defaults to 10000.
+        """
+        self.send_template = send_template
+        self.window = window
+        self.dedup_window = dedup_window
+        self.rate = rate
+        self.max_pending = max_pending
+
+        # The time of each user's last message, the users whose window has closed, and when each was last re-engaged
+        self._last_inbound: Dict[str, float] = {}
+        self._closed: Dict[str, float] = {}
+        self._last_sent: Dict[str, float] = {}
+
+        # The users waiting for a template, in the order they were requested, with the name of the template
+        self._pending: "collections.OrderedDict[str, str]" = collections.OrderedDict()
+        self._condition = threading.Condition()
+        self._sender: Optional[threading.Thread] = None
+        self.sent = 0
+        self.coalesced = 0
+        self.skipped = 0
+
+    def opened(self, number: str, sent_at: Any = None) -> None:
+        """
+        This function records a message from a user, which opens their customer service window. The window is timed
+        from when the user sent the message, so a message delivered late, after a backlog or a redelivery, does not
+        reopen a window that has since closed.
+
+        Parameters:
+        number (str): The phone number of the user.
+        sent_at (Any, optional): The Unix time the message was sent, as in its timestamp field. Defaults to now.
+        """
+        try:
+            sent_at = float(sent_at)
+        except (TypeError, ValueError):
+            sent_at = time.time()
+        with self._condition:
+            # Keep the latest message, and reopen the window only for messages sent after it was found closed
+            if sent_at > self._last_inbound.get(number, float("-inf")):
+                self._last_inbound[number] = sent_at
+            if sent_at > self._closed.get(number, float("-inf")):
+                self._closed.pop(number, None)
+
+    def is_closed(self, number: str) -> bool:
+        """
+        This function tells whether a free-form message to a user is bound to fail, because their window has closed:
+        their latest message was sent more than the window ago, or a send failed since it. Users the re-engager has not
+        seen a message from are assumed to be within their window.
+
+        Parameters:
+        number (str): The phone number of the user.
+
+        Returns:
+        bool: True if the window is known to be closed.
+        """
+        if number in self._closed:
+            return True
+        last_inbound = self._last_inbound.get(number)
+        return last_inbound is not None and time.time() - last_inbound > self.window
+
+    def request(self, number: str, template_name: str, failed_at: Any = None) -> bool:
+        """
+        This function records that a free-form message to a user failed because their window has closed, and queues a
+        template to re-engage them, unless one is already queued or was sent within the dedup window. A failure reported
+        late, after the user has sent a newer message, neither closes their window nor queues a template.
+
+        Parameters:
+        number (str): The phone number of the user.
+        template_name (str): The name of the template to send.
+        failed_at (Any, optional): The Unix time of the failure, as in the timestamp field of its status. Defaults to now.
+
+        Returns:
+        bool: True if a template was queued.
+        """
+        now = time.time()
+        try:
+            failed_at = float(failed_at)
+        except (TypeError, ValueError):
+            failed_at = now
+        with self._condition:
+            # Ignore a failure older than the user's latest message, which reopened their window
+            if failed_at < self._last_inbound.get(number, float("-inf")):
+                self.coalesced += 1
+                return False
+            self._closed[number] = failed_at
+
+            # Coalesce the request with a queued or recent template
+            if number in self._pending or now - self._last_sent.get(number, float("-inf")) < self.dedup_window:
+                self.coalesced += 1
+                return False
+            if len(self._pending) >= self.max_pending:
+                logging.warning("Re-engagement queue is full, dropping the template for a user")
+                return False
+            self._pending[number] = template_name
+
+            # Start the sender thread with the first request
+            if self._sender is None:
+                self._sender = threading.Thread(target=self.run, name="reengage", daemon=True)
+                self._sender.start()
+            self._condition.notify()
+        return True
+
+    def run(self) -> None:
+        """
+        This function sends the queued templates at the limited rate, indefinitely.
+        """
+        interval = 1.0 / self.rate if self.rate > 0 else 0.0
+        while True:
+            # Wait for a user to re-engage
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                number, template_name = self._pending.popitem(last=False)
+                self._last_sent[number] = time.time()
+                self._prune()
+
+            # Send the template outside the lock, so requests are never held up by the API
+            started = time.monotonic()
+            try:
+                self.send_template(number, template_name)
+                self.sent += 1
+            except Exception as e:
+                logging.error(f"Error occurred while sending a re-engagement template: {e}")
+
+            # Keep to the rate
+            delay = interval - (time.monotonic() - started)
+            if delay > 0:
+                time.sleep(delay)
+
+    def skip(self, count: int) -> None:
+        """
+        This function counts the free-form messages skipped because the user's window has closed.
+        """
+        with self._condition:
+            self.skipped += count
+
+    def _prune(self) -> None:
+        # Forget users whose windows and dedup windows have long passed, so the maps stay as small as the active users
+        now = time.time()
+        horizon = max(self.window, self.dedup_window)
+        for records in (self._last_inbound, self._closed, self._last_sent):
+            if len(records) > self.max_pending:
+                for number in [number for number, at in records.items() if now - at > horizon]:
+                    del records[number]
+
+    def snapshot(self) -> Dict[str, int]:
+        """
+        This function summarizes the re-engager for the admin routes.
+
+        Returns:
+        Dict[str, int]: The templates sent, coalesced and pending, the free-form sends skipped and the users known to be outside their window.
+        """
+        with self._condition:
+            return {
+                "sent": self.sent,
+                "coalesced": self.coalesced,
+                "pending": len(self._pending),
+                "skipped": self.skipped,
+                "closed": len(self._closed),
+            }
@@ -0,0 +1,466 @@
+# -*- coding: utf-8 -*-
+# Import necessary libraries
+import time
+import random
+import logging
+import threading
+import collections
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, wait, FIRST_COMPLETED
+from typing import Callable, Dict, Any
+import requests
+
+# Set up logging with INFO level
+logging.basicConfig(level=logging.INFO)
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """
+    This exception is raised instead of calling an endpoint whose circuit breaker is open.
+    It is a requests ConnectionError so existing request error handling treats it as a failed request.
+    """
+
+
+class CircuitBreaker:
+    """
+    This class tracks the health of one endpoint and fails calls fast while the endpoint is down.
+
+    The breaker opens after a number of consecutive failures, rejects calls until the reset timeout has passed,
+    then lets a single probe call through (half open) and closes again if that probe succeeds.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0) -> None:
+        # Store the thresholds of the breaker
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        # Start closed with no failures
+        self.state = self.CLOSED
+        self.failures = 0
+        self.times_opened = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """
+        This function checks whether a call may go through the breaker.
+
+        Returns:
+        bool: True if the call may be made, False if it should fail fast.
+        """
+        with self._lock:
+            if self.state == self.OPEN:
+                # Stay open until the reset timeout has passed, then let a probe through
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+
+            if self.state == self.HALF_OPEN:
+                # Only let one probe through at a time
+                if self._probe_in_flight:
+                    return False
+                self._probe_in_flight = True
+
+            return True
+
+    def record_success(self) -> None:
+        """
+        This function records a successful call, which closes the breaker.
+        """
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def release(self) -> None:
+        """
+        This function ends a call that failed before it reached the endpoint, such as on a missing file, which says
+        nothing about the endpoint's health: the state is kept, and a half open breaker lets the next probe through.
+        """
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        """
+        This function records a failed call, which opens the breaker after too many consecutive failures or a failed probe.
+        """
+        with self._lock:
+            self.failures += 1
+            self._probe_in_flight = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.times_opened += 1
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+# The value of each breaker state on the metrics route
+BREAKER_STATES = {CircuitBreaker.CLOSED: 0, CircuitBreaker.HALF_OPEN: 1, CircuitBreaker.OPEN: 2}
+
+
+class RetryBudget:
+    """
+    This class limits retries to a fraction of the calls made to an endpoint, so retries cannot multiply the load on a struggling service.
+
+    Every call deposits a fraction of a token and every retry withdraws a whole one.
+    """
+
+    def __init__(self, ratio: float = 0.2, max_tokens: float = 10.0) -> None:
+        # Start with a full budget
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._lock = threading.Lock()
+
+    def deposit(self) -> None:
+        """
+        This function adds the share of a call to the budget.
+        """
+        with self._lock:
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        """
+        This function takes a token for a retry.
+
+        Returns:
+        bool: True if the retry is within the budget, False otherwise.
+        """
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class EndpointState:
+    """
+    This class holds the circuit breaker, budgets, recent latencies and counters of one endpoint.
+    The counters are bumped from the request, pool and prefetch threads, so they are only changed under the lock.
+    """
+
+    __slots__ = ("breaker", "retry_budget", "hedge_budget", "latencies", "counters", "lock")
+
+    def __init__(
+        self,
+        breaker: CircuitBreaker,
+        retry_budget: RetryBudget,
+        hedge_budget: RetryBudget,
+        latency_window: int,
+    ) -> None:
+        self.breaker = breaker
+        self.retry_budget = retry_budget
+        self.hedge_budget = hedge_budget
+        self.latencies = collections.deque(maxlen=latency_window)
+        self.counters = collections.Counter(
+            calls=0,
+            failures=0,
+            retries=0,
+            short_circuits=0,
+            hedges=0,
+            hedge_wins=0,
+            speculative_calls=0,
+            speculative_failures=0,
+        )
+        self.lock = threading.Lock()
+
+    def count(self, name: str) -> None:
+        """
+        This function adds one to a counter of the endpoint.
+        """
+        with self.lock:
+            self.counters[name] += 1
+
+
+class EdgeGuard:
+    """
+    This class makes HTTP calls to external endpoints with timeouts, exponential backoff with jitter, retry budgets and circuit breakers.
+    Breakers, budgets and counters are kept per endpoint, keyed by the endpoint's base URL.
+
+    Calls can opt into hedging: if an attempt has not returned by a percentile of the endpoint's recent latencies,
+    an identical second attempt is fired, the first one to succeed wins and the other is abandoned.
+
+    Speculative calls, such as prefetched renders, make a single attempt and only while the breaker is closed. They
+    neither spend nor feed the budgets and their outcome is not recorded against the breaker, so background work can
+    never open it or use up the retries of real requests.
+    """
+
+    def __init__(
+        self,
+        connect_timeout: float = 3.05,
+        read_timeout: float = 30.0,
+        backoff_base: float = 0.5,
+        backoff_cap: float = 8.0,
+        retry_budget_ratio: float = 0.2,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        hedge_percentile: float = 95.0,
+        hedge_min_delay: float = 0.5,
+        hedge_max_delay: float = 10.0,
+        hedge_budget_ratio: float = 0.1,
+        hedge_max_workers: int = 16,
+        latency_window: int = 200,
+    ) -> None:
+        # Store the settings shared by every endpoint
+        self.timeout = (connect_timeout, read_timeout)
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.retry_budget_ratio = retry_budget_ratio
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_max_delay = hedge_max_delay
+        self.hedge_budget_ratio = hedge_budget_ratio
+        self.hedge_max_workers = hedge_max_workers
+        self.latency_window = latency_window
+
+        # Keep the state of each endpoint, and the thread pool for hedged calls once one is made
+        self._endpoints = {}
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _endpoint(self, endpoint: str) -> EndpointState:
+        # Create the state of an endpoint the first time it is called
+        with self._lock:
+            if endpoint not in self._endpoints:
+                self._endpoints[endpoint] = EndpointState(
+                    CircuitBreaker(self.failure_threshold, self.reset_timeout),
+                    RetryBudget(self.retry_budget_ratio),
+                    RetryBudget(self.hedge_budget_ratio),
+                    self.latency_window,
+                )
+            return self._endpoints[endpoint]
+
+    def is_closed(self, endpoint: str) -> bool:
+        """
+        This function checks whether an endpoint's circuit breaker is closed, as it is for endpoints not called yet.
+
+        Returns:
+        bool: True if the breaker is closed, False if it is open or half open.
+        """
+        with self._lock:
+            state = self._endpoints.get(endpoint)
+        return state is None or state.breaker.state == CircuitBreaker.CLOSED
+
+    def reading(self, endpoint: str, name: str) -> float:
+        """
+        This function reads one figure of an endpoint for a metrics gauge: its breaker state, as 0 for closed, 1 for half
+        open and 2 for open, or one of its counters. Endpoints not called yet read as closed with no calls.
+
+        Parameters:
+        endpoint (str): The base URL of the endpoint.
+        name (str): "state", or the name of a counter such as "failures".
+
+        Returns:
+        float: The figure.
+        """
+        with self._lock:
+            state = self._endpoints.get(endpoint)
+        if state is None:
+            return 0.0
+        if name == "state":
+            return float(BREAKER_STATES[state.breaker.state])
+        with state.lock:
+            return float(state.counters[name])
+
+    def hedge_delay(self, endpoint: str) -> float:
+        """
+        This function returns how long a hedged call to an endpoint waits before firing its second attempt.
+
+        Returns:
+        float: The configured percentile of the endpoint's recent latencies, clamped to the minimum and maximum delay.
+        """
+        # Wait the maximum delay until enough latencies have been observed
+        latencies = sorted(self._endpoint(endpoint).latencies)
+        if len(latencies) < 20:
+            return self.hedge_max_delay
+
+        # Take the percentile of the recent latencies
+        index = min(len(latencies) - 1, int(len(latencies) * self.hedge_percentile / 100))
+        return min(self.hedge_max_delay, max(self.hedge_min_delay, latencies[index]))
+
+    def call(
+        self,
+        endpoint: str,
+        send: Callable[[Any], requests.Response],
+        retries: int = 3,
+        hedge: bool = False,
+        speculative: bool = False,
+    ) -> requests.Response:
+        """
+        This function calls an endpoint through its circuit breaker, retrying failures with exponential backoff and jitter.
+
+        Parameters:
+        endpoint (str): The base URL of the endpoint, used to key its breaker and counters.
+        send (Callable[[Any], requests.Response]): A function that makes the request with the given timeout and returns the response.
+        retries (int, optional): The maximum number of attempts. Defaults to 3.
+        hedge (bool, optional): Whether to hedge slow attempts with a second identical one. Defaults to False.
+        speculative (bool, optional): Whether the call is background work that must not affect real requests: it makes
+        one attempt, without hedging, and leaves the breaker and budgets untouched. Defaults to False.
+
+        Returns:
+        requests.Response: The successful response.
+
+        Raises:
+        CircuitOpenError: If the endpoint's circuit breaker is open, or for speculative calls, not closed.
+        requests.exceptions.RequestException: If the last attempt fails, or a retry is not allowed by the budget.
+        """
+        if speculative:
+            return self._speculative(endpoint, send)
+
+        state = self._endpoint(endpoint)
+        breaker, budget = state.breaker, state.retry_budget
+        budget.deposit()
+        if hedge:
+            state.hedge_budget.deposit()
+
+        for attempt in range(retries):
+            # Fail fast if the endpoint is known to be down
+            if not breaker.allow():
+                state.count("short_circuits")
+                raise CircuitOpenError("Circuit open for {}".format(endpoint))
+
+            state.count("calls")
+            try:
+                # Make the request, hedging it if asked to
+                start = time.monotonic()
+                if hedge:
+                    response = self._hedged(endpoint, state, send)
+                else:
+                    response = self._attempt(send)
+
+                # Record the latency of the successful call
+                state.latencies.append(time.monotonic() - start)
+                breaker.record_success()
+                return response
+            except requests.exceptions.RequestException as e:
+                # Client errors mean the endpoint is up, so they are neither retried nor counted against it
+                status_code = getattr(e.response, "status_code", None)
+                if status_code is not None and status_code < 500 and status_code != 429:
+                    breaker.record_success()
+                    raise
+
+                state.count("failures")
+                breaker.record_failure()
+
+                # Give up on the last attempt or once the retry budget is spent
+                if attempt == retries - 1 or not budget.withdraw():
+                    raise
+
+                # Wait a random time up to the exponential backoff before retrying
+                state.count("retries")
+                delay = random.uniform(
+                    0, min(self.backoff_cap, self.backoff_base * 2**attempt)
+                )
+                logging.warning(
+                    f"Request to {endpoint} failed ({e}), retrying in {delay:.2f}s"
+                )
+                time.sleep(delay)
+            except BaseException:
+                # Release the probe of a half open breaker, or the breaker would wait for its outcome forever
+                breaker.release()
+                raise
+
+    def _speculative(self, endpoint: str, send: Callable[[Any], requests.Response]) -> requests.Response:
+        # Only call an endpoint that is known to be up, without taking the probe of a half open breaker
+        state = self._endpoint(endpoint)
+        if state.breaker.state != CircuitBreaker.CLOSED:
+            raise CircuitOpenError("Circuit not closed for {}, skipping speculative call".format(endpoint))
+
+        # Make a single attempt, counting it apart from the calls of real requests
+        state.count("speculative_calls")
+        try:
+            return self._attempt(send)
+        except requests.exceptions.RequestException:
+            state.count("speculative_failures")
+            raise
+
+    def _attempt(self, send: Callable[[Any], requests.Response]) -> requests.Response:
+        # Make the request and raise an exception if it was unsuccessful
+        response = send(self.timeout)
+        response.raise_for_status()
+        return response
+
+    def _hedged(
+        self,
+        endpoint: str,
+        state: EndpointState,
+        send: Callable[[Any], requests.Response],
+    ) -> requests.Response:
+        # Create the thread pool for hedged attempts the first time it is needed
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.hedge_max_workers, thread_name_prefix="hedge"
+                )
+
+        # Make the first attempt in the caller's context and wait for it up to the hedge delay
+        first = self._executor.submit(contextvars.copy_context().run, self._attempt, send)
+        try:
+            return first.result(timeout=self.hedge_delay(endpoint))
+        except TimeoutError:
+            pass
+
+        # If the hedge budget is spent, keep waiting for the first attempt
+        if not state.hedge_budget.withdraw():
+            return first.result()
+
+        # Fire a second identical attempt
+        state.count("hedges")
+        second = self._executor.submit(contextvars.copy_context().run, self._attempt, send)
+
+        # Return the first attempt to succeed, or raise the last error if both fail
+        pending = {first, second}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = future.exception()
+                    continue
+                if future is second:
+                    state.count("hedge_wins")
+
+                # Abandon the other attempt, closing its response if it still arrives
+                for loser in pending:
+                    loser.cancel()
+                    loser.add_done_callback(_close_response)
+                return future.result()
+        raise error
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """
+        This function returns the breaker state and counters of every endpoint.
+
+        Returns:
+        Dict[str, Dict[str, Any]]: A dictionary mapping each endpoint to its breaker state and counters.
+        """
+        with self._lock:
+            return {
+                endpoint: {
+                    "state": state.breaker.state,
+                    "consecutive_failures": state.breaker.failures,
+                    "times_opened": state.breaker.times_opened,
+                    **_counters(state),
+                }
+                for endpoint, state in self._endpoints.items()
+            }
+
+
+def _counters(state: EndpointState) -> Dict[str, int]:
+    # Copy the counters of an endpoint under its lock
+    with state.lock:
+        return dict(state.counters)
+
+
+def _close_response(future) -> None:
+    # Close the response of an abandoned hedged attempt so its connection is released
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 # Import necessary libraries
-from flask import Flask, request
+from flask import Flask, Response, request
+import hmac
+import json
 from waitress import serve
 import services
 import os
@@ -8,6 +10,11 @@ import logging
 from dotenv import load_dotenv
 import queue
 import threading
+import time
+from metrics import metrics
+from logs import log_payload, truncated
+from profiler import ProfilerBusy
+from ingest import routine_statuses
 
 # Load environment variables from .env file
 load_dotenv()
@@ -23,6 +30,9 @@ if app_token is None:
     logging.error("APP_TOKEN environment variable not set.")
     exit(1)
 
+# Get the token of the admin routes from environment variables; the admin routes are off without it
+admin_token = os.getenv("ADMIN_TOKEN")
+
 # Create a Flask application
 app = Flask(__name__)
 
@@ -41,6 +51,119 @@ def welcome():
     # Return a welcome message
     return "Hello there! My name is AIySha - your personal digital beauty advisor from roboMUA!"
 
+# Define the warm-up route, which App Engine requests before sending traffic to a new instance
+@app.route("/_ah/warmup", methods=["GET"])
+def warmup():
+    # Load the libraries and clients the first messages would otherwise wait for
+    services.warm_up()
+    return "", 200
+
+# Define a function to check the token of an admin request
+def is_admin(req) -> bool:
+    # Accept the token as a bearer token, compared in constant time
+    supplied = req.headers.get("Authorization", "")
+    return admin_token is not None and hmac.compare_digest(supplied, "Bearer " + admin_token)
+
+# Define the breakers route
+@app.route("/breakers", methods=["GET"])
+def breakers():
+    # Refuse requests without the admin token, since the stats name the internal edges and users' activity
+    if not is_admin(request):
+        return "Forbidden.", 403
+
+    # Return the circuit breaker state and counters of every edge
+    return services.edge_guard.snapshot()
+
+# Define the warmup stats route
+@app.route("/warmup/stats", methods=["GET"])
+def warmup_stats():
+    # Refuse requests without the admin token, since the stats name the internal edges and users' activity
+    if not is_admin(request):
+        return "Forbidden.", 403
+
+    # Return the keep-warm ping counts and cold-start latencies of every edge host
+    return services.keep_warm.snapshot()
+
+# Define the re-engagement route
+@app.route("/reengage", methods=["GET"])
+def reengage():
+    # Refuse requests without the admin token, since the stats name the internal edges and users' activity
+    if not is_admin(request):
+        return "Forbidden.", 403
+
+    # Return the re-engagement templates sent, coalesced and pending, and the users outside their window
+    return services.reengager.snapshot()
+
+# Define the outbound route
+@app.route("/outbound", methods=["GET"])
+def outbound():
+    # Refuse requests without the admin token, since the stats name the internal edges and users' activity
+    if not is_admin(request):
+        return "Forbidden.", 403
+
+    # Return the send rates of every business number and the recipients slowed down
+    return services.outbound.snapshot()
+
+# Define the read receipts route
+@app.route("/receipts", methods=["GET"])
+def read_receipts():
+    # Refuse requests without the admin token, since the stats name the internal edges and users' activity
+    if not is_admin(request):
+        return "Forbidden.", 403
+
+    # Return the read receipts sent, coalesced, dropped and waiting
+    return services.receipts.snapshot()
+
+# Define the metrics route
+@app.route("/metrics", methods=["GET"])
+def metrics_route():
+    # Return the stage latencies and counters in the Prometheus text format
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+# Define the profile route
+@app.route("/admin/profile", methods=["POST"])
+def profile():
+    # Refuse requests without the admin token
+    if not is_admin(request):
+        return "Forbidden.", 403
+
+    # Sample the stacks of every thread for the requested seconds
+    try:
+        seconds = float(request.args.get("seconds", 10))
+        interval = float(request.args.get("interval", 0.01))
+        idle = request.args.get("idle", "false").lower() in ("1", "true", "yes")
+        stacks = services.profiler.profile(seconds, interval, idle)
+    except ValueError:
+        return "seconds and interval must be numbers.", 400
+    except ProfilerBusy as e:
+        return "{}.".format(e), 409
+
+    # Return the collapsed stacks as a file flamegraph tools read
+    return Response(
+        stacks,
+        mimetype="text/plain",
+        headers={"Content-Disposition": "attachment; filename=profile-{}.collapsed".format(int(time.time()))},
+    )
+
+# Define the reload route
+@app.route("/admin/reload", methods=["POST"])
+def reload():
+    # Refuse requests without the admin token
+    if not is_admin(request):
+        return "Forbidden.", 403
+
+    # Swap in new snapshots of config.ini and options.json now, rather than at the next check, and list the sections
+    # of config.ini changed since startup that only take effect after a restart
+    try:
+        return {
+            "settings": services.settings.reload(),
+            "catalog": services.catalog.reload(),
+            "restart_required": services.settings.restart_required,
+        }
+    except Exception as e:
+        logging.error(f"Error occurred while reloading: {e}")
+        return "Reload failed, the current settings and catalog are kept.", 500
+
 # Define the webhook route for GET requests
 @app.route("/webhook", methods=["GET"])
 def verify_token():
@@ -64,15 +187,20 @@ def verify_token():
 # Create a queue to store the requests
 request_queue = queue.Queue()
 
-# Define a function to process the requests
-def process_requests():
-    # Process the requests indefinitely
-    while True:
-        # Get a request from the queue
-        body = request_queue.get()
-        
-        logging.info('INCOMING BODY >>>>> {}'.format(body))
-        
+# Report the number of requests waiting in the queue on every scrape
+metrics.gauge("queue_depth", request_queue.qsize)
+
+# Define a function to process one request
+def process_request(body, waited=0.0):
+    # Trace the request under the ID of its message, from the time it was accepted
+    with services.tracer.trace("message", services.get_message_id(body), elapsed=waited):
+        # Log the body inside the trace, so it is always logged for traced messages
+        log_payload("INCOMING BODY >>>>> %s", truncated(body))
+
+        # Record the wait in the queue as the first step of the trace
+        with services.tracer.span("queue_wait", elapsed=waited):
+            pass
+
         # Try to process the request
         try:
             # Get the entry, changes, and value from the request body
@@ -93,8 +221,8 @@ def process_requests():
                     
                     logging.info('SETTING UP TEMPLATE MESSAGE...')
 
-                    # Call the function with the recipient ID
-                    services.send_robotemp(number, "ytemp")
+                    # Queue a template for the recipient, coalesced with any other failures of theirs, as of when it failed
+                    services.reengager.request(number, "ytemp", status.get("timestamp"))
                 else:
                     # If the value contains messages and contacts, process this request
                     if "messages" in value and "contacts" in value:
@@ -106,6 +234,9 @@ def process_requests():
                         contacts = value["contacts"][0]
                         name = contacts["profile"]["name"]
 
+                        # Record that the user's customer service window is open, from when they sent the message
+                        services.reengager.opened(number, message.get("timestamp"))
+
                         text = services.get_whatsapp_message(message)
                         services.manage_chatbot(text, number, messageId, name, numberId)
             else:
@@ -119,6 +250,9 @@ def process_requests():
                     contacts = value["contacts"][0]
                     name = contacts["profile"]["name"]
 
+                    # Record that the user's customer service window is open, from when they sent the message
+                    services.reengager.opened(number, message.get("timestamp"))
+
                     text = services.get_whatsapp_message(message)
                     services.manage_chatbot(text, number, messageId, name, numberId)
 
@@ -159,17 +293,67 @@ def process_requests():
         except Exception as e:
             logging.error("Error processing message: {}".format(e))
 
+# Define a function to process the requests
+def process_requests():
+    # Process the requests indefinitely
+    while True:
+        # Get a request from the queue, with the time it was accepted
+        accepted, body = request_queue.get()
+        waited = time.perf_counter() - accepted
+        metrics.observe("queue_wait", waited)
+
+        # Process the request
+        process_request(body, waited)
+
         # Mark the request as done
         request_queue.task_done()
 
 # Start a daemon thread to process the requests
 threading.Thread(target=process_requests, daemon=True).start()
 
+# If keep-warm is enabled, start a daemon thread to keep the edges awake
+if services.keep_warm_enabled:
+    threading.Thread(target=services.keep_warm.run, daemon=True).start()
+
+# Start a daemon thread to upload the static media files in bulk
+threading.Thread(target=services.preload_media, daemon=True).start()
+
+# Start a daemon thread to reload the catalog when options.json changes
+threading.Thread(
+    target=services.catalog.watch, args=(services.catalog_reload_interval,), daemon=True
+).start()
+
+# Start a daemon thread to reload the settings when config.ini changes
+threading.Thread(
+    target=services.settings.watch, args=(services.settings_reload_interval,), daemon=True
+).start()
+
 # Define the webhook route for POST requests
 @app.route("/webhook", methods=["POST"])
 def receive_messages():
-    # Put the request data into the queue
-    request_queue.put(request.get_json())
+    # Put the request data into the queue, with the time it was accepted
+    with metrics.timer("webhook"):
+        # Count the status callbacks that need no processing by their statuses, without parsing or queueing them
+        raw = request.get_data()
+        statuses = routine_statuses(raw)
+        if statuses is not None:
+            for status in statuses:
+                metrics.count("statuses_" + status)
+
+            # Capture the callback for replaying, if capturing is enabled and it is valid JSON
+            if services.recorder is not None:
+                try:
+                    services.recorder.record(json.loads(raw))
+                except ValueError:
+                    logging.warning("Not capturing a status callback that is not valid JSON")
+            return "Request received!", 200
+
+        body = request.get_json()
+        request_queue.put((time.perf_counter(), body))
+
+        # Capture the request for replaying, if capturing is enabled
+        if services.recorder is not None:
+            services.recorder.record(body)
     # Return a success message
     return "Request received!", 200
 
@@ -7,17 +7,38 @@ import os
 import logging
 import base64
 import collections
+import contextvars
 import textwrap
-from typing import Tuple, List, Dict, Optional, Any
-from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
+from typing import IO, Tuple, List, Dict, Optional, Any
 from io import BytesIO
 from tempfile import NamedTemporaryFile
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
 import configparser
 from dotenv import load_dotenv
-from data import greetings, all_image_options, plus_color_options
-from llama import get_model_response
+from data import (
+    greetings,
+    all_image_options,
+    plus_color_options,
+    compare_shades_option,
+)
+from llama import get_model_response, get_prediction_client, VERTEX_EMULATOR_HOST
+from prefetch import RenderCache, Prefetcher
+from payloads import PayloadTemplate
+from catalog import Catalog, CatalogIndex, BRANDS, SHADES, STYLES
+from matcher import Matcher, best_match
+from resilience import EdgeGuard
+from warmup import KeepWarm
+from documents import RecommendationsPdf, PdfCache
+from media import MediaRegistry, digest_file, digest_path
+from metrics import metrics
+from tracing import Tracer
+from logs import setup_logging, log_payload, truncated, Lazy
+from capture import Recorder
+from profiler import Profiler
+from reengage import Reengager
+from outbound import OutboundScheduler, INTERACTIVE, TEMPLATE, RECEIPT
+from receipts import ReadReceipts
+from settings import SettingsStore
 
 # Load environment variables from .env file
 load_dotenv()
@@ -25,26 +46,175 @@ load_dotenv()
 # Set up logging with INFO level
 logging.basicConfig(level=logging.INFO)
 
-# Open and load JSON data from options.json file
-with open("options.json") as f:
-    feats = json.load(f)
-
 # Read configuration from config.ini file
 config = configparser.ConfigParser()
 config.read("config.ini")
 
-# Get URLs for different services from the configuration
-hair_color_try_on_edge = config["url"]["hair_color_try_on_edge"]
-lip_stick_try_on_edge = config["url"]["lip_stick_try_on_edge"]
-lip_liner_try_on_edge = config["url"]["lip_liner_try_on_edge"]
-hair_style_try_on_edge = config["url"]["hair_style_try_on_edge"]
-foundation_recs_edge = config["url"]["foundation_recs_edge"]
-concealer_recs_edge = config["url"]["concealer_recs_edge"]
-setting_powder_recs_edge = config["url"]["setting_powder_recs_edge"]
-contour_recs_edge = config["url"]["contour_recs_edge"]
-bronzer_recs_edge = config["url"]["bronzer_recs_edge"]
-shape_wear_recs_edge = config["url"]["shape_wear_recs_edge"]
-nude_shoes_recs_edge = config["url"]["nude_shoes_recs_edge"]
+# Route the logs through a background thread, sampling the verbose payloads
+log_listener = setup_logging(
+    level=config.get("logging", "level", fallback="INFO"),
+    json_format=config.getboolean("logging", "json", fallback=False),
+    payload_sample_rate=config.getfloat("logging", "payload_sample_rate", fallback=0.01),
+    queue_size=config.getint("logging", "queue_size", fallback=10000),
+)
+
+# Build the snapshot of the environment and config.ini the request paths read, which a reload of config.ini replaces
+settings = SettingsStore("config.ini")
+
+# Create the guard that applies timeouts, retries and circuit breakers to calls to the edges and WhatsApp
+edge_guard = EdgeGuard(
+    connect_timeout=config.getfloat("resilience", "connect_timeout", fallback=3.05),
+    read_timeout=config.getfloat("resilience", "read_timeout", fallback=30.0),
+    backoff_base=config.getfloat("resilience", "backoff_base", fallback=0.5),
+    backoff_cap=config.getfloat("resilience", "backoff_cap", fallback=8.0),
+    retry_budget_ratio=config.getfloat("resilience", "retry_budget_ratio", fallback=0.2),
+    failure_threshold=config.getint("resilience", "failure_threshold", fallback=5),
+    reset_timeout=config.getfloat("resilience", "reset_timeout", fallback=30.0),
+    hedge_percentile=config.getfloat("hedging", "percentile", fallback=95.0),
+    hedge_min_delay=config.getfloat("hedging", "min_delay", fallback=0.5),
+    hedge_max_delay=config.getfloat("hedging", "max_delay", fallback=10.0),
+    hedge_budget_ratio=config.getfloat("hedging", "budget_ratio", fallback=0.1),
+)
+
+# Report the breaker state, short circuits, failures and retries of every edge on the metrics route, named after its key
+# in config.ini rather than its URL
+for edge_key, edge_url in config["url"].items():
+    for reading in ("state", "short_circuits", "failures", "retries"):
+        metrics.gauge(
+            "edge_{}_breaker_{}".format(edge_key.replace("_edge", ""), reading),
+            lambda edge_url=edge_url, reading=reading: edge_guard.reading(edge_url, reading),
+        )
+
+# Get the settings for rendering several try-on shades from one selfie
+vto_batch_max_workers = config.getint("vto", "batch_max_workers", fallback=4)
+vto_grid_cell_width = config.getint("vto", "grid_cell_width", fallback=480)
+
+# Create the scheduler that keeps the Heroku apps behind the edges awake
+keep_warm = KeepWarm(
+    config["url"].values(),
+    active_interval=config.getfloat("warmup", "active_interval", fallback=1200.0),
+    idle_after=config.getfloat("warmup", "idle_after", fallback=7200.0),
+    prewarm_interval=config.getfloat("warmup", "prewarm_interval", fallback=300.0),
+    cold_threshold=config.getfloat("warmup", "cold_threshold", fallback=5.0),
+    check_interval=config.getfloat("warmup", "check_interval", fallback=60.0),
+)
+keep_warm_enabled = config.getboolean("warmup", "enabled", fallback=False)
+
+# Get whether stage latencies and counters are recorded for the metrics route
+metrics.enabled = config.getboolean("metrics", "enabled", fallback=True)
+
+# Create the tracer that follows a sample of messages through the pipeline, and trace every timed stage with it
+tracer = Tracer(
+    service_name=config.get("tracing", "service_name", fallback="aiysha"),
+    sample_rate=config.getfloat("tracing", "sample_rate", fallback=0.01)
+    if config.getboolean("tracing", "enabled", fallback=True)
+    else 0.0,
+    path=config.get("tracing", "path", fallback="") or None,
+    collector_url=config.get("tracing", "collector_url", fallback="") or None,
+)
+metrics.tracer = tracer
+
+# Get the secret mixed into the hashed phone numbers of captures; unsalted hashes of phone numbers are easy to reverse
+capture_salt = os.getenv("CAPTURE_SALT") or config.get("capture", "salt", fallback="")
+capture_enabled = config.getboolean("capture", "enabled", fallback=False)
+if capture_enabled and not capture_salt:
+    logging.error("Capture is enabled but neither CAPTURE_SALT nor [capture] salt is set, so requests are not captured.")
+    capture_enabled = False
+
+# Create the recorder that captures sanitized webhook bodies for replaying, if capturing is enabled
+recorder = (
+    Recorder(
+        path=config.get("capture", "path", fallback="/tmp/aiysha_requests.jsonl"),
+        max_bytes=config.getint("capture", "max_bytes", fallback=50 * 1024 * 1024),
+        backups=config.getint("capture", "backups", fallback=5),
+        salt=capture_salt,
+        max_queue=config.getint("capture", "queue_size", fallback=10000),
+    )
+    if capture_enabled
+    else None
+)
+
+# Create the scheduler that paces the messages sent within the Graph API's limits per business number and per recipient
+outbound = OutboundScheduler(
+    number_rate=config.getfloat("outbound", "number_rate", fallback=80.0),
+    number_burst=config.getfloat("outbound", "number_burst", fallback=80.0),
+    recipient_rate=config.getfloat("outbound", "recipient_rate", fallback=1 / 6),
+    recipient_burst=config.getfloat("outbound", "recipient_burst", fallback=10.0),
+    pause=config.getfloat("outbound", "pause", fallback=6.0),
+    max_retries=config.getint("outbound", "max_retries", fallback=2),
+    max_deferred=config.getint("outbound", "max_deferred", fallback=10000),
+)
+
+# Create the read receipts sent in the background, a newer message of a user's replacing their receipt still waiting
+receipts = ReadReceipts(
+    lambda message_id, number_id: send_whatsapp_message(mark_read_message(message_id), None, number_id, RECEIPT),
+    delay=config.getfloat("receipts", "delay", fallback=1.0),
+)
+
+# Create the re-engager that sends templates to users outside their customer service window, coalescing repeated failures
+reengager = Reengager(
+    lambda number, template_name: send_robotemp(number, template_name),
+    window=config.getfloat("reengage", "window_hours", fallback=24.0) * 3600,
+    dedup_window=config.getfloat("reengage", "dedup_window", fallback=3600.0),
+    rate=config.getfloat("reengage", "rate", fallback=1.0),
+)
+
+# Get the parts of the application loaded by warm-up requests instead of by the first messages
+startup_warm_up = [part.strip() for part in config.get("startup", "warm_up", fallback="pil, pdf, llama").split(",") if part.strip()]
+
+# Create the sampling profiler the admin route runs on demand
+profiler = Profiler(
+    max_seconds=config.getfloat("profiler", "max_seconds", fallback=60.0),
+    min_interval=config.getfloat("profiler", "min_interval", fallback=0.001),
+)
+
+# Map each type of static media to the files listed in its section of config.ini, by name
+static_media = {
+    media_type: dict(config[media_type])
+    for media_type in ("sticker", "image", "video", "audio")
+    if config.has_section(media_type)
+}
+
+# Map the extensions of static media files to their MIME types
+media_types = {
+    ".jpg": "image/jpeg",
+    ".png": "image/png",
+    ".webp": "image/webp",
+    ".mp4": "video/mp4",
+    ".3gp": "video/3gpp",
+    ".aac": "audio/aac",
+    ".amr": "audio/amr",
+    ".mp3": "audio/mpeg",
+    ".ogg": "audio/ogg",
+}
+
+# Create the registry of uploaded media, so the same content is uploaded once until WhatsApp expires it
+media_registry = MediaRegistry(
+    config.get("media", "registry_path", fallback="") or None,
+    ttl=config.getfloat("media", "ttl_seconds", fallback=29 * 24 * 3600.0),
+    max_entries=config.getint("media", "max_entries", fallback=10000),
+)
+media_preload_workers = config.getint("media", "preload_workers", fallback=4)
+
+
+def get_message_id(body: Dict) -> Optional[str]:
+    """
+    This function finds the WhatsApp ID of the message a webhook request is about.
+
+    Parameters:
+    body (dict): The body of the webhook request.
+
+    Returns:
+    Optional[str]: The ID of the incoming message, or of the message a status is about, or None if there is neither.
+    """
+    try:
+        value = body["entry"][0]["changes"][0]["value"]
+        for key in ("messages", "statuses"):
+            if value.get(key):
+                return value[key][0].get("id")
+    except (KeyError, IndexError, TypeError, AttributeError):
+        pass
+    return None
 
 
 def get_whatsapp_message(message: Dict) -> str:
@@ -95,47 +265,49 @@ def get_whatsapp_message(message: Dict) -> str:
     return text
 
 
-def send_whatsapp_message(data: str) -> Tuple[str, int]:
+@metrics.timed("send_whatsapp_message")
+def send_whatsapp_message(
+    data: str,
+    number: Optional[str] = None,
+    number_id: Optional[str] = None,
+    priority: int = INTERACTIVE,
+) -> Tuple[str, int]:
     """
-    This function sends a WhatsApp message using the provided data.
+    This function sends a WhatsApp message using the provided data, or queues it until its recipient's rate limit allows it.
 
     Parameters:
     data (str): A string containing the WhatsApp message data.
+    number (Optional[str], optional): The phone number of the recipient, or None for read receipts. Defaults to None.
+    number_id (Optional[str], optional): The ID of the business phone number sending it. Defaults to the one in the WhatsApp URL.
+    priority (int, optional): The priority class of the message: INTERACTIVE, TEMPLATE or RECEIPT. Defaults to INTERACTIVE.
 
     Returns:
     Tuple[str, int]: A tuple containing a message about the status of the operation and an HTTP status code.
     """
-    logging.info('SENDING THIS DATA >>> {}'.format(data))
+    log_payload("SENDING THIS DATA >>> %s", truncated(data))
     try:
-        # Get the WhatsApp token and environment variables
-        whatsapp_token = os.getenv("WHATSAPP_TOKEN")
-        flask_env = os.getenv("FLASK_ENV")
-
-        # Determine the WhatsApp URL based on the environment
-        whatsapp_url = (
-            os.getenv("WHATSAPP_URL_DEV")
-            if flask_env == "development"
-            else os.getenv("WHATSAPP_URL_PROD")
+        # Take the settings once, with the WhatsApp URL and headers resolved when they were loaded
+        current = settings.current
+
+        # Send the POST request to the WhatsApp URL within the rate limits of the sender, deferring it to the background
+        # if the recipient has to wait for their limit, so other users are not held up
+        response = outbound.dispatch(
+            lambda: requests.post(
+                current.whatsapp_url, headers=current.json_headers, data=data, timeout=edge_guard.timeout
+            ),
+            number_id or current.sender_id,
+            number,
+            priority,
         )
-
-        # Define the headers for the request
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": "Bearer " + whatsapp_token,
-        }
-
-        # Send the POST request to the WhatsApp URL
-        response = requests.post(whatsapp_url, headers=headers, data=data)
+        if response is None:
+            return "message queued", 202
         
-        logging.info('RESPONSE FROM SERVER >>> {}'.format(response.json()))
+        log_payload("RESPONSE FROM SERVER >>> %s", Lazy(response.json))
 
         # If the request was unsuccessful, raise an exception
         response.raise_for_status()
-
-        # Wait for 5 seconds to ensure the message is sent
-        time.sleep(5)
         
-        logging.info('MESSAGE SENT!')
+        logging.debug("MESSAGE SENT!")
 
         # Return a success message and status code
         return "message sent!", 200
@@ -196,7 +368,7 @@ def send_robotemp(number: str, template_name: str) -> None:
     
     logging.info('SENDING TEMPLATE MESSAGE...')
     
-    send_whatsapp_message(temp_msg)
+    send_whatsapp_message(temp_msg, number, priority=TEMPLATE)
     
     
 def text_message(number: str, text: str) -> str:
@@ -413,31 +585,93 @@ def sticker_message(number: str, sticker_id: str) -> str:
     return data
 
 
-def get_media_id(media_name: str, media_type: str) -> Optional[str]:
+def get_media_id(
+    media_name: str, media_type: str, number_id: Optional[str] = None
+) -> Optional[str]:
     """
     This function retrieves the ID of a media file based on its name and type.
+    The file is uploaded the first time it is needed, and again once its upload has expired.
 
     Parameters:
     media_name (str): The name of the media file.
     media_type (str): The type of the media file. It can be 'sticker', 'image', 'video', or 'audio'.
+    number_id (Optional[str], optional): The ID of the phone number the media is sent from. Defaults to the WHATSAPP_NUMBER_ID environment variable.
 
     Returns:
     Optional[str]: The ID of the media file if it exists, None otherwise.
     """
-    # Initialize the media ID as an empty string
-    media_id = ""
+    # Find the file of the media in the section of its type in config.ini
+    media_path = static_media.get(media_type, {}).get(media_name)
+    if media_path is None:
+        return None
 
-    # Retrieve the media ID based on the media type
-    if media_type == "sticker":
-        media_id = STICKER_ID.get(media_name, None)
-    elif media_type == "image":
-        media_id = IMAGE_ID.get(media_name, None)
-    elif media_type == "video":
-        media_id = VIDEO_ID.get(media_name, None)
-    elif media_type == "audio":
-        media_id = AUDIO_ID.get(media_name, None)
+    # Get the phone number ID to upload the media from
+    number_id = number_id or settings.current.whatsapp_number_id
+    if not number_id:
+        logging.error("No phone number ID to upload {} {} from.".format(media_type, media_name))
+        return None
+
+    # Upload the media, unless it was already uploaded and has not expired
+    try:
+        return upload_media(media_path, number_id)
+    except Exception as e:
+        logging.error(f"Error occurred while uploading {media_type} {media_name}: {e}")
+        return None
+
+
+def preload_media() -> None:
+    """
+    This function uploads every static media file in config.ini in bulk, so the first user to get one does not wait for its upload.
+    Files whose uploads are still valid are skipped. It is meant to run in a daemon thread at startup.
+    """
+    # Get the phone number ID to upload the media from
+    number_id = settings.current.whatsapp_number_id
+    assets = [
+        (media_type, media_name)
+        for media_type, names in static_media.items()
+        for media_name in names
+    ]
+    if not number_id or not assets:
+        return
+
+    # Upload the files in parallel
+    with ThreadPoolExecutor(max_workers=media_preload_workers) as executor:
+        media_ids = list(
+            executor.map(
+                lambda asset: get_media_id(asset[1], asset[0], number_id), assets
+            )
+        )
+    logging.info(
+        "Preloaded {} of {} static media files".format(
+            sum(1 for media_id in media_ids if media_id), len(assets)
+        )
+    )
 
-    return media_id
+
+def warm_up() -> Dict[str, float]:
+    """
+    This function loads what the first messages would otherwise wait for: PIL, reportlab with the PDF fonts and the
+    Vertex AI client, as listed under [startup] warm_up in config.ini. It is meant for App Engine warm-up requests,
+    which reach a new instance before any traffic does.
+
+    Returns:
+    Dict[str, float]: The seconds each part took to load.
+    """
+    timings = {}
+    for part in startup_warm_up:
+        start = time.perf_counter()
+        try:
+            if part == "pil":
+                from PIL import Image, ImageDraw
+            elif part == "pdf":
+                recommendations_pdf.warm()
+            elif part == "llama" and not VERTEX_EMULATOR_HOST:
+                get_prediction_client()
+        except Exception as e:
+            logging.error(f"Error occurred while warming up {part}: {e}")
+        timings[part] = time.perf_counter() - start
+    logging.info("Warmed up {}".format(", ".join("{} in {:.2f}s".format(part, seconds) for part, seconds in timings.items())))
+    return timings
 
 
 def reply_reaction_message(number: str, messageId: str, emoji: str) -> str:
@@ -518,6 +752,191 @@ def mark_read_message(messageId: str) -> str:
     return data
 
 
+# The footer of the interactive messages
+footer_text = "Aiysha from yShade"
+
+# The text of the message asking the user to send a selfie
+selfie_request_text = textwrap.dedent(
+    """
+        Great! Now, I need to see your beautiful face in all its glory. 
+        For ```foundation, skin tint, concealer, setting powder, contour, bronzer:``` `Send SELFIE` 
+        For ```hair style or hair color:``` `Send SELFIE with full hair visible`
+        For ```shapewear or nude shoes:``` `Snap Skin Patch` 
+        Let’s make sure you find the right fit!
+        But make sure you’re not wearing any makeup or glasses. I want to see the real you, not the filtered version.
+    """
+)
+
+# The text of the message asking the user to wait while their photo is processed
+pause_message_text = "Hang tight! I’m whipping up some digital wizardry as we speak. It’s like a techy cauldron bubbling with bytes and bits – your wish is my command line. 🧙‍♂️💻✨"
+
+# The text of the goodbye message
+no_thanks_text = textwrap.dedent(
+    """
+    Absolutely! Don’t forget to snag our app for: 
+    `iOS` ```@ https://apps.apple.com/us/app/robomua/id6443639738```
+    `Android` ```@ https://play.google.com/store/apps/details?id=com.domainname.roboMUANEW```
+    It’s like having a genie in your pocket – minus the three-wish limit. I’m just a text away, ready to grant your digital wishes. Catch you on the flip side! 😄🧞‍♂️✨
+    """
+)
+
+# Build the messages that only change by recipient once, at startup.
+# Each handler then only splices the recipient into a pre-serialized payload.
+selfie_request_payload = PayloadTemplate(
+    lambda number, messageId: text_message(number, selfie_request_text)
+)
+pause_payload = PayloadTemplate(
+    lambda number, messageId: text_message(number, pause_message_text)
+)
+no_thanks_payload = PayloadTemplate(
+    lambda number, messageId: text_message(number, no_thanks_text)
+)
+follow_up_payload = PayloadTemplate(
+    lambda number, messageId: button_reply_message(
+        number,
+        ["✅ Yes, please.", "❌ No, thanks."],
+        "Your radiance was truly captivating! As the curtain rises on the next chapter of your style journey, can I assist in crafting your upcoming show-stopping look? 🌟🎭✨",
+        footer_text,
+        "scenario4",
+        messageId,
+    )
+)
+greetings_payload = PayloadTemplate(
+    lambda number, messageId: button_reply_message(
+        number,
+        ["💄 Product Recs", "🪞 Try-On"],
+        "Hello, there! I’m AIySha, your dedicated beauty ally. My mission is to elevate your beauty routine and ensure you feel extraordinary. How may I enhance your allure today? ✨",
+        footer_text,
+        "intro",
+        messageId,
+    )
+)
+product_recs_payload = PayloadTemplate(
+    lambda number, messageId: list_reply_message(
+        number,
+        ["😀 Face", "☺️ Cheeks", "👤 Body"],
+        "How thrilling to embrace your adventurous spirit! Let’s channel that energy into creating a stunning visage that reflects your inner creativity. I’m here to guide you every step of the way. Tell me, what vision do you have for your transformative look today? 🎨✨",
+        footer_text,
+        "product_recs",
+        messageId,
+    )
+)
+face_payload = PayloadTemplate(
+    lambda number, messageId: list_reply_message(
+        number,
+        ["🎨 Foundation", "🙈 Concealer", "💎 Setting Powder"],  # "🌟 Skin Tint",
+        "Indeed, true beauty resonates from within, yet there’s always room to highlight your natural allure with the right products. Allow me to assist you in selecting the perfect items to accentuate your complexion. Could you share which feature of your face you’d like to enhance first? 🌟",
+        footer_text,
+        "face",
+        messageId,
+    )
+)
+cheeks_payload = PayloadTemplate(
+    lambda number, messageId: button_reply_message(
+        number,
+        ["😊 Contour", "🥉 Bronzer"],
+        "Your desire for glamour shines through, and rest assured, I’m here to support your vision. Whether you’re leaning towards a subtle, natural elegance or aiming for the dramatic flair of a diva, I’m at your service. What are your aspirations for today’s look? ✨",
+        footer_text,
+        "cheeks",
+        messageId,
+    )
+)
+body_payload = PayloadTemplate(
+    lambda number, messageId: button_reply_message(
+        number,
+        ["🩱 Shapewear", "🥿 Nude Shoes"],
+        "Ah, the beauty sovereign graces us with her presence! Are you prepared to enchant the world with your splendid visage? Share with me, what sort of enchantment shall we conjure up for your look today? ✨",
+        footer_text,
+        "body",
+        messageId,
+    )
+)
+vto_payload = PayloadTemplate(
+    lambda number, messageId: button_reply_message(
+        number,
+        ["🪮 Hair", "👄 Lips"],
+        "Fantastic! We’re about to embark on a transformative journey with a touch of digital enchantment. Tell me, what ambiance are you aiming to capture with your new look? 🌟✨",
+        footer_text,
+        "vto",
+        messageId,
+    )
+)
+hair_payload = PayloadTemplate(
+    lambda number, messageId: button_reply_message(
+        number,
+        ["💈 Color Try-On", "🎀 Style Try-On"],
+        "Marvelous choice! Elevating your look with a fresh hair color or style can be truly transformative. Are you envisioning a bold new shade to make a statement, or perhaps a chic cut to redefine your style? Share your inspiration, and let’s craft a look that’s uniquely you. 🌈✨",
+        footer_text,
+        "hair",
+        messageId,
+    )
+)
+lips_payload = PayloadTemplate(
+    lambda number, messageId: button_reply_message(
+        number,
+        ["💋 Lip Stick Try-On", "🫦 Lip Liner Try-On"],
+        "Absolutely, let’s revitalize your beauty routine! For lips that make a statement, are you feeling the boldness of a fiery red, or perhaps the understated elegance of a nude shade? Remember, a good lipliner is your ally—it ensures your lipstick stays precisely where it should. Ready to define your look? 💄✨",
+        footer_text,
+        "lips",
+        messageId,
+    )
+)
+yes_please_payload = PayloadTemplate(
+    lambda number, messageId: button_reply_message(
+        number,
+        ["💄 Product Recs", "🪞 Try-On"],
+        "You’re truly in the spirit of transformation! With our virtual beauty wand at the ready, what new look or style would you like to bring to life? Let’s create some beauty magic together! 🪄✨",
+        footer_text,
+        "intro",
+        messageId,
+    )
+)
+
+# The body text of the catalog menus
+brands_menu_text = "Envision yourself in a boutique of beauty, surrounded by the finest brands, each offering a delightful selection to satisfy your style cravings. Which one captures your heart and transports you to a realm of fashion enchantment? 🍭👗✨"
+shades_menu_text = "Selecting the perfect shade is akin to donning a superhero’s cape—each color holds its own power and story. So, which hue will be your superpower today? Will it be a bold, confident red or perhaps a mysterious, deep blue? Let’s find the color that makes you feel invincible! 🦸‍♂️🌈"
+styles_menu_text = "Navigating to the hair salon, it’s time to redefine your look! Shall we go bold with a daring pixie cut, embrace the romance of flowing mermaid waves, or perhaps choose a hue that embodies ‘rockstar’ vibes? Together, we’ll craft an experience that elevates your hair to new heights of style! 💇‍♀️🎨🤘"
+
+
+def build_catalog_menu(level: str, key: Any, options: List[str]) -> PayloadTemplate:
+    """
+    This function builds the list reply message of a catalog menu once, when the catalog is loaded.
+
+    Parameters:
+    level (str): The level of the menu: brands, shades or styles.
+    key (Any): The category of a brands or styles menu, or the (category, brand) of a shades menu.
+    options (List[str]): The titled options of the menu.
+
+    Returns:
+    PayloadTemplate: The prebuilt list reply message.
+    """
+    # Pick the body text and scenario of the level
+    if level == BRANDS:
+        body, scenario = brands_menu_text, "vto_opt_1"
+    elif level == SHADES:
+        # Offer to render every shade of the brand from a single selfie
+        options = options + [compare_shades_option.title()]
+        body, scenario = shades_menu_text, "vto_opt_2"
+    else:
+        body, scenario = styles_menu_text, "vto_opt_3"
+
+    return PayloadTemplate(
+        lambda number, messageId: list_reply_message(
+            number, options, body, footer_text, scenario, messageId
+        )
+    )
+
+
+# Load the try-on catalog from options.json, with its menus prebuilt
+catalog = Catalog("options.json", build_catalog_menu)
+
+# Get how often options.json is checked for changes
+catalog_reload_interval = config.getfloat("catalog", "reload_interval", fallback=30.0)
+
+# Get how often config.ini is checked for changes to the settings
+settings_reload_interval = config.getfloat("settings", "reload_interval", fallback=30.0)
+
+
 def ask_for_selfie(number: str) -> str:
     """
     This function creates a text message asking the user to send a selfie.
@@ -532,21 +951,8 @@ def ask_for_selfie(number: str) -> str:
     Exception: If an error occurs while creating the text message.
     """
     try:
-        # Define the text of the message
-        send_text = text_message(
-            number,
-            textwrap.dedent(
-                """
-                    Great! Now, I need to see your beautiful face in all its glory. 
-                    For ```foundation, skin tint, concealer, setting powder, contour, bronzer:``` `Send SELFIE` 
-                    For ```hair style or hair color:``` `Send SELFIE with full hair visible`
-                    For ```shapewear or nude shoes:``` `Snap Skin Patch` 
-                    Let’s make sure you find the right fit!
-                    But make sure you’re not wearing any makeup or glasses. I want to see the real you, not the filtered version.
-                """
-            ),
-        )
-        return send_text
+        # Render the prebuilt selfie request for the recipient
+        return selfie_request_payload.render(number)
     except Exception as e:
         # Log the error and re-raise it
         logging.error(f"Error occurred while asking for selfie: {e}")
@@ -567,12 +973,8 @@ def pause_text(number: str) -> Tuple[str, int]:
     Exception: If an error occurs while creating the text message.
     """
     try:
-        # Define the text of the message
-        send_text = text_message(
-            number,
-            "Hang tight! I’m whipping up some digital wizardry as we speak. It’s like a techy cauldron bubbling with bytes and bits – your wish is my command line. 🧙‍♂️💻✨",
-        )
-        return send_text, 200
+        # Render the prebuilt hold message for the recipient
+        return pause_payload.render(number), 200
     except Exception as e:
         # Log the error and re-raise it
         logging.error(f"Error occurred while asking user to hold on: {e}")
@@ -590,17 +992,8 @@ def follow_up(number: str, messageId: str) -> str:
     Returns:
     str: A JSON string representing the WhatsApp button reply message.
     """
-    # Define the body, footer, and options of the message
-    body = "Your radiance was truly captivating! As the curtain rises on the next chapter of your style journey, can I assist in crafting your upcoming show-stopping look? 🌟🎭✨"
-    footer = "Aiysha from yShade"
-    options = ["✅ Yes, please.", "❌ No, thanks."]
-
-    # Create a button reply message
-    reply_button_data = button_reply_message(
-        number, options, body, footer, "scenario4", messageId
-    )
-
-    return reply_button_data
+    # Render the prebuilt follow-up message for the recipient
+    return follow_up_payload.render(number, messageId)
 
 
 def remove_emoji_and_strip(input_string: str) -> str:
@@ -617,6 +1010,7 @@ def remove_emoji_and_strip(input_string: str) -> str:
     return input_string[2:].strip()
 
 
+@metrics.timed("download_media")
 def download_media(media_id: str, number_id: str, retries: int = 3) -> Optional[str]:
     """
     This function downloads a media file from WhatsApp.
@@ -633,65 +1027,65 @@ def download_media(media_id: str, number_id: str, retries: int = 3) -> Optional[
     requests.exceptions.RequestException: If a request to the WhatsApp API fails.
     Exception: If any other error occurs.
     """
-    # Get the WhatsApp token and media URL from the environment variables
-    whatsapp_token = os.getenv("WHATSAPP_TOKEN")
-    whatsapp_media_url = os.getenv("WHATSAPP_MEDIA_URL")
+    # Get the WhatsApp media URL and headers from the settings
+    current = settings.current
+    whatsapp_media_url = current.whatsapp_media_url
 
     # Construct the media URL
     media_url = "{}/{}?phone_number_id={}".format(
         whatsapp_media_url, media_id, number_id
     )
 
-    # Define the headers for the request
-    headers = {"Authorization": "Bearer " + whatsapp_token}
+    # Use the headers built when the settings were loaded
+    headers = current.auth_headers
 
     # Try to download the media file
-    for i in range(retries):
-        try:
-            # Send a GET request to the media URL
-            response = requests.get(media_url, headers=headers)
-
-            # If the request was unsuccessful, raise an exception
-            response.raise_for_status()
-
-            # Get the media data from the response
-            media_data = response.json()
+    try:
+        # Send a GET request to the media URL
+        response = edge_guard.call(
+            whatsapp_media_url,
+            lambda timeout: requests.get(media_url, headers=headers, timeout=timeout),
+            retries,
+        )
 
-            # Get the URL of the media file
-            media_url = media_data.get("url")
+        # Get the media data from the response
+        media_data = response.json()
 
-            # If the media URL is not None, download the media file
-            if media_url:
-                # Send a GET request to the media URL
-                response = requests.get(media_url, headers=headers)
+        # Get the URL of the media file
+        file_url = media_data.get("url")
 
-                # If the request was unsuccessful, raise an exception
-                response.raise_for_status()
+        # If the file URL is not None, download the media file
+        if file_url:
+            # Send a GET request to the file URL
+            response = edge_guard.call(
+                whatsapp_media_url,
+                lambda timeout: requests.get(file_url, headers=headers, timeout=timeout),
+                retries,
+            )
 
-                # Open the media file as an image
-                image = Image.open(BytesIO(response.content))
+            # Open the media file as an image, importing PIL on first use
+            from PIL import Image
 
-                # Save the image to a temporary file
-                downloaded_temp_file = NamedTemporaryFile(delete=False, suffix=".jpeg")
-                image.save(downloaded_temp_file.name, format="JPEG")
+            image = Image.open(BytesIO(response.content))
 
-                # Return the path of the temporary file
-                return downloaded_temp_file.name
-        except requests.exceptions.RequestException as e:
-            # Log the error
-            logging.error(f"Request failed: {e}")
+            # Save the image to a temporary file
+            downloaded_temp_file = NamedTemporaryFile(delete=False, suffix=".jpeg")
+            image.save(downloaded_temp_file.name, format="JPEG")
 
-            # If this was the last retry, re-raise the exception
-            if i == retries - 1:
-                raise
-        except Exception as e:
-            # Log the error and re-raise the exception
-            logging.error(e)
-            raise
+            # Return the path of the temporary file
+            return downloaded_temp_file.name
+    except requests.exceptions.RequestException as e:
+        # Log the error and re-raise the exception
+        logging.error(f"Request failed: {e}")
+        raise
+    except Exception as e:
+        # Log the error and re-raise the exception
+        logging.error(e)
+        raise
 
 
 def fetch_vto_image(
-    url: str, color: str, temp_file_path: str, retries: int = 3
+    url: str, color: str, temp_file_path: str, retries: int = 3, speculative: bool = False
 ) -> Optional[str]:
     """
     This function fetches a virtual try-on (VTO) image from a given URL.
@@ -701,6 +1095,8 @@ def fetch_vto_image(
     color (str): The color to be used for the VTO.
     temp_file_path (str): The path of the temporary file to be used for storing the VTO image.
     retries (int, optional): The number of times to retry the fetch if it fails. Defaults to 3.
+    speculative (bool, optional): Whether the fetch is a prefetch, made once and without hedging, whose outcome does not
+    count against the edge's circuit breaker or budgets. Defaults to False.
 
     Returns:
     Optional[str]: The path of the fetched VTO image if the fetch is successful, None otherwise.
@@ -709,52 +1105,169 @@ def fetch_vto_image(
     requests.exceptions.RequestException: If a request to the URL fails.
     Exception: If any other error occurs.
     """
+    # Record the traffic to the edge for the keep-warm schedule
+    keep_warm.touch(url)
+
+    # Define a function that sends the request, reopening the temporary file for every attempt
+    def send(timeout):
+        # Open the temporary file
+        with open(temp_file_path, "rb") as temp_file:
+            # Send a POST request to the URL with the color and the temporary file
+            return requests.post(
+                url, data={"color": color}, files={"file": temp_file}, timeout=timeout
+            )
+
     # Try to fetch the VTO image
-    for i in range(retries):
-        try:
-            # Open the temporary file
-            with open(temp_file_path, "rb") as temp_file:
-                # Send a POST request to the URL with the color and the temporary file
-                response = requests.post(
-                    url, data={"color": color}, files={"file": temp_file}
-                )
+    try:
+        current = settings.current
+        with metrics.timer(current.edge_stages.get(url, "edge")):
+            if speculative:
+                response = edge_guard.call(url, send, 1, speculative=True)
+            else:
+                response = edge_guard.call(url, send, retries, hedge=current.hedging_enabled)
 
-            # If the request was unsuccessful, raise an exception
-            response.raise_for_status()
+        # Decode the base64 image data from the response
+        image_data = base64.b64decode(response.json().get("b64"))
 
-            # Decode the base64 image data from the response
-            image_data = base64.b64decode(response.json().get("b64"))
+        # If the image data is not None, save it to a temporary file
+        if image_data:
+            # Open the image data as an image, importing PIL on first use
+            from PIL import Image
 
-            # If the image data is not None, save it to a temporary file
-            if image_data:
-                # Open the image data as an image
-                image = Image.open(BytesIO(image_data))
+            image = Image.open(BytesIO(image_data))
 
-                # Save the image to a temporary file
-                temp_image_file = NamedTemporaryFile(delete=False, suffix=".jpeg")
-                image.save(temp_image_file.name, format="JPEG")
+            # Save the image to a temporary file
+            temp_image_file = NamedTemporaryFile(delete=False, suffix=".jpeg")
+            image.save(temp_image_file.name, format="JPEG")
 
-                # Return the path of the temporary file
-                return temp_image_file.name
-            else:
-                # Log an error message
-                logging.error("No image data found.")
-        except requests.exceptions.RequestException as e:
-            # Log the error
-            logging.error(f"Request failed: {e}")
-
-            # If this was the last retry, re-raise the exception
-            if i == retries - 1:
-                raise
-        except Exception as e:
-            # Log the error and re-raise the exception
-            logging.error(e)
-            raise
+            # Return the path of the temporary file
+            return temp_image_file.name
+        else:
+            # Log an error message
+            logging.error("No image data found.")
+    except requests.exceptions.RequestException as e:
+        # Log the error and re-raise the exception
+        logging.error(f"Request failed: {e}")
+        raise
+    except Exception as e:
+        # Log the error and re-raise the exception
+        logging.error(e)
+        raise
 
     # If the fetch was unsuccessful, return None
     return None
 
 
+def prefetch_vto_image(url: str, color: str, temp_file_path: str) -> Optional[str]:
+    """
+    This function renders a shade in the background for the prefetcher, as a speculative fetch that is skipped while the
+    edge's circuit breaker is not closed, so prefetching never takes capacity or retries from the try-ons users asked for.
+
+    Parameters:
+    url (str): The URL of the try-on edge.
+    color (str): The color to render.
+    temp_file_path (str): The path of the selfie.
+
+    Returns:
+    Optional[str]: The path of the rendered image, or None if it was skipped or failed.
+    """
+    # Leave an edge that is failing alone
+    if not edge_guard.is_closed(url):
+        return None
+    return fetch_vto_image(url, color, temp_file_path, speculative=True)
+
+
+def fetch_vto_images(
+    url: str,
+    colors: Dict[str, str],
+    temp_file_path: str,
+    max_workers: int = vto_batch_max_workers,
+) -> Dict[str, Optional[str]]:
+    """
+    This function fetches virtual try-on (VTO) images for several colors concurrently from a given URL.
+
+    Parameters:
+    url (str): The URL from which to fetch the VTO images.
+    colors (Dict[str, str]): A dictionary mapping each shade name to its hex color code.
+    temp_file_path (str): The path of the temporary file holding the selfie to be used for every color.
+    max_workers (int, optional): The maximum number of concurrent requests. Defaults to the configured batch size.
+
+    Returns:
+    Dict[str, Optional[str]]: A dictionary mapping each shade name to the path of its VTO image, or None if that shade failed.
+    """
+    # Send one request per color, capped at the configured number of workers, in the trace of the message
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(colors)))) as executor:
+        futures = {
+            shade_name: executor.submit(
+                contextvars.copy_context().run, fetch_vto_image, url, color, temp_file_path
+            )
+            for shade_name, color in colors.items()
+        }
+
+    # Collect the results, keeping the shades that failed so the caller can skip them
+    images = {}
+    for shade_name, future in futures.items():
+        try:
+            images[shade_name] = future.result()
+        except Exception as e:
+            # Log the error and carry on with the other shades
+            logging.error(f"Error occurred while fetching VTO image for {shade_name}: {e}")
+            images[shade_name] = None
+
+    return images
+
+
+def compose_image_grid(
+    images: Dict[str, str], cell_width: int = vto_grid_cell_width
+) -> str:
+    """
+    This function composes several images into a single labelled grid image.
+
+    Parameters:
+    images (Dict[str, str]): A dictionary mapping each label to the path of its image.
+    cell_width (int, optional): The width of each cell in the grid. Defaults to the configured cell width.
+
+    Returns:
+    str: The path of the composed grid image.
+    """
+    # Import PIL on first use, since most messages never touch an image
+    from PIL import Image, ImageDraw
+
+    # Open each image and scale it to the width of a cell
+    tiles = []
+    for label, image_path in images.items():
+        with Image.open(image_path) as image:
+            image = image.convert("RGB")
+            cell_height = round(image.height * cell_width / image.width)
+            tiles.append((label, image.resize((cell_width, cell_height))))
+
+    # Lay the tiles out in two columns, or three when there are more than four shades
+    columns = 2 if len(tiles) <= 4 else 3
+    rows = -(-len(tiles) // columns)
+    label_height = 32
+    cell_height = max(tile.height for _, tile in tiles) + label_height
+
+    # Create a white canvas for the grid
+    grid = Image.new("RGB", (columns * cell_width, rows * cell_height), "white")
+    draw = ImageDraw.Draw(grid)
+
+    # Paste each tile and write its label underneath
+    for i, (label, tile) in enumerate(tiles):
+        x = (i % columns) * cell_width
+        y = (i // columns) * cell_height
+        grid.paste(tile, (x, y))
+        draw.text(
+            (x + 10, y + cell_height - label_height + 8), label.title(), fill="black"
+        )
+
+    # Save the grid to a temporary file
+    grid_temp_file = NamedTemporaryFile(delete=False, suffix=".jpeg")
+    grid.save(grid_temp_file.name, format="JPEG")
+
+    # Return the path of the temporary file
+    return grid_temp_file.name
+
+
 def fetch_hair_style_image(
     url: str, hair: str, temp_file_path: str, retries: int = 3
 ) -> Optional[str]:
@@ -774,47 +1287,50 @@ def fetch_hair_style_image(
     requests.exceptions.RequestException: If a request to the URL fails.
     Exception: If any other error occurs.
     """
+    # Record the traffic to the edge for the keep-warm schedule
+    keep_warm.touch(url)
+
+    # Define a function that sends the request, reopening the temporary file for every attempt
+    def send(timeout):
+        # Open the temporary file
+        with open(temp_file_path, "rb") as temp_file:
+            # Send a POST request to the URL with the hair style and the temporary file
+            return requests.post(
+                url, data={"hair": hair}, files={"file": temp_file}, timeout=timeout
+            )
+
     # Try to fetch the hair style image
-    for i in range(retries):
-        try:
-            # Open the temporary file
-            with open(temp_file_path, "rb") as temp_file:
-                # Send a POST request to the URL with the hair style and the temporary file
-                response = requests.post(
-                    url, data={"hair": hair}, files={"file": temp_file}
-                )
+    try:
+        with metrics.timer(settings.current.edge_stages.get(url, "edge")):
+            response = edge_guard.call(url, send, retries)
 
-            # If the request was unsuccessful, raise an exception
-            response.raise_for_status()
+        # Decode the base64 image data from the response
+        image_data = base64.b64decode(response.json().get("b64"))
 
-            # Decode the base64 image data from the response
-            image_data = base64.b64decode(response.json().get("b64"))
+        # If the image data is not None, save it to a temporary file
+        if image_data:
+            # Open the image data as an image, importing PIL on first use
+            from PIL import Image
 
-            # If the image data is not None, save it to a temporary file
-            if image_data:
-                # Open the image data as an image
-                image = Image.open(BytesIO(image_data))
+            image = Image.open(BytesIO(image_data))
 
-                # Save the image to a temporary file
-                temp_image_file = NamedTemporaryFile(delete=False, suffix=".jpeg")
-                image.save(temp_image_file.name, format="JPEG")
+            # Save the image to a temporary file
+            temp_image_file = NamedTemporaryFile(delete=False, suffix=".jpeg")
+            image.save(temp_image_file.name, format="JPEG")
 
-                # Return the path of the temporary file
-                return temp_image_file.name
-            else:
-                # Log an error message
-                logging.error("No image data found.")
-        except requests.exceptions.RequestException as e:
-            # Log the error
-            logging.error(f"Request failed: {e}")
-
-            # If this was the last retry, re-raise the exception
-            if i == retries - 1:
-                raise
-        except Exception as e:
-            # Log the error and re-raise the exception
-            logging.error(e)
-            raise
+            # Return the path of the temporary file
+            return temp_image_file.name
+        else:
+            # Log an error message
+            logging.error("No image data found.")
+    except requests.exceptions.RequestException as e:
+        # Log the error and re-raise the exception
+        logging.error(f"Request failed: {e}")
+        raise
+    except Exception as e:
+        # Log the error and re-raise the exception
+        logging.error(e)
+        raise
 
     # If the fetch was unsuccessful, return None
     return None
@@ -838,62 +1354,68 @@ def fetch_prod_recs(
     requests.exceptions.RequestException: If a request to the URL fails.
     Exception: If any other error occurs.
     """
+    # Record the traffic to the edge for the keep-warm schedule
+    keep_warm.touch(url)
+
+    # Define a function that sends the request, reopening the temporary file for every attempt
+    def send(timeout):
+        # Open the temporary file
+        with open(temp_file_path, "rb") as temp_file:
+            # Send a POST request to the URL with the temporary file
+            return requests.post(url, files={"file": temp_file}, timeout=timeout)
+
     # Try to fetch the product recommendations
-    for i in range(retries):
-        try:
-            # Open the temporary file
-            with open(temp_file_path, "rb") as temp_file:
-                # Send a POST request to the URL with the temporary file
-                response = requests.post(url, files={"file": temp_file})
-
-            # If the request was unsuccessful, raise an exception
-            response.raise_for_status()
-
-            # Get the product recommendations from the response
-            recs = response.json()
-
-            # If the product recommendations are not None, process them
-            if recs:
-                # Initialize a dictionary for the product recommendations and a set for the company names
-                company_products = collections.defaultdict(list)
-                company_names = set()
-
-                # Process each product recommendation
-                for rec in recs:
-                    # Get the company of the product recommendation
-                    company = rec["Company"].lower()
-
-                    # If the company is not in the set and the set has less than 10 companies, add the company to the set
-                    if len(company_names) < 10:
-                        company_names.add(company)
-
-                        # If the company has less than 10 product recommendations, add the product recommendation to the company
-                        if len(company_products[company]) < 10:
-                            company_products[company].append(rec)
-
-                # Return the product recommendations and the company names
-                return company_products, list(company_names)
-            else:
-                # Log an error message
-                logging.error("No product recommendations data found.")
-        except requests.exceptions.RequestException as e:
-            # Log the error
-            logging.error(f"Request failed: {e}")
-
-            # If this was the last retry, re-raise the exception
-            if i == retries - 1:
-                raise
-        except Exception as e:
-            # Log the error and re-raise the exception
-            logging.error(e)
-            raise
+    try:
+        current = settings.current
+        with metrics.timer(current.edge_stages.get(url, "edge")):
+            response = edge_guard.call(url, send, retries, hedge=current.hedging_enabled)
+
+        # Get the product recommendations from the response
+        recs = response.json()
+
+        # If the product recommendations are not None, process them
+        if recs:
+            # Initialize a dictionary for the product recommendations and a set for the company names
+            company_products = collections.defaultdict(list)
+            company_names = set()
+
+            # Process each product recommendation
+            for rec in recs:
+                # Get the company of the product recommendation
+                company = rec["Company"].lower()
+
+                # If the company is not in the set and the set has less than 10 companies, add the company to the set
+                if len(company_names) < 10:
+                    company_names.add(company)
+
+                    # If the company has less than 10 product recommendations, add the product recommendation to the company
+                    if len(company_products[company]) < 10:
+                        company_products[company].append(rec)
+
+            # Return the product recommendations and the company names
+            return company_products, list(company_names)
+        else:
+            # Log an error message
+            logging.error("No product recommendations data found.")
+    except requests.exceptions.RequestException as e:
+        # Log the error and re-raise the exception
+        logging.error(f"Request failed: {e}")
+        raise
+    except Exception as e:
+        # Log the error and re-raise the exception
+        logging.error(e)
+        raise
 
     # If the fetch was unsuccessful, return (None, None)
     return None, None
 
 
+@metrics.timed("upload_media")
 def upload_media(
-    temp_file_path: str, number_id: str, retries: int = 3
+    temp_file_path: str,
+    number_id: str,
+    retries: int = 3,
+    media_file: Optional[IO[bytes]] = None,
 ) -> Optional[str]:
     """
     This function uploads a media file to WhatsApp.
@@ -902,6 +1424,8 @@ def upload_media(
     temp_file_path (str): The path of the temporary file to be uploaded.
     number_id (str): The ID of the phone number to which the media file is to be uploaded.
     retries (int, optional): The number of times to retry the upload if it fails. Defaults to 3.
+    media_file (Optional[IO[bytes]], optional): An open file holding the media, uploaded instead of reopening
+    temp_file_path, which then only names the file type. Defaults to None.
 
     Returns:
     Optional[str]: The ID of the uploaded media file if the upload is successful, None otherwise.
@@ -910,67 +1434,90 @@ def upload_media(
     requests.exceptions.RequestException: If a request to the WhatsApp API fails.
     Exception: If any other error occurs.
     """
-    # Get the WhatsApp token and media URL from the environment variables
-    whatsapp_token = os.getenv("WHATSAPP_TOKEN")
-    whatsapp_media_url = os.getenv("WHATSAPP_MEDIA_URL")
+    # Get the WhatsApp media URL and headers from the settings
+    current = settings.current
+    whatsapp_media_url = current.whatsapp_media_url
 
     # Construct the media URL
     media_url = "{}/{}/media".format(whatsapp_media_url, number_id)
 
-    # Define the headers for the request
-    headers = {"Authorization": "Bearer " + whatsapp_token}
+    # Use the headers built when the settings were loaded
+    headers = current.auth_headers
 
     # Define the data for the request
     data = {"messaging_product": "whatsapp"}
 
-    # Try to upload the media file
-    for i in range(retries):
-        try:
-            # Open the temporary file
-            with open(temp_file_path, "rb") as temp_file:
-                # Determine the file type based on the file extension
-                _, ext = os.path.splitext(temp_file_path)
-                if ext.lower() == ".jpeg":
-                    files = {"file": ("image.jpeg", temp_file, "image/jpeg")}
-                elif ext.lower() == ".pdf":
-                    files = {"file": ("document.pdf", temp_file, "application/pdf")}
-                else:
-                    raise ValueError("Unsupported file extension: {}".format(ext))
-
-                # Send a POST request to the media URL with the data and the file
-                response = requests.post(
-                    media_url, headers=headers, data=data, files=files
-                )
+    # Determine the file type based on the file extension
+    _, ext = os.path.splitext(temp_file_path)
+    if ext.lower() == ".jpeg":
+        filename, mime_type = "image.jpeg", "image/jpeg"
+    elif ext.lower() == ".pdf":
+        filename, mime_type = "document.pdf", "application/pdf"
+    elif ext.lower() in media_types:
+        filename, mime_type = "media" + ext.lower(), media_types[ext.lower()]
+    else:
+        raise ValueError("Unsupported file extension: {}".format(ext))
 
-            # If the request was unsuccessful, raise an exception
-            response.raise_for_status()
+    # If the same content was already uploaded from this phone number and has not expired, reuse its media ID
+    if media_file is not None:
+        digest = digest_file(media_file)
+    else:
+        digest = digest_path(temp_file_path)
+    media_id = media_registry.get(number_id, digest)
+    if media_id is not None:
+        return media_id
+
+    # Define a function that sends the request, reopening or rewinding the file for every attempt
+    def send(timeout):
+        # If the media is already open, send it from the start
+        if media_file is not None:
+            media_file.seek(0)
+            files = {"file": (filename, media_file, mime_type)}
+            return requests.post(
+                media_url, headers=headers, data=data, files=files, timeout=timeout
+            )
 
-            # Get the media ID from the response
-            media_id = response.json().get("id")
+        # Open the temporary file
+        with open(temp_file_path, "rb") as temp_file:
+            files = {"file": (filename, temp_file, mime_type)}
 
-            # Return the media ID
-            return media_id
-        except requests.exceptions.RequestException as e:
-            # Log the error
-            logging.error(f"Request failed: {e}")
+            # Send a POST request to the media URL with the data and the file
+            return requests.post(
+                media_url, headers=headers, data=data, files=files, timeout=timeout
+            )
 
-            # If this was the last retry, re-raise the exception
-            if i == retries - 1:
-                raise
-        except Exception as e:
-            # Log the error and re-raise the exception
-            logging.error(e)
-            raise
+    # Try to upload the media file
+    try:
+        response = edge_guard.call(whatsapp_media_url, send, retries)
+
+        # Get the media ID from the response
+        media_id = response.json().get("id")
+
+        # Remember the media ID of the content
+        if media_id:
+            media_registry.put(number_id, digest, media_id)
+
+        # Return the media ID
+        return media_id
+    except requests.exceptions.RequestException as e:
+        # Log the error and re-raise the exception
+        logging.error(f"Request failed: {e}")
+        raise
+    except Exception as e:
+        # Log the error and re-raise the exception
+        logging.error(e)
+        raise
 
     # If the upload was unsuccessful, return None
     return None
 
 
+@metrics.timed("handle_vto_type")
 def handle_vto_type(
     vto_type: str,
     number: str,
     last_vto_type: Dict[str, List[str]],
-    feats: Dict[str, Dict[str, Dict[str, str]]],
+    index: CatalogIndex,
     media_content: str,
     numberId: str,
     messageId: str,
@@ -986,7 +1533,7 @@ def handle_vto_type(
     vto_type (str): The type of the VTO.
     number (str): The phone number of the recipient.
     last_vto_type (Dict[str, List[str]]): A dictionary mapping phone numbers to a list of the last VTO types.
-    feats (Dict[str, Dict[str, Dict[str, str]]]): A dictionary containing the features for the VTO.
+    index (CatalogIndex): The snapshot of the try-on catalog.
     media_content (str): The media content for the VTO.
     numberId (str): The ID of the phone number.
     messageId (str): The ID of the message.
@@ -1003,7 +1550,7 @@ def handle_vto_type(
     """
     try:
         # Send a hold message
-        send_hold = pause_text(number)
+        send_hold, _ = pause_text(number)
         response_list.append(send_hold)
 
         # Get the top level option, company name, and color name from the last VTO type
@@ -1011,9 +1558,6 @@ def handle_vto_type(
         company_name = last_vto_type[number][-2]
         color_name = last_vto_type[number][-1]
 
-        # Get the hex color code from the features
-        hex_color_code = feats[(top_level_option)][(company_name)][(color_name)]
-
         # Determine the edge URL based on the VTO type
         if "color try-on" in vto_type:
             edge_url = hair_color_try_on_edge
@@ -1022,8 +1566,42 @@ def handle_vto_type(
         elif "lip liner try-on" in vto_type:
             edge_url = lip_liner_try_on_edge
 
-        # Fetch the VTO image
-        temp_file = fetch_vto_image(edge_url, hex_color_code, media_content)
+        # If the user asked to compare shades, render every shade of the brand into one grid
+        if color_name == compare_shades_option:
+            # Fetch the VTO images for all the shades at once
+            shade_codes = index.codes(top_level_option, company_name)
+            shade_images = fetch_vto_images(edge_url, shade_codes, media_content)
+            rendered = {name: path for name, path in shade_images.items() if path}
+
+            # If none of the shades could be rendered, give up
+            if not rendered:
+                raise RuntimeError("No shades could be rendered for comparison.")
+
+            # Compose the shades into a single grid image
+            temp_file = compose_image_grid(rendered)
+
+            # Keep the individual shade images so picking one of them later is instant
+            prefetcher.cancel(number)
+            render_cache.discard_user(number)
+            for shade_name, path in rendered.items():
+                render_cache.put(number, edge_url, shade_codes[shade_name], path)
+        else:
+            # Get the hex color code of the shade from the catalog
+            hex_color_code = index.get(top_level_option, company_name, color_name).code
+
+            # Fetch the VTO image
+            temp_file = fetch_vto_image(edge_url, hex_color_code, media_content)
+
+            # Forget the renders of the previous selfie and keep this one
+            prefetcher.cancel(number)
+            render_cache.discard_user(number)
+            render_cache.put(number, edge_url, hex_color_code, temp_file)
+
+            # Render the other shades of the brand in the background
+            if settings.current.prefetch_enabled and edge_guard.is_closed(edge_url):
+                prefetcher.schedule(
+                    number, edge_url, index.codes(top_level_option, company_name), media_content
+                )
 
         # Upload the VTO image
         vto_file = upload_media(temp_file, numberId)
@@ -1046,10 +1624,11 @@ def handle_vto_type(
         raise
 
 
+@metrics.timed("handle_hair_style")
 def handle_hair_style(
     number: str,
     last_hair_type: Dict[str, List[str]],
-    feats: Dict[str, Dict[str, str]],
+    index: CatalogIndex,
     media_content: str,
     numberId: str,
     messageId: str,
@@ -1062,7 +1641,7 @@ def handle_hair_style(
     Parameters:
     number (str): The phone number of the recipient.
     last_hair_type (Dict[str, List[str]]): A dictionary mapping phone numbers to a list of the last hair styles.
-    feats (Dict[str, Dict[str, str]]): A dictionary containing the features for the VTO.
+    index (CatalogIndex): The snapshot of the try-on catalog.
     media_content (str): The media content for the VTO.
     numberId (str): The ID of the phone number.
     messageId (str): The ID of the message.
@@ -1077,15 +1656,15 @@ def handle_hair_style(
     """
     try:
         # Send a hold message
-        send_hold = pause_text(number)
+        send_hold, _ = pause_text(number)
         response_list.append(send_hold)
 
         # Get the top level option and style name from the last hair style
         top_level_option = last_hair_type[number][-2]
         style_name = last_hair_type[number][-1]
 
-        # Get the hair style code from the features
-        hair_style_code = feats[(top_level_option)][(style_name)]
+        # Get the hair style code from the catalog
+        hair_style_code = index.get(top_level_option, None, style_name).code
 
         # Fetch the hair style image
         temp_file = fetch_hair_style_image(
@@ -1156,7 +1735,7 @@ def fetch_product_recs(
     """
     try:
         # Send a hold message
-        send_hold = pause_text(number)
+        send_hold, _ = pause_text(number)
         response_list.append(send_hold)
 
         # Determine the edge URL based on the product type
@@ -1201,7 +1780,7 @@ def fetch_product_recs(
         raise
 
 
-def create_pdf(products: List[Dict[str, str]]) -> str:
+def create_pdf(products: List[Dict[str, str]]) -> IO[bytes]:
     """
     This function creates a PDF file with product information.
 
@@ -1209,70 +1788,13 @@ def create_pdf(products: List[Dict[str, str]]) -> str:
     products (List[Dict[str, str]]): A list of dictionaries where each dictionary contains product information.
 
     Returns:
-    str: The path of the created PDF file.
-    """
-    # Create a BytesIO object to hold the PDF data
-    pdf_bytes = BytesIO()
-
-    # Create a canvas for the PDF
-    c = canvas.Canvas(pdf_bytes, pagesize=letter)
-
-    # Define the starting coordinates for the text
-    x = 50
-    y = 750
-
-    # Iterate over each product
-    for product in products:
-        # Define the keys and labels for the product information
-        keys_labels = {
-            "Foundation": "Foundation",
-            "Shade": "Shade",
-            "Concealer": "Concealer",
-            "Shoe": "Shoe",
-        }
-
-        # Initialize an empty string for the message
-        message = ""
-
-        # Iterate over each key and label
-        for key, label in keys_labels.items():
-            # If the key is in the product, add the product information to the message
-            if key in product:
-                message = f"🤎 *{label}*: ```{product[key]}```\n" + message
-
-        # Add the price, buy link, and tutorial link to the message
-        message += f"💰 *Price*: `{product['Price']}`\n🛍️ *Buy*: ```{product['ProductURL']}```\n🎬 *Tutorial*: ```{product['VideoTutorial']}```\n"
-
-        # Draw the message on the canvas
-        c.drawString(x, y, message)
-
-        # Move the y-coordinate down for the next product
-        y -= 100
-
-        # If the y-coordinate is too low, create a new page and reset the y-coordinate
-        if y < 50:
-            c.showPage()
-            y = 750
-
-    # Save the PDF data to the canvas
-    c.save()
-
-    # Get the PDF data from the BytesIO object
-    pdf_data = pdf_bytes.getvalue()
-
-    # Create a temporary file to hold the PDF data
-    temp_doc_file = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf")
-
-    # Write the PDF data to the temporary file
-    temp_doc_file.write(pdf_data)
-
-    # Close the temporary file
-    temp_doc_file.close()
-
-    # Return the path of the temporary file
-    return temp_doc_file.name
+    IO[bytes]: A spooled temporary file holding the PDF document, rewound to its start. The caller closes it.
+    """
+    # Lay out the products with the preloaded fonts and styles, straight into a spooled file
+    return recommendations_pdf.render(products)
 
 
+@metrics.timed("handle_greetings")
 def handle_greetings(
     text: str, number: str, messageId: str, response_list: List[str]
 ) -> List[str]:
@@ -1288,30 +1810,17 @@ def handle_greetings(
     Returns:
     List[str]: The updated list of responses.
     """
-    logging.info('ENTERED GREETINGS FUNCTION...')
-    # Define the body, footer, and options of the message
-    body = "Hello, there! I’m AIySha, your dedicated beauty ally. My mission is to elevate your beauty routine and ensure you feel extraordinary. How may I enhance your allure today? ✨"
-    footer = "Aiysha from yShade"
-    options = ["💄 Product Recs", "🪞 Try-On"]
-
-    # Create a button reply message
-    reply_button_data = button_reply_message(
-        number, options, body, footer, "intro", messageId
-    )
-
-    # Create a reply reaction message
-    # reply_reaction = reply_reaction_message(number, messageId, "❤️")
-
-    # Add the reply reaction and button reply messages to the list of responses
-    # response_list.append(reply_reaction)
-    response_list.append(reply_button_data)
+    logging.debug("ENTERED GREETINGS FUNCTION...")
+    # Render the prebuilt greetings message for the recipient
+    response_list.append(greetings_payload.render(number, messageId))
     
-    logging.info('SENDING GREETINGS RESULTS...{}'.format(response_list))
+    log_payload("SENDING GREETINGS RESULTS...%s", truncated(response_list))
 
     # Return the updated list of responses
     return response_list
 
 
+@metrics.timed("handle_else_condition")
 def handle_else_condition(
     text: str,
     number: str,
@@ -1351,6 +1860,7 @@ def handle_else_condition(
     return response_list, chat_history
 
 
+@metrics.timed("handle_product_recs")
 def handle_product_recs(
     text: str, number: str, messageId: str, response_list: List[str]
 ) -> List[str]:
@@ -1366,23 +1876,14 @@ def handle_product_recs(
     Returns:
     List[str]: The updated list of responses.
     """
-    # Define the body, footer, and options of the message
-    body = "How thrilling to embrace your adventurous spirit! Let’s channel that energy into creating a stunning visage that reflects your inner creativity. I’m here to guide you every step of the way. Tell me, what vision do you have for your transformative look today? 🎨✨"
-    footer = "Aiysha from yShade"
-    options = ["😀 Face", "☺️ Cheeks", "👤 Body"]
-
-    # Create a list reply message
-    list_reply_data = list_reply_message(
-        number, options, body, footer, "product_recs", messageId
-    )
-
-    # Add the list reply message to the list of responses
-    response_list.append(list_reply_data)
+    # Render the prebuilt product recs message for the recipient
+    response_list.append(product_recs_payload.render(number, messageId))
 
     # Return the updated list of responses
     return response_list
 
 
+@metrics.timed("handle_face")
 def handle_face(
     text: str, number: str, messageId: str, response_list: List[str]
 ) -> List[str]:
@@ -1398,23 +1899,14 @@ def handle_face(
     Returns:
     List[str]: The updated list of responses.
     """
-    # Define the body, footer, and options of the message
-    body = "Indeed, true beauty resonates from within, yet there’s always room to highlight your natural allure with the right products. Allow me to assist you in selecting the perfect items to accentuate your complexion. Could you share which feature of your face you’d like to enhance first? 🌟"
-    footer = "Aiysha from yShade"
-    options = ["🎨 Foundation", "🙈 Concealer", "💎 Setting Powder"]  # "🌟 Skin Tint",
-
-    # Create a list reply message
-    list_reply_data = list_reply_message(
-        number, options, body, footer, "face", messageId
-    )
-
-    # Add the list reply message to the list of responses
-    response_list.append(list_reply_data)
+    # Render the prebuilt face message for the recipient
+    response_list.append(face_payload.render(number, messageId))
 
     # Return the updated list of responses
     return response_list
 
 
+@metrics.timed("handle_cheeks")
 def handle_cheeks(
     text: str, number: int, messageId: str, response_list: List[str]
 ) -> List[str]:
@@ -1430,28 +1922,14 @@ def handle_cheeks(
     Returns:
     List[str]: The updated list of responses after handling the 'cheeks' makeup option.
     """
+    # Render the prebuilt cheeks message for the recipient
+    response_list.append(cheeks_payload.render(number, messageId))
 
-    # Define the body of the message
-    body = "Your desire for glamour shines through, and rest assured, I’m here to support your vision. Whether you’re leaning towards a subtle, natural elegance or aiming for the dramatic flair of a diva, I’m at your service. What are your aspirations for today’s look? ✨"
-
-    # Define the footer of the message
-    footer = "Aiysha from yShade"
-
-    # Define the options for the user
-    options = ["😊 Contour", "🥉 Bronzer"]
-
-    # Generate the reply button data
-    reply_button_data = button_reply_message(
-        number, options, body, footer, "cheeks", messageId
-    )
-
-    # Append the reply button data to the response list
-    response_list.append(reply_button_data)
-
-    # Return the updated response list
+    # Return the updated list of responses
     return response_list
 
 
+@metrics.timed("handle_body")
 def handle_body(
     text: str, number: int, messageId: str, response_list: List[str]
 ) -> List[str]:
@@ -1467,28 +1945,14 @@ def handle_body(
     Returns:
     List[str]: The updated list of responses after handling the 'body' fashion option.
     """
+    # Render the prebuilt body message for the recipient
+    response_list.append(body_payload.render(number, messageId))
 
-    # Define the body of the message
-    body = "Ah, the beauty sovereign graces us with her presence! Are you prepared to enchant the world with your splendid visage? Share with me, what sort of enchantment shall we conjure up for your look today? ✨"
-
-    # Define the footer of the message
-    footer = "Aiysha from yShade"
-
-    # Define the options for the user
-    options = ["🩱 Shapewear", "🥿 Nude Shoes"]
-
-    # Generate the reply button data
-    reply_button_data = button_reply_message(
-        number, options, body, footer, "body", messageId
-    )
-
-    # Append the reply button data to the response list
-    response_list.append(reply_button_data)
-
-    # Return the updated response list
+    # Return the updated list of responses
     return response_list
 
 
+@metrics.timed("handle_recs_selfie")
 def handle_recs_selfie(
     text: str,
     number: str,
@@ -1512,6 +1976,9 @@ def handle_recs_selfie(
     # Update the last recommendation type for the given number
     last_rec_type[number] = text
 
+    # Wake the recommendation edge while the user takes their selfie
+    keep_warm.prewarm(settings.current.recs_edges.get(text))
+
     # Generate a request for a selfie
     selfie_request = ask_for_selfie(number)
 
@@ -1522,6 +1989,7 @@ def handle_recs_selfie(
     return response_list
 
 
+@metrics.timed("handle_vto")
 def handle_vto(
     text: str, number: str, messageId: str, response_list: List[str]
 ) -> List[str]:
@@ -1537,23 +2005,14 @@ def handle_vto(
     Returns:
     List[str]: The updated list of responses.
     """
-    # Define the body, footer, and options of the message
-    body = "Fantastic! We’re about to embark on a transformative journey with a touch of digital enchantment. Tell me, what ambiance are you aiming to capture with your new look? 🌟✨"
-    footer = "Aiysha from yShade"
-    options = ["🪮 Hair", "👄 Lips"]
-
-    # Create a button reply message
-    reply_button_data = button_reply_message(
-        number, options, body, footer, "vto", messageId
-    )
-
-    # Add the button reply message to the list of responses
-    response_list.append(reply_button_data)
+    # Render the prebuilt vto message for the recipient
+    response_list.append(vto_payload.render(number, messageId))
 
     # Return the updated list of responses
     return response_list
 
 
+@metrics.timed("handle_hair")
 def handle_hair(
     text: str, number: str, messageId: str, response_list: List[str]
 ) -> List[str]:
@@ -1569,23 +2028,14 @@ def handle_hair(
     Returns:
     List[str]: The updated list of responses.
     """
-    # Define the body, footer, and options of the message
-    body = "Marvelous choice! Elevating your look with a fresh hair color or style can be truly transformative. Are you envisioning a bold new shade to make a statement, or perhaps a chic cut to redefine your style? Share your inspiration, and let’s craft a look that’s uniquely you. 🌈✨"
-    footer = "Aiysha from yShade"
-    options = ["💈 Color Try-On", "🎀 Style Try-On"]
-
-    # Create a button reply message
-    reply_button_data = button_reply_message(
-        number, options, body, footer, "hair", messageId
-    )
-
-    # Add the button reply message to the list of responses
-    response_list.append(reply_button_data)
+    # Render the prebuilt hair message for the recipient
+    response_list.append(hair_payload.render(number, messageId))
 
     # Return the updated list of responses
     return response_list
 
 
+@metrics.timed("handle_lips")
 def handle_lips(
     text: str, number: str, messageId: str, response_list: List[str]
 ) -> List[str]:
@@ -1601,23 +2051,14 @@ def handle_lips(
     Returns:
     List[str]: The updated list of responses.
     """
-    # Define the body, footer, and options of the message
-    body = "Absolutely, let’s revitalize your beauty routine! For lips that make a statement, are you feeling the boldness of a fiery red, or perhaps the understated elegance of a nude shade? Remember, a good lipliner is your ally—it ensures your lipstick stays precisely where it should. Ready to define your look? 💄✨"
-    footer = "Aiysha from yShade"
-    options = ["💋 Lip Stick Try-On", "🫦 Lip Liner Try-On"]
-
-    # Create a button reply message
-    reply_button_data = button_reply_message(
-        number, options, body, footer, "lips", messageId
-    )
-
-    # Add the button reply message to the list of responses
-    response_list.append(reply_button_data)
+    # Render the prebuilt lips message for the recipient
+    response_list.append(lips_payload.render(number, messageId))
 
     # Return the updated list of responses
     return response_list
 
 
+@metrics.timed("handle_digit_text")
 def handle_digit_text(
     text: str,
     number: str,
@@ -1644,6 +2085,9 @@ def handle_digit_text(
     Returns:
     List[str]: The updated list of responses.
     """
+    # Initialize the media content
+    media_content = None
+
     # Try to download the media content from the text
     try:
         media_content = download_media(text, numberId)
@@ -1657,6 +2101,9 @@ def handle_digit_text(
         vto_type = last_vto_type.get(number)
         hair_type = last_hair_type.get(number)
 
+        # Take the edge URLs once for the whole selfie
+        edges = settings.current.edges
+
         # If the last recommendation type is in all image options
         if rec_type and any(option in rec_type for option in all_image_options):
             (
@@ -1664,7 +2111,19 @@ def handle_digit_text(
                 recs_data["company_products"],
                 recs_data["company_names"],
             ) = fetch_product_recs(
-                number, rec_type, media_content, numberId, messageId, response_list
+                number,
+                rec_type,
+                media_content,
+                numberId,
+                messageId,
+                response_list,
+                foundation_recs_edge=edges.get("foundation_recs_edge", ""),
+                concealer_recs_edge=edges.get("concealer_recs_edge", ""),
+                setting_powder_recs_edge=edges.get("setting_powder_recs_edge", ""),
+                contour_recs_edge=edges.get("contour_recs_edge", ""),
+                bronzer_recs_edge=edges.get("bronzer_recs_edge", ""),
+                shape_wear_recs_edge=edges.get("shape_wear_recs_edge", ""),
+                nude_shoes_recs_edge=edges.get("nude_shoes_recs_edge", ""),
             )
         # If the last VTO type is in plus color options
         elif vto_type and any(option in vto_type for option in plus_color_options):
@@ -1672,22 +2131,26 @@ def handle_digit_text(
                 vto_type,
                 number,
                 last_vto_type,
-                feats,
+                catalog.index,
                 media_content,
                 numberId,
                 messageId,
                 response_list,
+                hair_color_try_on_edge=edges.get("hair_color_try_on_edge", ""),
+                lip_stick_try_on_edge=edges.get("lip_stick_try_on_edge", ""),
+                lip_liner_try_on_edge=edges.get("lip_liner_try_on_edge", ""),
             )
         # If the last hair type is "style try-on"
         elif hair_type and "style try-on" in hair_type:
             response_list = handle_hair_style(
                 number,
                 last_hair_type,
-                feats,
+                catalog.index,
                 media_content,
                 numberId,
                 messageId,
                 response_list,
+                hair_style_try_on_edge=edges.get("hair_style_try_on_edge", ""),
             )
         # If none of the above conditions are met
         else:
@@ -1713,6 +2176,7 @@ def handle_digit_text(
     return response_list
 
 
+@metrics.timed("handle_yes_please")
 def handle_yes_please(
     text: str, number: str, messageId: str, response_list: List[str]
 ) -> List[str]:
@@ -1728,23 +2192,14 @@ def handle_yes_please(
     Returns:
     List[str]: The updated list of responses.
     """
-    # Define the body, footer, and options of the message
-    body = "You’re truly in the spirit of transformation! With our virtual beauty wand at the ready, what new look or style would you like to bring to life? Let’s create some beauty magic together! 🪄✨"
-    footer = "Aiysha from yShade"
-    options = ["💄 Product Recs", "🪞 Try-On"]
-
-    # Create a button reply message
-    reply_button_data = button_reply_message(
-        number, options, body, footer, "intro", messageId
-    )
-
-    # Add the button reply message to the list of responses
-    response_list.append(reply_button_data)
+    # Render the prebuilt yes please message for the recipient
+    response_list.append(yes_please_payload.render(number, messageId))
 
     # Return the updated list of responses
     return response_list
 
 
+@metrics.timed("handle_no_thanks")
 def handle_no_thanks(
     text: str, number: str, messageId: str, response_list: List[str]
 ) -> List[str]:
@@ -1760,26 +2215,14 @@ def handle_no_thanks(
     Returns:
     List[str]: The updated list of responses.
     """
-    # Define the text message to be sent
-    send_text = text_message(
-        number,
-        textwrap.dedent(
-            """
-            Absolutely! Don’t forget to snag our app for: 
-            `iOS` ```@ https://apps.apple.com/us/app/robomua/id6443639738```
-            `Android` ```@ https://play.google.com/store/apps/details?id=com.domainname.roboMUANEW```
-            It’s like having a genie in your pocket – minus the three-wish limit. I’m just a text away, ready to grant your digital wishes. Catch you on the flip side! 😄🧞‍♂️✨
-            """
-        ),
-    )
-
-    # Add the text message to the list of responses
-    response_list.append(send_text)
+    # Render the prebuilt goodbye message for the recipient
+    response_list.append(no_thanks_payload.render(number))
 
     # Return the updated list of responses
     return response_list
 
 
+@metrics.timed("handle_company_names")
 def handle_company_names(
     text: str,
     number: str,
@@ -1787,6 +2230,7 @@ def handle_company_names(
     name: str,
     response_list: List[str],
     recs_data: Dict[str, Dict[str, List[Dict[str, str]]]],
+    numberId: str,
 ) -> List[str]:
     """
     This function handles the case where the user wants to get recommendations from specific companies and generates the appropriate responses.
@@ -1798,6 +2242,7 @@ def handle_company_names(
     name (str): The name of the recipient.
     response_list (List[str]): A list of responses to be sent.
     recs_data (Dict[str, Dict[str, List[Dict[str, str]]]]): A dictionary that stores the company names and products for each number.
+    numberId (str): The ID of the number.
 
     Returns:
     List[str]: The updated list of responses.
@@ -1807,11 +2252,18 @@ def handle_company_names(
 
     # If the number of products is more than 5
     if len(products) > 5:
-        # Create a PDF file with the products
-        rec_file = create_pdf(products)
-
-        # Upload the PDF file
-        doc_file = upload_media(rec_file, numberId)
+        # Reuse the PDF of the same products, or render it
+        pdf_key = pdf_cache.key(products)
+        pdf_data = pdf_cache.get(pdf_key)
+        if pdf_data is None:
+            with create_pdf(products) as rec_file:
+                pdf_data = rec_file.read()
+            pdf_cache.put(pdf_key, pdf_data)
+
+        # Upload the PDF, which reuses its media ID if the same PDF was uploaded before and has not expired
+        doc_file = upload_media(
+            "recommendations.pdf", numberId, media_file=BytesIO(pdf_data)
+        )
 
         # Create a document message with the PDF file
         send_doc = document_message(
@@ -1868,13 +2320,14 @@ def handle_company_names(
     return response_list
 
 
+@metrics.timed("handle_style_try_on")
 def handle_style_try_on(
     text: str,
     number: str,
     messageId: str,
     response_list: List[str],
     last_hair_type: Dict[str, List[str]],
-    feats: Dict[str, Dict[str, str]],
+    index: CatalogIndex,
 ) -> List[str]:
     """
     This function handles the case where the user wants to try on a virtual hair style and generates the appropriate responses.
@@ -1885,7 +2338,7 @@ def handle_style_try_on(
     messageId (str): The ID of the message.
     response_list (List[str]): A list of responses to be sent.
     last_hair_type (Dict[str, List[str]]): A dictionary that stores the last hair type for each number.
-    feats (Dict[str, Dict[str, str]]): A dictionary that stores the features for each text.
+    index (CatalogIndex): The snapshot of the try-on catalog.
 
     Returns:
     List[str]: The updated list of responses.
@@ -1893,23 +2346,17 @@ def handle_style_try_on(
     # Add the text to the last hair type for the given number
     last_hair_type.setdefault(number, []).append(text)
 
-    # Define the body, footer, and options of the message
-    body = "Navigating to the hair salon, it’s time to redefine your look! Shall we go bold with a daring pixie cut, embrace the romance of flowing mermaid waves, or perhaps choose a hue that embodies ‘rockstar’ vibes? Together, we’ll craft an experience that elevates your hair to new heights of style! 💇‍♀️🎨🤘"
-    footer = "Aiysha from yShade"
-    options = [name.title() for name in feats[text].keys()]
+    # Wake the hair style edge while the user picks a style
+    keep_warm.prewarm(settings.current.edges.get("hair_style_try_on_edge"))
 
-    # Create a list reply message
-    list_reply_data = list_reply_message(
-        number, options, body, footer, "vto_opt_3", messageId
-    )
-
-    # Add the list reply message to the list of responses
-    response_list.append(list_reply_data)
+    # Render the prebuilt styles menu for the recipient
+    response_list.append(index.menus[(STYLES, text)].render(number, messageId))
 
     # Return the updated list of responses
     return response_list
 
 
+@metrics.timed("handle_style_selfie")
 def handle_style_selfie(
     text: str,
     number: str,
@@ -1941,13 +2388,14 @@ def handle_style_selfie(
     return response_list
 
 
+@metrics.timed("handle_plus_color_options")
 def handle_plus_color_options(
     text: str,
     number: str,
     messageId: str,
     response_list: List[str],
     last_vto_type: Dict[str, List[str]],
-    feats: Dict[str, Dict[str, str]],
+    index: CatalogIndex,
 ) -> List[str]:
     """
     This function handles the case where the user wants to try on a virtual lipstick, lip liner or hair color option and generates the appropriate responses.
@@ -1958,7 +2406,7 @@ def handle_plus_color_options(
     messageId (str): The ID of the message.
     response_list (List[str]): A list of responses to be sent.
     last_vto_type (Dict[str, List[str]]): A dictionary that stores the last VTO type for each number.
-    feats (Dict[str, Dict[str, str]]): A dictionary that stores the features for each text.
+    index (CatalogIndex): The snapshot of the try-on catalog.
 
     Returns:
     List[str]: The updated list of responses.
@@ -1966,30 +2414,24 @@ def handle_plus_color_options(
     # Add the text to the last VTO type for the given number
     last_vto_type.setdefault(number, []).append(text)
 
-    # Define the body, footer, and options of the message
-    body = "Envision yourself in a boutique of beauty, surrounded by the finest brands, each offering a delightful selection to satisfy your style cravings. Which one captures your heart and transports you to a realm of fashion enchantment? 🍭👗✨"
-    footer = "Aiysha from yShade"
-    options = [name.title() for name in feats[text].keys()]
+    # Wake the try-on edge while the user picks a brand and shade
+    keep_warm.prewarm(settings.current.vto_edges.get(text))
 
-    # Create a list reply message
-    list_reply_data = list_reply_message(
-        number, options, body, footer, "vto_opt_1", messageId
-    )
-
-    # Add the list reply message to the list of responses
-    response_list.append(list_reply_data)
+    # Render the prebuilt brands menu for the recipient
+    response_list.append(index.menus[(BRANDS, text)].render(number, messageId))
 
     # Return the updated list of responses
     return response_list
 
 
+@metrics.timed("handle_vto_options")
 def handle_vto_options(
     text: str,
     number: str,
     messageId: str,
     response_list: List[str],
     last_vto_type: Dict[str, List[str]],
-    feats: Dict[str, Dict[str, Dict[str, str]]],
+    index: CatalogIndex,
 ) -> List[str]:
     """
     This function handles the case where the user wants to try on a virtual option and generates the appropriate responses.
@@ -2000,51 +2442,73 @@ def handle_vto_options(
     messageId (str): The ID of the message.
     response_list (List[str]): A list of responses to be sent.
     last_vto_type (Dict[str, List[str]]): A dictionary that stores the last VTO type for each number.
-    feats (Dict[str, Dict[str, Dict[str, str]]]): A dictionary that stores the features for each text.
+    index (CatalogIndex): The snapshot of the try-on catalog.
 
     Returns:
     List[str]: The updated list of responses.
     """
-    # Add the text to the last VTO type for the given number
-    last_vto_type[number].append(text)
-
-    # Define the body, footer, and options of the message
-    body = "Selecting the perfect shade is akin to donning a superhero’s cape—each color holds its own power and story. So, which hue will be your superpower today? Will it be a bold, confident red or perhaps a mysterious, deep blue? Let’s find the color that makes you feel invincible! 🦸‍♂️🌈"
-    footer = "Aiysha from yShade"
-    options = [key.title() for key in feats[last_vto_type[number][0]][text].keys()]
+    # Add the brand the text refers to to the last VTO type for the given number
+    category = last_vto_type[number][0]
+    brand = index.find(BRANDS, category, text)
+    last_vto_type[number].append(brand.name)
 
-    # Create a list reply message
-    list_reply_data = list_reply_message(
-        number, options, body, footer, "vto_opt_2", messageId
-    )
-
-    # Add the list reply message to the list of responses
-    response_list.append(list_reply_data)
+    # Render the prebuilt shades menu of the brand for the recipient
+    response_list.append(index.menus[(SHADES, (category, brand.name))].render(number, messageId))
 
     # Return the updated list of responses
     return response_list
 
 
+@metrics.timed("handle_vto_selfie")
 def handle_vto_selfie(
     text: str,
     number: str,
+    messageId: str,
+    numberId: str,
     response_list: List[str],
     last_vto_type: Dict[str, List[str]],
+    index: CatalogIndex,
 ) -> List[str]:
     """
     This function handles the case where the user is asked to take a selfie for a virtual try-on (VTO) and generates the appropriate responses.
+    If the chosen shade was already rendered from the user's latest selfie, the cached image is sent instead.
 
     Parameters:
     text (str): The input text.
     number (str): The phone number of the recipient.
+    messageId (str): The ID of the message.
+    numberId (str): The ID of the number.
     response_list (List[str]): A list of responses to be sent.
     last_vto_type (Dict[str, List[str]]): A dictionary that stores the last VTO type for each number.
+    index (CatalogIndex): The snapshot of the try-on catalog.
 
     Returns:
     List[str]: The updated list of responses.
     """
-    # Add the text to the last VTO type for the given number
-    last_vto_type[number].append(text)
+    # Add the shade the text refers to to the last VTO type for the given number
+    top_level_option, company_name = last_vto_type[number][-2:]
+    shade = index.find(SHADES, (top_level_option, company_name), text)
+    last_vto_type[number].append(shade.name if shade is not None else text)
+
+    # Look for a render of the chosen shade from the user's latest selfie
+    hex_color_code = shade.code if shade is not None else None
+    cached_file = render_cache.get(
+        number, settings.current.vto_edges.get(top_level_option, ""), hex_color_code
+    )
+
+    # If the shade was already rendered, send it right away
+    if cached_file is not None:
+        # Upload the cached VTO image
+        vto_file = upload_media(cached_file, numberId)
+
+        # Send the VTO image and a follow-up message
+        response_list.append(image_message(number, vto_file))
+        response_list.append(follow_up(number, messageId))
+
+        # The try-on is complete, so forget the last VTO type for the given number
+        del last_vto_type[number]
+
+        return response_list
 
     # Generate a request for a selfie
     selfie_request = ask_for_selfie(number)
@@ -2068,7 +2532,7 @@ def get_variables():
     Note: The actual definitions of 'last_vto_type', 'recs_data', and 'feats' should be present in the scope where this function is defined.
     """
     # Returning the variables 'last_vto_type', 'recs_data', and 'feats'
-    return last_vto_type, recs_data, feats
+    return last_vto_type, recs_data, catalog.index.feats
 
 
 def is_greeting(text):
@@ -2080,19 +2544,16 @@ def is_matching_keyword(keyword, text, stripped_text):
 
 
 def is_special_condition(keyword, text, number):
+    index = catalog.index
     if keyword == "digit text":
         return text.isdigit()
     elif keyword == "company names":
         return any(option in text for option in recs_data["company_names"])
     elif keyword == "vto options":
-        return any(option in text for option in feats[last_vto_type[number][0]].keys())
+        return index.find(BRANDS, last_vto_type[number][0], text) is not None
     elif keyword == "vto selfie":
-        return any(
-            option in text
-            for option in feats[last_vto_type[number][0]][
-                last_vto_type[number][-1]
-            ].keys()
-        )
+        menu = (last_vto_type[number][0], last_vto_type[number][-1])
+        return index.find(SHADES, menu, text) is not None
     return False
 
 
@@ -2115,7 +2576,139 @@ last_hair_type = {}
 # A dictionary to store the company names and products for each number
 recs_data = {"company_names": [], "company_products": {}}
 
+# The layout of recommendation PDFs, with its fonts and styles loaded once, by the first PDF or the warm-up
+recommendations_pdf = RecommendationsPdf(
+    spool_max_size=config.getint("pdf", "spool_max_bytes", fallback=1024 * 1024)
+)
+
+# A cache of recommendation PDFs, keyed by the products they list
+pdf_cache = PdfCache(max_entries=config.getint("pdf", "cache_max_entries", fallback=128))
+
+# A cache of VTO renders from each user's latest selfie
+render_cache = RenderCache(
+    max_entries=config.getint("prefetch", "cache_max_entries", fallback=256),
+    ttl=config.getfloat("prefetch", "cache_ttl_seconds", fallback=900.0),
+)
+
+# A background prefetcher that renders the other shades of a brand into the cache
+prefetcher = Prefetcher(
+    prefetch_vto_image,
+    render_cache,
+    max_workers=config.getint("prefetch", "max_workers", fallback=2),
+    per_user_limit=config.getint("prefetch", "per_user_limit", fallback=2),
+    budget=config.getint("prefetch", "budget", fallback=4),
+    max_pending=config.getint("prefetch", "max_pending", fallback=32),
+)
+
+# Define the handlers for different types of user inputs
+handlers = {
+    "greetings": handle_greetings,
+    "product recs": handle_product_recs,
+    "face": handle_face,
+    "cheeks": handle_cheeks,
+    "body": handle_body,
+    "try-on": handle_vto,
+    "hair": handle_hair,
+    "lips": handle_lips,
+    "style try-on": handle_style_try_on,
+    "yes, please.": handle_yes_please,
+    "no, thanks.": handle_no_thanks,
+    "foundation": handle_recs_selfie,
+    "skin tint": handle_recs_selfie,
+    "concealer": handle_recs_selfie,
+    "setting powder": handle_recs_selfie,
+    "contour": handle_recs_selfie,
+    "bronzer": handle_recs_selfie,
+    "shapewear": handle_recs_selfie,
+    "nude shoes": handle_recs_selfie,
+    "color try-on": handle_plus_color_options,
+    "lip stick try-on": handle_plus_color_options,
+    "lip liner try-on": handle_plus_color_options,
+    "box braids": handle_style_selfie,
+    "kinky twist": handle_style_selfie,
+    "lemonade braids": handle_style_selfie,
+    "bantu knots": handle_style_selfie,
+    "wavy bob": handle_style_selfie,
+    "high top fade": handle_style_selfie,
+    "buzz cut": handle_style_selfie,
+    "twist out": handle_style_selfie,
+    "wash n go": handle_style_selfie,
+    "pixie cut": handle_style_selfie,
+    "digit text": handle_digit_text,
+    "company names": handle_company_names,
+    "vto options": handle_vto_options,
+    "vto selfie": handle_vto_selfie,
+}
+
+# The keywords that are conditions rather than replies
+special_keywords = ("digit text", "company names", "vto options", "vto selfie")
+
+# The replies a typo can be corrected to, besides the catalog: the handler keywords and the greetings
+option_phrases = [
+    keyword for keyword in handlers if keyword not in special_keywords
+] + sorted(greetings)
+
+# A matcher over the option phrases, built once
+option_matcher = Matcher(option_phrases)
+
+
+def correct_text(
+    text: str, stripped_text: str, number: str, index: CatalogIndex
+) -> Optional[Tuple[float, str]]:
+    """
+    This function finds the option a mistyped reply most likely meant: a brand or shade of the menu the user is in,
+    a handler keyword or a greeting. Replies that already route as typed are left alone.
+
+    Parameters:
+    text (str): The lower-cased text of the reply. Emojis are ignored when matching it.
+    stripped_text (str): The text of the reply without its leading emoji.
+    number (str): The phone number of the sender.
+    index (CatalogIndex): The snapshot of the try-on catalog.
 
+    Returns:
+    Optional[Tuple[float, str]]: The score and the option the reply meant, or None if it routes as typed or no option
+    is close enough.
+    """
+    # Leave digits, keywords, greetings and company names alone
+    if not text or text.isdigit() or text in handlers or stripped_text in handlers:
+        return None
+    if any(greeting in text for greeting in greetings):
+        return None
+    if text == compare_shades_option or any(
+        option in text for option in recs_data["company_names"]
+    ):
+        return None
+
+    # Get how close a match must be
+    min_score = settings.current.matching_min_score
+
+    # Match the brands or shades of the menu the user is in
+    candidates = []
+    state = last_vto_type.get(number, [])
+    if len(state) == 1:
+        if index.find(BRANDS, state[0], text) is not None:
+            return None
+        candidates = index.fuzzy(BRANDS, text, key=state[0], limit=8, min_score=min_score)
+    elif len(state) >= 2:
+        if index.find(SHADES, (state[0], state[-1]), text) is not None:
+            return None
+        candidates = index.fuzzy(
+            SHADES, text, key=(state[0], state[-1]), limit=8, min_score=min_score
+        )
+    catalog_match = best_match((score, entry.name) for score, entry in candidates)
+
+    # Match the keywords and greetings
+    keyword_match = option_matcher.match(text, min_score)
+    if catalog_match is None or keyword_match is None:
+        return catalog_match or keyword_match
+
+    # Keep the option of the menu the user is in, unless a keyword is strictly closer; as close means ambiguous
+    if abs(catalog_match[0] - keyword_match[0]) < 1e-9:
+        return None if catalog_match[1] != keyword_match[1] else catalog_match
+    return keyword_match if keyword_match[0] > catalog_match[0] else catalog_match
+
+
+@metrics.timed("manage_chatbot")
 def manage_chatbot(
     text: str,
     number: str,
@@ -2142,15 +2735,31 @@ def manage_chatbot(
     Returns:
     None
     """
+    # Start timing the routing of the reply
+    route_start = time.perf_counter()
+
     # Convert the text to lower case
     text = text.lower()
     
-    logging.info('LOWER TEXT >>>>> {}'.format(text))
+    logging.debug("LOWER TEXT >>>>> %s", text)
 
     # Remove emojis and strip the text
     stripped_text = remove_emoji_and_strip(text)
     
-    logging.info('STRIPPED TEXT >>>>> {}'.format(stripped_text))
+    logging.debug("STRIPPED TEXT >>>>> %s", stripped_text)
+
+    # Take one snapshot of the try-on catalog for the whole message
+    index = catalog.index
+
+    # If the reply is a typo of an option, route it as the option
+    correction = correct_text(text, stripped_text, number, index) if settings.current.matching_enabled else None
+    if correction is not None:
+        logging.info("CORRECTED TEXT >>>>> %s (%.2f)", correction[1], correction[0])
+        tracer.current().tag("corrected", correction[1])
+        text = stripped_text = correction[1]
+
+    # Record how long normalizing and correcting the reply took, before it is handed to a handler
+    metrics.observe("route", time.perf_counter() - route_start)
 
     # Initialize the list of responses
     response_list = []
@@ -2163,53 +2772,13 @@ def manage_chatbot(
     temp_image_file = None
     temp_doc_file = None
 
-    # Mark the message as read
-    mark_read = mark_read_message(messageId)
-    response_list.append(mark_read)
-
-    # Define the handlers for different types of user inputs
-    handlers = {
-        "greetings": handle_greetings,
-        "product recs": handle_product_recs,
-        "face": handle_face,
-        "cheeks": handle_cheeks,
-        "body": handle_body,
-        "try-on": handle_vto,
-        "hair": handle_hair,
-        "lips": handle_lips,
-        "style try-on": handle_style_try_on,
-        "yes, please.": handle_yes_please,
-        "no, thanks.": handle_no_thanks,
-        "foundation": handle_recs_selfie,
-        "skin tint": handle_recs_selfie,
-        "concealer": handle_recs_selfie,
-        "setting powder": handle_recs_selfie,
-        "contour": handle_recs_selfie,
-        "bronzer": handle_recs_selfie,
-        "shapewear": handle_recs_selfie,
-        "nude shoes": handle_recs_selfie,
-        "color try-on": handle_plus_color_options,
-        "lip stick try-on": handle_plus_color_options,
-        "lip liner try-on": handle_plus_color_options,
-        "box braids": handle_style_selfie,
-        "kinky twist": handle_style_selfie,
-        "lemonade braids": handle_style_selfie,
-        "bantu knots": handle_style_selfie,
-        "wavy bob": handle_style_selfie,
-        "high top fade": handle_style_selfie,
-        "buzz cut": handle_style_selfie,
-        "twist out": handle_style_selfie,
-        "wash n go": handle_style_selfie,
-        "pixie cut": handle_style_selfie,
-        "digit text": handle_digit_text,
-        "company names": handle_company_names,
-        "vto options": handle_vto_options,
-        "vto selfie": handle_vto_selfie,
-    }
+    # Mark the message as read in the background, after the replies
+    receipts.mark(number, messageId, numberId)
+
 
     params = {
-        handle_style_try_on: [last_hair_type, feats],
-        handle_plus_color_options: [last_vto_type, feats],
+        handle_style_try_on: [last_hair_type, index],
+        handle_plus_color_options: [last_vto_type, index],
         handle_recs_selfie: [last_rec_type],
         handle_style_selfie: [last_hair_type],
     }
@@ -2239,10 +2808,9 @@ def manage_chatbot(
 
     # For each keyword and handler in the handlers
     for keyword, handler in handlers.items():
-        logging.info('INSIDE THE FLOW...')
         # If the keyword is "greetings" and the text is a greeting
         if keyword == "greetings" and any(greeting in text for greeting in greetings):
-            logging.info('GREETINGS TRUE!')
+            logging.debug("GREETINGS TRUE!")
             response_list = handler(text, number, messageId, response_list)
 
         # If the keyword is the stripped text
@@ -2258,28 +2826,50 @@ def manage_chatbot(
 
         # If the keyword is "digit text" and the text is a digit
         elif keyword == "digit text" and text.isdigit():
-            response_list = handler(text, number, messageId, numberId, response_list)
+            response_list = handler(
+                text,
+                number,
+                messageId,
+                numberId,
+                response_list,
+                last_rec_type,
+                last_vto_type,
+                last_hair_type,
+            )
 
         # If the keyword is "company names" and the text is a company name
         elif keyword == "company names" and any(
             option in text for option in recs_data["company_names"]
         ):
-            response_list = handler(text, number, messageId, name, response_list)
+            response_list = handler(
+                text, number, messageId, name, response_list, recs_data, numberId
+            )
 
         # If the keyword is "vto options" and the text is a VTO option
-        elif keyword == "vto options" and any(
-            option in text for option in feats[last_vto_type[number][0]].keys()
+        elif (
+            keyword == "vto options"
+            and number in last_vto_type
+            and index.find(BRANDS, last_vto_type[number][0], text) is not None
         ):
-            response_list = handler(text, number, messageId, response_list)
+            response_list = handler(
+                text, number, messageId, response_list, last_vto_type, index
+            )
 
         # If the keyword is "vto selfie" and the text is a VTO selfie option
-        elif keyword == "vto selfie" and any(
-            option in text
-            for option in feats[last_vto_type[number][0]][
-                last_vto_type[number][-1]
-            ].keys()
+        elif (
+            keyword == "vto selfie"
+            and len(last_vto_type.get(number, [])) >= 2
+            and (
+                text == compare_shades_option
+                or index.find(
+                    SHADES, (last_vto_type[number][0], last_vto_type[number][-1]), text
+                )
+                is not None
+            )
         ):
-            response_list = handler(text, number, response_list)
+            response_list = handler(
+                text, number, messageId, numberId, response_list, last_vto_type, index
+            )
 
         # If none of the above conditions are met, use the "else" handler
         else:
@@ -2296,10 +2886,16 @@ def manage_chatbot(
     #     response_list = res[0]
     #     chat_history = res[1]
 
+    # Skip the responses if the user's customer service window has closed, since WhatsApp would fail them
+    if reengager.is_closed(number):
+        logging.info("Skipping %d responses to a user outside their customer service window", len(response_list))
+        reengager.skip(len(response_list))
+        response_list = []
+
     # For each item in the list of responses, send a WhatsApp message
     for item in response_list:
-        logging.info('ABOUT TO SEND RESPONSE...')
-        send_whatsapp_message(item)
+        logging.debug("ABOUT TO SEND RESPONSE...")
+        send_whatsapp_message(item, number, numberId, INTERACTIVE)
 
     # If the downloaded temporary file exists, remove it
     if downloaded_temp_file is not None and os.path.isfile(downloaded_temp_file.name):
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+# Import necessary libraries
+import os
+import time
+import logging
+import threading
+import configparser
+from types import MappingProxyType
+from typing import Dict, List, Mapping, NamedTuple, Optional
+
+# Set up logging with INFO level
+logging.basicConfig(level=logging.INFO)
+
+# The keys in the [url] section of config.ini of the edge behind each VTO type
+VTO_EDGE_KEYS = {
+    "color try-on": "hair_color_try_on_edge",
+    "lip stick try-on": "lip_stick_try_on_edge",
+    "lip liner try-on": "lip_liner_try_on_edge",
+}
+
+# The keys in the [url] section of config.ini of the edge behind each recommendation type
+RECS_EDGE_KEYS = {
+    "foundation": "foundation_recs_edge",
+    "concealer": "concealer_recs_edge",
+    "setting powder": "setting_powder_recs_edge",
+    "contour": "contour_recs_edge",
+    "bronzer": "bronzer_recs_edge",
+    "shapewear": "shape_wear_recs_edge",
+    "nude shoes": "nude_shoes_recs_edge",
+}
+
+# The keys of config.ini read on every message, from the snapshot; every other key is read once at startup, by the
+# components services.py builds (the edge guard, keep-warm, the outbound scheduler, the reengager, the read receipts,
+# tracing, logging, capture, the caches and the workers), so changing it only takes effect after a restart. The [url]
+# section is read from the snapshot too, but its hosts are also kept warm and exported as gauges, from startup.
+LIVE_KEYS = {
+    ("hedging", "enabled"),
+    ("prefetch", "enabled"),
+    ("matching", "enabled"),
+    ("matching", "min_score"),
+}
+
+
+class Settings(NamedTuple):
+    """
+    This class holds one immutable snapshot of the settings the request paths read: the WhatsApp credentials and URLs
+    from the environment, with the request headers built from them, and the edge URLs and switches from config.ini.
+    """
+
+    # The WhatsApp credentials and URLs, and the headers of JSON and media requests
+    whatsapp_token: str
+    whatsapp_url: str
+    whatsapp_media_url: str
+    whatsapp_number_id: Optional[str]
+    sender_id: str
+    json_headers: Mapping[str, str]
+    auth_headers: Mapping[str, str]
+
+    # The URL of each edge by its key in config.ini, by VTO type and by recommendation type, and its metrics stage by URL
+    edges: Mapping[str, str]
+    vto_edges: Mapping[str, str]
+    recs_edges: Mapping[str, str]
+    edge_stages: Mapping[str, str]
+
+    # The switches read on every message
+    hedging_enabled: bool
+    prefetch_enabled: bool
+    matching_enabled: bool
+    matching_min_score: float
+
+
+def load_settings(config: configparser.ConfigParser, environ: Mapping[str, str] = os.environ) -> Settings:
+    """
+    This function builds a snapshot of the settings from config.ini and the environment.
+
+    Parameters:
+    config (configparser.ConfigParser): The parsed config.ini.
+    environ (Mapping[str, str], optional): The environment variables. Defaults to os.environ.
+
+    Returns:
+    Settings: The snapshot.
+    """
+    # Use the development URL of WhatsApp when Flask runs in development
+    whatsapp_token = environ.get("WHATSAPP_TOKEN", "")
+    whatsapp_url = (
+        environ.get("WHATSAPP_URL_DEV", "")
+        if environ.get("FLASK_ENV") == "development"
+        else environ.get("WHATSAPP_URL_PROD", "")
+    )
+
+    # Build the headers once, read-only so no request can change them for the others
+    auth_headers = {"Authorization": "Bearer " + whatsapp_token}
+    json_headers = dict(auth_headers, **{"Content-Type": "application/json"})
+
+    # Map the edges by key, by VTO type and by recommendation type
+    edges = dict(config["url"]) if config.has_section("url") else {}
+    return Settings(
+        whatsapp_token=whatsapp_token,
+        whatsapp_url=whatsapp_url,
+        whatsapp_media_url=environ.get("WHATSAPP_MEDIA_URL", ""),
+        whatsapp_number_id=environ.get("WHATSAPP_NUMBER_ID"),
+        sender_id=whatsapp_url.rstrip("/").rsplit("/", 2)[-2] if whatsapp_url.count("/") >= 2 else whatsapp_url,
+        json_headers=MappingProxyType(json_headers),
+        auth_headers=MappingProxyType(auth_headers),
+        edges=MappingProxyType(edges),
+        vto_edges=MappingProxyType({option: edges.get(key, "") for option, key in VTO_EDGE_KEYS.items()}),
+        recs_edges=MappingProxyType({option: edges.get(key, "") for option, key in RECS_EDGE_KEYS.items()}),
+        edge_stages=MappingProxyType({url: "edge:" + key.replace("_edge", "") for key, url in edges.items()}),
+        hedging_enabled=config.getboolean("hedging", "enabled", fallback=False),
+        prefetch_enabled=config.getboolean("prefetch", "enabled", fallback=False),
+        matching_enabled=config.getboolean("matching", "enabled", fallback=True),
+        matching_min_score=config.getfloat("matching", "min_score", fallback=0.75),
+    )
+
+
+class SettingsStore:
+    """
+    This class loads the settings into a Settings snapshot and swaps in a new snapshot when config.ini changes, so
+    settings updates do not need a redeploy. Readers take `settings.current` once and use that snapshot for the whole call.
+
+    Only the snapshot is swapped: the components built at startup keep the values they were built with. The sections
+    changed since startup in any key outside LIVE_KEYS are listed in `restart_required` until the app is restarted.
+    """
+
+    def __init__(self, path: str) -> None:
+        # Store the path, then load the settings, keeping the sections they were loaded with at startup
+        self.path = path
+        self._mtime = None
+        self._lock = threading.Lock()
+        self._startup: Optional[Dict[str, Dict[str, str]]] = None
+        self.current: Optional[Settings] = None
+        self.restart_required: List[str] = []
+        self.reload()
+
+    def reload(self) -> bool:
+        """
+        This function reloads the settings if config.ini changed since they were last loaded.
+
+        Returns:
+        bool: True if a new snapshot was swapped in, False otherwise.
+        """
+        with self._lock:
+            mtime = os.stat(self.path).st_mtime_ns
+            if mtime == self._mtime:
+                return False
+
+            # Parse the file, keeping the current snapshot if it cannot be parsed
+            config = configparser.ConfigParser()
+            with open(self.path) as config_file:
+                config.read_file(config_file)
+
+            # Swap the new snapshot in with a single assignment
+            self.current = load_settings(config)
+            self._mtime = mtime
+
+            # List the sections whose changes the components built at startup do not pick up
+            sections = _startup_sections(config)
+            if self._startup is None:
+                self._startup = sections
+            self.restart_required = sorted(
+                section
+                for section in set(sections) | set(self._startup)
+                if sections.get(section) != self._startup.get(section)
+            )
+        if self.restart_required:
+            logging.warning(
+                "Reloaded the settings from {}; changes to {} take effect after a restart".format(
+                    self.path, ", ".join(self.restart_required)
+                )
+            )
+        else:
+            logging.info("Reloaded the settings from {}".format(self.path))
+        return True
+
+    def watch(self, interval: float = 30.0) -> None:
+        """
+        This function checks config.ini for changes indefinitely. It is meant to run in a daemon thread.
+        """
+        while True:
+            time.sleep(interval)
+            try:
+                self.reload()
+            except Exception as e:
+                logging.error(f"Error occurred while reloading the settings: {e}")
+
+
+def _startup_sections(config: configparser.ConfigParser) -> Dict[str, Dict[str, str]]:
+    # Return the keys of every section that are only read at startup
+    return {
+        section: {key: value for key, value in config[section].items() if (section, key) not in LIVE_KEYS}
+        for section in config.sections()
+    }
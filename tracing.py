@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+# Import necessary libraries
+import json
+import time
+import queue
+import random
+import hashlib
+import logging
+import threading
+import contextvars
+from typing import Any, Dict, List, Optional
+import requests
+
+# Set up logging with INFO level
+logging.basicConfig(level=logging.INFO)
+
+# The span the running code belongs to, carried across threads by copying the context into the worker
+_current: "contextvars.ContextVar[Optional[Span]]" = contextvars.ContextVar("span", default=None)
+
+
+def current_trace_id() -> Optional[str]:
+    """
+    This function returns the ID of the trace the running code belongs to.
+
+    Returns:
+    Optional[str]: The trace ID, or None if the running code is not part of a sampled trace.
+    """
+    span = _current.get()
+    return span.trace_id if span is not None else None
+
+
+class NoSpan:
+    """
+    This class stands in for a span when the message is not sampled, so unsampled code pays for a lookup and nothing else.
+    """
+
+    __slots__ = ()
+
+    def __enter__(self) -> "NoSpan":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        return None
+
+    def tag(self, key: str, value: Any) -> None:
+        return None
+
+
+# The stand-in shared by every unsampled span
+NO_SPAN = NoSpan()
+
+
+class Span:
+    """
+    This class times one step of handling a message, as a child of the step that called it.
+    It becomes the current span while its block runs, and is exported when the block exits.
+    """
+
+    __slots__ = ("tracer", "trace_id", "id", "parent_id", "name", "timestamp", "start", "duration", "tags", "_token")
+
+    def __init__(
+        self, tracer: "Tracer", trace_id: str, parent_id: Optional[str], name: str, elapsed: float = 0.0
+    ) -> None:
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.id = "%016x" % random.getrandbits(64)
+        self.parent_id = parent_id
+        self.name = name
+        self.timestamp = time.time() - elapsed
+        self.start = time.perf_counter() - elapsed
+        self.duration = 0.0
+        self.tags: Dict[str, str] = {}
+
+    def __enter__(self) -> "Span":
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.duration = time.perf_counter() - self.start
+        if exc_type is not None:
+            self.tags["error"] = "{}: {}".format(exc_type.__name__, exc_value)
+        _current.reset(self._token)
+        self.tracer.export(self)
+
+    def tag(self, key: str, value: Any) -> None:
+        """
+        This function attaches a detail to the span, such as the handler a reply was routed to.
+        """
+        self.tags[key] = str(value)
+
+    def to_json(self, service_name: str) -> Dict[str, Any]:
+        """
+        This function converts the span to the Zipkin v2 JSON format, with times in microseconds.
+        """
+        span = {
+            "traceId": self.trace_id,
+            "id": self.id,
+            "name": self.name,
+            "timestamp": int(self.timestamp * 1e6),
+            "duration": max(1, int(self.duration * 1e6)),
+            "localEndpoint": {"serviceName": service_name},
+            "tags": self.tags,
+        }
+        if self.parent_id is not None:
+            span["parentId"] = self.parent_id
+        return span
+
+
+class Tracer:
+    """
+    This class traces messages through the pipeline, one trace per WhatsApp message, and exports the finished spans.
+
+    The trace ID is derived from the message ID, so a message is sampled or not as a whole, and redeliveries of the
+    same message land in the same trace. Spans are opened as children of the current span, which follows the code
+    through function calls and, when the context is copied into them, worker threads. Finished spans are queued and
+    written by a background thread as JSON lines in the Zipkin v2 format, to a file and, if one is configured, to a
+    collector, so exporting never blocks a message. Spans are dropped when the queue is full.
+    """
+
+    def __init__(
+        self,
+        service_name: str = "aiysha",
+        sample_rate: float = 0.01,
+        path: Optional[str] = None,
+        collector_url: Optional[str] = None,
+        batch_size: int = 100,
+        flush_interval: float = 5.0,
+        max_queue: int = 10000,
+    ) -> None:
+        """
+        Parameters:
+        service_name (str, optional): The name of the service in the exported spans. Defaults to "aiysha".
+        sample_rate (float, optional): The share of messages traced, between 0 and 1. Defaults to 0.01.
+        path (Optional[str], optional): The file the spans are appended to. Defaults to None.
+        collector_url (Optional[str], optional): The Zipkin-compatible URL the spans are posted to. Defaults to None.
+        batch_size (int, optional): The maximum number of spans written at once. Defaults to 100.
+        flush_interval (float, optional): How long spans wait for a batch to fill, in seconds. Defaults to 5.
+        max_queue (int, optional): The maximum number of spans waiting to be exported. Defaults to 10000.
+        """
+        # Store the settings of the tracer
+        self.service_name = service_name
+        self.sample_rate = sample_rate
+        self.path = path
+        self.collector_url = collector_url
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+
+        # Queue the finished spans for the exporter thread, which starts with the first span
+        self._queue: "queue.Queue[Span]" = queue.Queue()
+        self._exporter = None
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def sampled(self, trace_id: str) -> bool:
+        """
+        This function decides whether a trace is recorded, from the first 32 bits of its ID.
+        """
+        return int(trace_id[:8], 16) < self.sample_rate * 2**32
+
+    def trace(self, name: str, message_id: Optional[str], elapsed: float = 0.0) -> Any:
+        """
+        This function starts the trace of a message, as a root span to run the handling of the message in.
+
+        Parameters:
+        name (str): The name of the root span.
+        message_id (Optional[str]): The WhatsApp ID of the message.
+        elapsed (float, optional): How long ago the message arrived, in seconds, to backdate the root span. Defaults to 0.
+
+        Returns:
+        Any: The root span, or a stand-in if the message has no ID or is not sampled.
+        """
+        if not message_id or self.sample_rate <= 0:
+            return NO_SPAN
+        trace_id = hashlib.sha256(message_id.encode("utf-8")).hexdigest()[:32]
+        if not self.sampled(trace_id):
+            return NO_SPAN
+        span = Span(self, trace_id, None, name, elapsed)
+        span.tags["message_id"] = message_id
+        return span
+
+    def span(self, name: str, elapsed: float = 0.0) -> Any:
+        """
+        This function opens a span as a child of the current one.
+
+        Parameters:
+        name (str): The name of the span.
+        elapsed (float, optional): How long ago the step started, in seconds, to backdate the span. Defaults to 0.
+
+        Returns:
+        Any: The span, or a stand-in if the running code is not part of a sampled trace.
+        """
+        parent = _current.get()
+        if parent is None:
+            return NO_SPAN
+        return Span(self, parent.trace_id, parent.id, name, elapsed)
+
+    def current(self) -> Any:
+        """
+        This function returns the current span, or a stand-in if the running code is not part of a sampled trace.
+        """
+        return _current.get() or NO_SPAN
+
+    def export(self, span: Span) -> None:
+        """
+        This function queues a finished span for the exporter thread.
+        """
+        if self._queue.qsize() >= self.max_queue:
+            self.dropped += 1
+            return
+        self._queue.put(span)
+
+        # Start the exporter thread with the first span
+        if self._exporter is None:
+            with self._lock:
+                if self._exporter is None:
+                    self._exporter = threading.Thread(target=self.run, name="tracing", daemon=True)
+                    self._exporter.start()
+
+    def run(self) -> None:
+        """
+        This function exports the finished spans in batches, indefinitely.
+        """
+        while True:
+            # Wait for a span, then for the rest of its batch up to the flush interval
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            self.write([span.to_json(self.service_name) for span in batch])
+            for _ in batch:
+                self._queue.task_done()
+
+    def flush(self) -> None:
+        """
+        This function waits until every queued span has been exported.
+        """
+        self._queue.join()
+
+    def write(self, spans: List[Dict[str, Any]]) -> None:
+        """
+        This function writes a batch of spans to the file and the collector, logging rather than raising errors.
+        """
+        if self.path:
+            try:
+                with open(self.path, "a") as trace_file:
+                    trace_file.write("".join(json.dumps(span) + "\n" for span in spans))
+            except OSError as e:
+                logging.error(f"Error occurred while writing traces: {e}")
+        if self.collector_url:
+            try:
+                requests.post(self.collector_url, json=spans, timeout=5).raise_for_status()
+            except requests.exceptions.RequestException as e:
+                logging.error(f"Error occurred while posting traces: {e}")
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+# Import necessary libraries
+import time
+import logging
+import threading
+from urllib.parse import urlsplit
+from typing import Dict, Iterable, Optional, Any
+import requests
+
+# Set up logging with INFO level
+logging.basicConfig(level=logging.INFO)
+
+
+class HostState:
+    """
+    This class holds the traffic, ping times and latencies of one edge host.
+    """
+
+    __slots__ = (
+        "url",
+        "last_traffic",
+        "last_ping",
+        "pinging",
+        "pings",
+        "cold_starts",
+        "last_latency",
+        "warm_latency",
+        "cold_start_latency",
+    )
+
+    def __init__(self, url: str) -> None:
+        self.url = url
+
+        # Start as never seen: time.monotonic() counts from boot, so 0 would look recent on a fresh instance
+        self.last_traffic = float("-inf")
+        self.last_ping = float("-inf")
+        self.pinging = False
+        self.pings = 0
+        self.cold_starts = 0
+        self.last_latency = None
+        self.warm_latency = None
+        self.cold_start_latency = None
+
+
+class KeepWarm:
+    """
+    This class keeps the Heroku apps behind the edges awake while users are around, so they do not wait for a dyno cold start.
+
+    Each app is pinged when it has seen traffic within the idle window but no call within the active interval, so pings stop
+    when the bot is quiet and are not needed while real calls keep the app awake. Entering a flow pre-warms the edge it will use.
+    Pings slower than the cold-start threshold are counted as cold starts and their latency is tracked per host.
+    """
+
+    def __init__(
+        self,
+        urls: Iterable[str],
+        active_interval: float = 1200.0,
+        idle_after: float = 7200.0,
+        prewarm_interval: float = 300.0,
+        cold_threshold: float = 5.0,
+        check_interval: float = 60.0,
+        timeout: float = 60.0,
+    ) -> None:
+        # Store the schedule settings
+        self.active_interval = active_interval
+        self.idle_after = idle_after
+        self.prewarm_interval = prewarm_interval
+        self.cold_threshold = cold_threshold
+        self.check_interval = check_interval
+        self.timeout = timeout
+
+        # Track one state per host, since several edges can share a Heroku app
+        self._hosts = {}
+        for url in urls:
+            host = urlsplit(url).netloc
+            if host and host not in self._hosts:
+                self._hosts[host] = HostState(url)
+        self._lock = threading.Lock()
+
+    def _host(self, url: Optional[str]) -> Optional[HostState]:
+        # Find the state of the host of a URL, if it is a known edge
+        if not url:
+            return None
+        return self._hosts.get(urlsplit(url).netloc)
+
+    def touch(self, url: Optional[str]) -> None:
+        """
+        This function records traffic to the host of an edge URL.
+        """
+        state = self._host(url)
+        if state is not None:
+            state.last_traffic = time.monotonic()
+
+    def prewarm(self, url: Optional[str]) -> None:
+        """
+        This function records traffic to the host of an edge URL and pings it in the background if it was not pinged recently.
+        It is called as soon as a user enters a flow that will call the edge, before their selfie arrives.
+        """
+        state = self._host(url)
+        if state is None:
+            return
+        state.last_traffic = time.monotonic()
+        if time.monotonic() - state.last_ping >= self.prewarm_interval:
+            self._ping_async(state)
+
+    def _ping_async(self, state: HostState) -> None:
+        # Ping the host in a daemon thread, unless a ping is already on its way
+        with self._lock:
+            if state.pinging:
+                return
+            state.pinging = True
+        threading.Thread(target=self._ping, args=(state,), daemon=True).start()
+
+    def _ping(self, state: HostState) -> None:
+        try:
+            # Any HTTP response means the dyno is awake, so the status code is not checked
+            start = time.monotonic()
+            requests.get(state.url, timeout=(3.05, self.timeout)).close()
+            latency = time.monotonic() - start
+
+            # Record the latency, separating cold starts from warm pings
+            state.pings += 1
+            state.last_latency = latency
+            if latency >= self.cold_threshold:
+                state.cold_starts += 1
+                state.cold_start_latency = latency
+                logging.info(
+                    "Edge {} woke from a cold start in {:.1f}s".format(state.url, latency)
+                )
+            elif state.warm_latency is None:
+                state.warm_latency = latency
+            else:
+                state.warm_latency = 0.8 * state.warm_latency + 0.2 * latency
+        except requests.exceptions.RequestException as e:
+            # Log the error, the next check will try again
+            logging.error(f"Keep-warm ping to {state.url} failed: {e}")
+        finally:
+            state.last_ping = time.monotonic()
+            state.pinging = False
+
+    def run(self) -> None:
+        """
+        This function pings the hosts that need it, indefinitely. It is meant to run in a daemon thread.
+        """
+        while True:
+            now = time.monotonic()
+            for state in self._hosts.values():
+                # Leave the host alone if it has been idle or never had traffic, or a call or ping kept it awake recently
+                if now - state.last_traffic >= self.idle_after:
+                    continue
+                if now - max(state.last_traffic, state.last_ping) < self.active_interval:
+                    continue
+                self._ping_async(state)
+            time.sleep(self.check_interval)
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """
+        This function returns the ping counts and latencies of every host.
+
+        Returns:
+        Dict[str, Dict[str, Any]]: A dictionary mapping each host to its ping counts and latencies in seconds.
+        """
+        return {
+            host: {
+                "pings": state.pings,
+                "cold_starts": state.cold_starts,
+                "last_latency": state.last_latency,
+                "warm_latency": state.warm_latency,
+                "cold_start_latency": state.cold_start_latency,
+            }
+            for host, state in self._hosts.items()
+        }